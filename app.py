@@ -1,35 +1,68 @@
 import streamlit as st
 import os
-import base64
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
 import json
 import pandas as pd
 import time
-import mimetypes
 import urllib.parse
-import unicodedata
+import uuid
+import functools
+import hashlib
+import importlib.util
+import datetime
+import itertools
 
-# Intentar importar pywhatkit (solo funciona si la app se ejecuta en una máquina local)
-try:
-    import pywhatkit as pwk
-    HAS_PYWHATKIT = True
-except Exception:
-    HAS_PYWHATKIT = False
+from correo.attachments import (
+    INLINE_LIMIT, MAX_MESSAGE_BYTES, BodyWithAttachments, dedupe_attachments, estimated_size, precompile_attachments
+)
+from correo.campaign import (
+    backend_results, campaign_items, campaign_results, closing_results, safe_format, spooled_results
+)
+from correo.clients import GmailClientPool, refresh_if_needed
+from correo.documents import DOCUMENT_TYPES, TEXT_TYPES, DocumentTemplate
+from correo.gmail import MAX_BATCH_SIZE, can_draft
+from correo.inbox_cache import MailboxCache, sync_mailbox
+from correo.jobs import Job, JobRunner
+from correo.journal import SendJournal, campaign_id
+from correo.memory import MB, SESSION_BUDGET_MB, SESSION_TTL_MINUTES, TOTAL_BUDGET_MB, MemoryBudget
+from correo.metrics import STAGE_LABELS, STAGES, metrics_json, prometheus_text, start_metrics_server
+from correo.loader import (
+    CONTACT_FILE_TYPES, buffer_of, canonicalize_columns, count_rows, iter_contact_batches, read_contacts, read_page,
+    read_preview
+)
+from correo.ratelimit import GMAIL_USER_UNITS_PER_SEC, QUOTA_UNITS, gmail_limiter
+from correo.render import TemplateError, compile_template, render_campaign, render_template, template_columns
+from correo.validation import ContactValidator, SuppressionList
+from correo.whatsapp import links_html, links_page, search_links, wa_links
+# Igual que en la CLI, los módulos que cargan dependencias pesadas (requests, la
+# autenticación de cuentas de servicio, cryptography) se importan donde se usan:
+# correo.accounts, correo.backends, correo.scheduler, correo.spool y correo.wa_mock.
+
+# ¿Está instalado pywhatkit? (solo funciona si la app se ejecuta en una máquina local).
+# No se importa aquí: arrastra la automatización del navegador y del escritorio
+# y solo se carga al enviar por pywhatkit.
+HAS_PYWHATKIT = importlib.util.find_spec('pywhatkit') is not None
 
 # Configuración de la página
 st.set_page_config(page_title="Gmail API App", page_icon="📧")
 
 st.title("📧 Aplicación de Gmail")
 
-# Scopes necesarios para Gmail
+# Cada cuántos segundos se refresca el estado de los envíos en segundo plano
+JOB_POLL_SECONDS = 2
+
+# Filas por página en la vista previa de contactos
+PREVIEW_ROWS = 200
+
+# Archivos subidos que se mantienen en caché (y por cuántos segundos)
+UPLOAD_CACHE_ENTRIES = 8
+UPLOAD_CACHE_TTL = 3600
+
+# Scopes necesarios para Gmail (compose: preparar campañas como borradores)
 SCOPES = ['https://www.googleapis.com/auth/gmail.send',
-          'https://www.googleapis.com/auth/gmail.readonly']
+          'https://www.googleapis.com/auth/gmail.readonly',
+          'https://www.googleapis.com/auth/gmail.compose']
 
 # Función para crear el flujo de autenticación
 def get_flow():
@@ -50,133 +83,433 @@ def get_flow():
     )
     return flow
 
-# Función para enviar correo MEJORADA
-def send_email(service, to, subject, body, attachments=None):
-    try:
-        # Crear mensaje
-        message = MIMEMultipart()
-        message['to'] = to
-        message['subject'] = subject
-        
-        # Agregar el cuerpo del mensaje
-        message.attach(MIMEText(body, 'plain', 'utf-8'))
-        
-        # Agregar archivos adjuntos si existen
-        if attachments:
-            for attachment in attachments:
-                filename = attachment['name']
-                content = attachment['content']
-                
-                # Detectar el tipo MIME correcto
-                mime_type, _ = mimetypes.guess_type(filename)
-                if mime_type is None:
-                    mime_type = 'application/octet-stream'
-                
-                # Separar el tipo MIME principal y subtipo
-                maintype, subtype = mime_type.split('/', 1)
-                
-                # Crear la parte del adjunto con el tipo MIME correcto
-                part = MIMEBase(maintype, subtype)
-                part.set_payload(content)
-                encoders.encode_base64(part)
-                
-                # Agregar header con el nombre del archivo
-                part.add_header(
-                    'Content-Disposition',
-                    f'attachment; filename="{filename}"'
-                )
-                message.attach(part)
-        
-        # Codificar el mensaje
-        raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        
-        send_message = service.users().messages().send(
-            userId="me",
-            body={'raw': raw}
-        ).execute()
-        
-        return True, f"Mensaje enviado! ID: {send_message['id']}"
-    except Exception as e:
-        return False, f"Error: {str(e)}"
 
-# Función para listar mensajes
-def list_messages(service, max_results=10):
-    try:
-        results = service.users().messages().list(
-            userId='me',
-            maxResults=max_results
-        ).execute()
-        
-        messages = results.get('messages', [])
-        return messages
-    except Exception as e:
-        st.error(f"Error al listar mensajes: {str(e)}")
-        return []
+# Cerrar la sesión de Google (también para volver a autorizar con más permisos)
+def sign_out():
+    get_client_pool().discard(st.session_state.credentials)
+    st.session_state.credentials = None
+    st.session_state.pop('account_email', None)
+    st.session_state.pop('gmail_service', None)
+    st.rerun()
 
 
-# Helper: formato seguro para plantillas que puede manejar claves faltantes
-def safe_format(template, row):
-    # Proveer valores por defecto (cadena vacía) si alguna clave falta
-    vals = {
-        'Nombre': '',
-        'Celular': '',
-        'email': ''
-    }
-    try:
-        for k in vals.keys():
-            if k in row and pd.notna(row[k]):
-                vals[k] = str(row[k])
-    except Exception:
-        # row puede ser un dict o Series; si falla, seguir con defaults
-        pass
+# Registro de envíos compartido por todas las sesiones del servidor
+@st.cache_resource
+def get_journal():
+    return SendJournal()
+
+
+# Lista de supresión compartida por todas las sesiones
+@st.cache_resource
+def get_suppression_list():
+    return SuppressionList()
+
+
+# Pool de clientes de Gmail por usuario compartido por todas las sesiones
+@st.cache_resource
+def get_client_pool():
+    return GmailClientPool()
+
+
+# Caché local de metadatos del buzón compartida por todas las sesiones
+@st.cache_resource
+def get_mailbox_cache():
+    return MailboxCache()
+
+
+# Ejecutor de envíos en segundo plano compartido por todas las sesiones
+@st.cache_resource
+def get_job_runner():
+    return JobRunner(max_jobs=int(os.environ.get('CORREO_MAX_JOBS', '4')))
+
+
+# Exportar las métricas de los envíos por HTTP (/metrics para Prometheus y
+# /metrics.json) si se configura `metrics_port` en los secretos
+@st.cache_resource
+def get_metrics_server():
+    port = secret('metrics_port')
+    if not port:
+        return None
+    return start_metrics_server(get_job_runner().jobs, host=secret('metrics_host', '127.0.0.1'), port=int(port))
+
+
+# Cuentas remitentes para repartir campañas grandes, una por dueño (la cuenta
+# con la que se inició sesión): nadie ve ni usa las cuentas de otro. Las
+# credenciales se cifran con `credentials_key` de secrets.toml (o CORREO_SECRET_KEY).
+@st.cache_resource
+def get_sender_pool(owner):
+    from correo.accounts import SenderPool
+    from correo.vault import Vault
+
+    return SenderPool(owner, vault=Vault(secret('credentials_key') or None))
+
+
+# Presupuesto de memoria por sesión (MB en secrets.toml: session_memory_mb,
+# memory_mb y session_ttl_minutes): los datos grandes de cada sesión pasan a
+# disco al superarlo y los de sesiones inactivas se liberan
+@st.cache_resource
+def get_memory_budget():
+    return MemoryBudget(
+        session_bytes=float(secret('session_memory_mb', SESSION_BUDGET_MB)) * MB,
+        total_bytes=float(secret('memory_mb', TOTAL_BUDGET_MB)) * MB,
+        ttl=float(secret('session_ttl_minutes', SESSION_TTL_MINUTES)) * 60
+    )
+
+
+# Dato grande de esta sesión bajo el presupuesto de memoria: `load()` solo corre
+# si no está guardado con la misma versión (`tag`, p. ej. la huella del archivo)
+def session_value(key, tag, load):
+    budget = get_memory_budget()
+    entry = budget.get(st.session_state.session_id, key, tag)
+    if entry is None:
+        entry = budget.put(st.session_state.session_id, key, load(), tag)
+    return entry.value()
+
+
+# Cola de campañas programadas: su despachador corre en el servidor aunque
+# nadie tenga la página abierta (también se puede correr aparte con
+# `python -m correo.scheduler`)
+@st.cache_resource
+def get_scheduler():
+    from correo.scheduler import Scheduler
+    from correo.vault import Vault
+
+    scheduler = Scheduler(client_pool=get_client_pool(), vault=Vault(secret('credentials_key') or None))
+    scheduler.start()
+    return scheduler
+
+
+SCHEDULE_ICONS = {
+    'loading': '⏳', 'scheduled': '🗓️', 'running': '📤', 'paused': '⏸️',
+    'done': '✅', 'cancelled': '⏹️', 'failed': '❌'
+}
+
+
+# Administrar las cuentas remitentes del pool: agregar la cuenta conectada,
+# usuarios de una cuenta de servicio con delegación de dominio, o quitarlas
+def show_sender_pool(pool, account):
+    from correo.scheduler import DEFAULT_DAILY_LIMIT
+
+    resumen = pool.summary()
+    if resumen:
+        st.dataframe(pd.DataFrame(resumen), hide_index=True)
+    else:
+        st.caption("Aún no hay cuentas en el pool")
+    limite = st.number_input(
+        "Límite diario por cuenta:", min_value=1, max_value=10000, value=DEFAULT_DAILY_LIMIT, key='pool_limit',
+        help="500 para cuentas personales de Gmail, 2000 para Google Workspace."
+    )
+    if account and st.button(f"➕ Agregar esta cuenta ({account})", key='pool_add_self'):
+        pool.add_oauth(account, st.session_state.credentials.to_json(), daily_limit=limite)
+        st.success(f"Cuenta {account} agregada. Para sumar otra, cierra sesión, entra con ella y agrégala aquí.")
+    clave = st.file_uploader("Clave JSON de una cuenta de servicio (delegación de dominio):", type=['json'], key='pool_sa')
+    usuarios = st.text_area("Correos del dominio que enviarán (uno por línea):", key='pool_sa_users')
+    if clave is not None and st.button("➕ Agregar usuarios de la cuenta de servicio", key='pool_add_sa'):
+        emails = [u.strip() for u in usuarios.splitlines() if u.strip()]
+        try:
+            pool.add_service_account(json.loads(clave.getvalue()), emails, daily_limit=limite)
+            st.success(f"{len(emails)} cuenta(s) agregada(s)")
+        except ValueError as e:
+            st.error(f"No se pudo leer la clave: {e}")
+    if resumen:
+        quitar = st.selectbox("Quitar cuenta:", [r['email'] for r in resumen], key='pool_remove')
+        if st.button("🗑️ Quitar del pool", key='pool_remove_btn'):
+            pool.remove(quitar)
+            st.rerun()
+
+
+# Pintar las campañas programadas de una cuenta con botones para pausarlas o cancelarlas
+def show_scheduled(account):
+    scheduler = get_scheduler()
+    campaigns = scheduler.campaigns(account)
+    if not campaigns:
+        return
+    st.divider()
+    st.subheader("🗓️ Campañas programadas")
+    for camp in campaigns:
+        icon = SCHEDULE_ICONS.get(camp['status'], '')
+        inicio = time.strftime('%Y-%m-%d %H:%M', time.localtime(camp['send_at']))
+        ventana = (f"{camp['window_start']}:00–{camp['window_end']}:00"
+                   if camp['window_start'] is not None else "todo el día")
+        st.write(f"{icon} **{camp['name']}** ({camp['backend']}) — desde {inicio}, {ventana}, "
+                 f"máximo {camp['daily_limit']} por día")
+        sent = camp['sent'] or 0
+        errors = camp['errors'] or 0
+        st.progress((sent + errors) / camp['total'] if camp['total'] else 1.0)
+        st.caption(f"{sent + errors}/{camp['total']} — {sent} enviados, {errors} errores")
+        if camp['prestage'] and camp['status'] in ('scheduled', 'running', 'paused'):
+            st.caption(f"📝 {camp['staged'] or 0} borradores preparados en Gmail")
+        if camp['detail']:
+            with st.expander("Detalle del error"):
+                st.code(camp['detail'])
+        if camp['status'] in ('scheduled', 'running', 'paused'):
+            col_pause, col_cancel = st.columns(2)
+            if camp['status'] == 'paused':
+                if col_pause.button("▶️ Reanudar", key=f"sched_resume_{camp['campaign_id']}"):
+                    scheduler.resume(camp['campaign_id'])
+                    st.rerun()
+            elif col_pause.button("⏸️ Pausar", key=f"sched_pause_{camp['campaign_id']}"):
+                scheduler.pause(camp['campaign_id'])
+                st.rerun()
+            if col_cancel.button("⏹️ Cancelar", key=f"sched_cancel_{camp['campaign_id']}"):
+                scheduler.cancel(camp['campaign_id'])
+                st.rerun()
+
+
+# Pedir fecha, ventana horaria y límite diario de una campaña programada
+def schedule_inputs(key, default_limit=None):
+    from correo.scheduler import DEFAULT_DAILY_LIMIT
 
+    now = datetime.datetime.now()
+    col_date, col_time = st.columns(2)
+    fecha = col_date.date_input("Fecha de inicio:", value=now.date(), key=f"{key}_date")
+    hora = col_time.time_input("Hora de inicio:", value=now.time().replace(second=0, microsecond=0), key=f"{key}_time")
+    ventana = st.slider("Enviar solo entre estas horas:", 0, 24, (9, 18), key=f"{key}_window")
+    limite = st.number_input(
+        "Máximo de mensajes por día:",
+        min_value=1,
+        max_value=10000,
+        value=default_limit or DEFAULT_DAILY_LIMIT,
+        key=f"{key}_limit",
+        help="Gmail permite unos 500 correos diarios en cuentas personales y 2000 en Workspace. "
+             "El envío se reparte en partes iguales por hora dentro de la ventana."
+    )
+    send_at = datetime.datetime.combine(fecha, hora).timestamp()
+    window = None if ventana in ((0, 24), (0, 0)) else (ventana[0], ventana[1] % 24)
+    return send_at, window, limite
+
+
+# Valor de secrets.toml (o el valor por defecto si no existe el archivo o la clave)
+def secret(name, default=''):
     try:
-        return template.format(**vals)
-    except Exception as e:
-        # Re-lanzar para que el caller pueda mostrar un error amigable
-        raise e
-
-
-# Normalizar nombres de columna: quitar acentos, espacios y pasar a minúsculas
-def normalize_colname(name):
-    if not isinstance(name, str):
-        name = str(name)
-    # quitar espacios alrededor
-    s = name.strip().lower()
-    # quitar acentos
-    s = unicodedata.normalize('NFKD', s)
-    s = ''.join(c for c in s if not unicodedata.combining(c))
-    # reemplazar espacios y guiones bajos por nada
-    s = s.replace(' ', '').replace('_', '').replace('-', '')
-    return s
-
-
-def canonicalize_columns(df):
-    # Map columns by substring matching to handle variants like 'número_de_teléfono'
-    rename_map = {}
-    used_targets = set()
-    for col in list(df.columns):
-        norm = normalize_colname(col)
-        target = None
-        if 'nombre' in norm:
-            target = 'Nombre'
-        elif any(k in norm for k in ('correo', 'correoelectronico', 'email', 'mail')):
-            target = 'email'
-        elif any(k in norm for k in ('telefono', 'numerodetelefono', 'numero', 'movil', 'celular')):
-            target = 'Celular'
-
-        if target and target not in used_targets:
-            rename_map[col] = target
-            used_targets.add(target)
-
-    if rename_map:
-        df = df.rename(columns=rename_map)
-    return df
+        return st.secrets.get(name, default)
+    except FileNotFoundError:
+        return default
+
+
+# Servidor local que imita la API de WhatsApp (uno por proceso, para probar sin enviar)
+@st.cache_resource
+def get_wa_mock_server():
+    from correo.wa_mock import start_mock_server
+
+    return start_mock_server()
+
+
+# Opciones del backend de la API de WhatsApp (token e ID del número en secrets.toml).
+# Devuelve None si falta configurarlo.
+def whatsapp_api_options():
+    from correo.backends import WHATSAPP_API_URL, WHATSAPP_RATE
+
+    token = secret('whatsapp_token')
+    usar_prueba = st.checkbox(
+        "🧪 Usar el servidor de prueba local (no envía mensajes reales)",
+        value=not token,
+        key='wa_mock'
+    )
+    col_rate, col_workers = st.columns(2)
+    rate = col_rate.number_input(
+        "Mensajes por segundo:",
+        min_value=1,
+        max_value=1000,
+        value=WHATSAPP_RATE,
+        key='wa_rate',
+        help="La Cloud API admite 80 mensajes por segundo por número (más si Meta lo amplía)."
+    )
+    workers = col_workers.number_input("Peticiones en paralelo:", min_value=1, max_value=64, value=8, key='wa_workers')
+    if usar_prueba:
+        return {'token': 'prueba', 'phone_number_id': 'prueba', 'api_url': get_wa_mock_server().url,
+                'rate': rate, 'workers': workers}
+    phone_number_id = secret('whatsapp_phone_number_id')
+    if not token or not phone_number_id:
+        st.warning("Configura whatsapp_token y whatsapp_phone_number_id en secrets.toml para usar la API")
+        return None
+    return {'token': token, 'phone_number_id': phone_number_id,
+            'api_url': secret('whatsapp_api_url', WHATSAPP_API_URL), 'rate': rate, 'workers': workers}
+
+
+# Leer el contenido de los adjuntos subidos ({'name': ..., 'content': bytes})
+def read_attachments(files):
+    attachments = []
+    for att in files:
+        att.seek(0)  # Ir al inicio del archivo
+        attachments.append({'name': att.name, 'content': att.read()})
+    return attachments
+
+
+JOB_ICONS = {'pending': '⏳', 'running': '📤', 'done': '✅', 'cancelled': '⏹️', 'failed': '❌'}
+
+
+# Pintar el estado de los envíos en segundo plano
+def show_jobs(owner, campaign_id=None):
+    runner = get_job_runner()
+    for job in runner.jobs(owner=owner, campaign_id=campaign_id):
+        snap = job.snapshot()
+        st.write(f"{JOB_ICONS.get(snap['status'], '')} **{snap['name']}** — trabajo #{snap['id']}")
+        st.progress(min(1.0, snap['procesados'] / snap['total']) if snap['total'] else 1.0)
+        st.caption(
+            f"{snap['procesados']}/{snap['total']} — {snap['enviados']} enviados, {snap['errores']} errores, "
+            f"{snap['omitidos']} ya enviados antes, {snap['rechazados']} rechazados "
+            f"— ⚡ {snap['rate']:.1f} mensajes/seg en {snap['elapsed']:.0f} s"
+        )
+        if snap['errors']:
+            with st.expander(f"⚠️ Errores ({snap['errores']})"):
+                for label, msg in snap['errors']:
+                    st.write(f"- {label}: {msg}")
+        if snap['status'] == 'failed':
+            st.error(f"El envío se detuvo: {snap['detail'].splitlines()[0] if snap['detail'] else ''}")
+        if job.active and st.button("⏹️ Cancelar envío", key=f"cancel_job_{snap['id']}"):
+            job.cancel()
+
+
+# Mientras haya envíos activos, refrescar solo este panel cada pocos segundos
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_jobs_live(owner, campaign_id=None):
+    show_jobs(owner, campaign_id)
+    if not any(job.active for job in get_job_runner().jobs(owner=owner, campaign_id=campaign_id)):
+        st.rerun()
+
+
+# Segundos como texto corto para el panel (p. ej. 95 -> "1 min 35 s")
+def format_seconds(seconds):
+    if seconds is None:
+        return "—"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours} h {minutes} min"
+    return f"{minutes} min {seconds} s" if minutes else f"{seconds} s"
+
+
+# Panel de rendimiento de un envío: velocidad, hora estimada de fin,
+# reintentos y en qué etapa se va el tiempo de cada mensaje (solo los envíos de la sesión)
+def show_metrics(owner):
+    jobs = get_job_runner().jobs(owner=owner)
+    if not jobs:
+        st.caption("Sin envíos todavía")
+        return
+    # La etiqueta no cambia con el estado del trabajo (si cambiara, se perdería la selección)
+    by_id = {job.id: job for job in jobs}
+    job = by_id[st.selectbox(
+        "Envío:", list(by_id), format_func=lambda i: f"#{i} {by_id[i].name}", key='metrics_job'
+    )]
+    st.caption(f"{JOB_ICONS.get(job.status, '')} {job.status}")
+    snap = job.metrics_snapshot()
+    col_rate, col_eta = st.columns(2)
+    col_rate.metric("Velocidad", f"{snap['throughput']:.1f}/s")
+    col_eta.metric("Termina en", format_seconds(snap['eta']))
+    st.caption(f"{snap['procesados']}/{snap['total']} procesados — 🔁 {snap['retries']} reintentos")
+    total = sum(h['sum'] for h in snap['stages'].values())
+    st.dataframe(
+        pd.DataFrame([
+            {
+                'Etapa': STAGE_LABELS[stage],
+                'Media (ms)': round(h['mean'] * 1000, 2),
+                'p95 (ms)': round(h['p95'] * 1000, 2),
+                '% del tiempo': round(100 * h['sum'] / total, 1) if total else 0.0,
+            }
+            for stage, h in ((stage, snap['stages'][stage]) for stage in STAGES)
+        ]),
+        hide_index=True
+    )
+    col_json, col_prom = st.columns(2)
+    col_json.download_button(
+        "⬇️ JSON", metrics_json(jobs).encode('utf-8'), file_name="metricas_envio.json", mime="application/json"
+    )
+    col_prom.download_button(
+        "⬇️ Prometheus", prometheus_text(jobs).encode('utf-8'), file_name="metricas_envio.prom", mime="text/plain"
+    )
+
+
+# Mientras haya envíos activos, refrescar el panel cada pocos segundos
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_metrics_live(owner):
+    show_metrics(owner)
+    if not any(job.active for job in get_job_runner().jobs(owner=owner)):
+        st.rerun()
+
+
+# Huella SHA-256 del archivo subido: se calcula una sola vez por subida (file_id)
+def upload_digest(uploaded_file):
+    if 'upload_digests' not in st.session_state:
+        st.session_state.upload_digests = {}
+    digests = st.session_state.upload_digests
+    key = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+    if key not in digests:
+        digests[key] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        # Conservar solo las huellas de las últimas subidas
+        for old_key in list(digests)[:-UPLOAD_CACHE_ENTRIES]:
+            del digests[old_key]
+    return digests[key]
+
+
+# Lecturas de archivos memoizadas por contenido: escribir en una plantilla o mover
+# un control no vuelve a leer el archivo. El archivo (_file) no se hashea: la
+# clave es su huella. Se expulsan por antigüedad (ttl) y por número de entradas.
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL, show_spinner="Leyendo archivo...")
+def load_contacts_preview(digest, filename, _file, n=PREVIEW_ROWS):
+    return read_preview(_file, filename, n), count_rows(_file, filename)
+
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES * 4, ttl=UPLOAD_CACHE_TTL, show_spinner="Leyendo página...")
+def load_contacts_page(digest, filename, _file, page, page_size=PREVIEW_ROWS):
+    return read_page(_file, filename, page, page_size)
+
+
+# Archivo completo (la pestaña de WhatsApp): queda en la sesión, no en la caché
+# compartida, para contarlo en su presupuesto de memoria (y pasarlo a disco)
+def load_contacts(digest, filename, _file, dtype=None):
+    def load():
+        with st.spinner("Leyendo archivo..."):
+            return read_contacts(_file, filename, dtype=dtype)
+    return session_value(('contactos', filename), digest, load)
+
+
+# Plantilla del documento por contacto, analizada una vez por archivo y nombre de salida
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL, show_spinner=False)
+def load_document_template(digest, name, output_name, _content):
+    return DocumentTemplate(name, _content, output_name)
+
+
+# Documento de muestra (el del primer contacto) para descargarlo antes de enviar
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL, show_spinner=False)
+def preview_document(digest, output_name, _template, values):
+    return _template.render(dict(values))
+
+
+# Validar todo el archivo (por lotes) con el mismo índice que usa el envío.
+# `suppression_version` es None si no se usa la lista de supresión.
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL, show_spinner="Validando contactos...")
+def load_validation(digest, filename, _file, columns, suppression_version=None):
+    suppressed = get_suppression_list().contacts('email') if suppression_version is not None else None
+    validator = ContactValidator('email', suppressed)
+    for batch in iter_contact_batches(_file, filename):
+        batch.columns = list(columns)
+        validator.check(batch['email'])
+    return validator.summary(), validator.report_frame()
+
+
+# Administrar la lista de supresión (agregar direcciones o teléfonos a mano)
+def show_suppression_manager(suppression, kind):
+    etiqueta = "direcciones" if kind == 'email' else "teléfonos"
+    with st.expander(f"🚫 Lista de supresión ({len(suppression.contacts(kind))} {etiqueta})"):
+        nuevos = st.text_area(f"Agregar {etiqueta} (uno por línea):", key=f"suppress_new_{kind}")
+        motivo = st.selectbox("Motivo:", ["baja", "rebote", "queja", "otro"], key=f"suppress_reason_{kind}")
+        if st.button("Agregar a la lista de supresión", key=f"suppress_add_{kind}"):
+            agregados = suppression.add(nuevos.splitlines(), kind, motivo)
+            st.success(f"{agregados} {etiqueta} agregados a la lista de supresión")
+        lista = suppression.frame()
+        lista = lista[lista['Tipo'] == kind]
+        if len(lista):
+            st.dataframe(lista, hide_index=True)
 
 # Verificar si hay credenciales guardadas
 if 'credentials' not in st.session_state:
     st.session_state.credentials = None
 
+# Identificador de la sesión (dueña de sus envíos en segundo plano)
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 # Obtener código de la URL si Google redirige de vuelta
 query_params = st.query_params
 auth_code = query_params.get("code", None)
@@ -213,11 +546,24 @@ else:
     st.success("✅ Autenticado correctamente")
     
     if st.button("Cerrar sesión"):
-        st.session_state.credentials = None
-        st.rerun()
+        sign_out()
     
-    # Crear el servicio de Gmail
-    service = build('gmail', 'v1', credentials=st.session_state.credentials)
+    # Cliente de Gmail de la sesión: se toma del pool una vez y se reutiliza en
+    # cada rerun (sin reconstruir el cliente ni abrir otra conexión HTTP)
+    if st.session_state.get('gmail_service') is None:
+        st.session_state.gmail_service = get_client_pool().acquire(st.session_state.credentials)
+    else:
+        refresh_if_needed(st.session_state.credentials)
+    service = st.session_state.gmail_service
+    
+    # La cuenta identifica la caché local y el cupo diario de envíos programados (una llamada por sesión)
+    if 'account_email' not in st.session_state:
+        try:
+            st.session_state.account_email = service.users().getProfile(userId='me').execute()['emailAddress']
+        except Exception as e:
+            st.session_state.account_email = None
+            st.error(f"Error al obtener el perfil de Gmail: {str(e)}")
+    account = st.session_state.account_email
     
     # Tabs para diferentes funcionalidades
     tab1, tab2, tab3 = st.tabs(["📊 Enviar desde Excel", "📬 Ver Emails", "📱 Enviar WhatsApp"])
@@ -237,20 +583,17 @@ else:
             st.info("Tu archivo Excel debe tener estas tres columnas exactamente.")
         
         # Subir archivo
-        uploaded_file = st.file_uploader("Sube tu archivo Excel", type=['xlsx', 'xls'])
+        uploaded_file = st.file_uploader("Sube tu archivo de contactos (Excel, CSV o Parquet)", type=CONTACT_FILE_TYPES)
+        current_campaign = None
         
         if uploaded_file is not None:
             try:
-                # Leer el archivo Excel usando el engine apropiado
+                # Leer solo una muestra: el archivo completo se recorre por lotes al enviar
                 df = None
                 try:
                     filename = getattr(uploaded_file, 'name', '') or ''
-                    if filename.lower().endswith('.xls'):
-                        # .xls necesita xlrd
-                        df = pd.read_excel(uploaded_file, engine='xlrd')
-                    else:
-                        # .xlsx usa openpyxl
-                        df = pd.read_excel(uploaded_file, engine='openpyxl')
+                    digest = upload_digest(uploaded_file)
+                    df, total_contactos = load_contacts_preview(digest, filename, uploaded_file)
                 except Exception as e:
                     err = str(e)
                     if 'xlrd' in err or 'Install xlrd' in err or 'Missing optional dependency' in err:
@@ -285,13 +628,45 @@ else:
                     if not all(col in df.columns for col in required_columns):
                         st.error("Aún faltan columnas requeridas tras el mapeo. Por favor selecciona la columna correcta para 'email'.")
                     else:
-                        st.success(f"✅ Archivo cargado correctamente: {len(df)} contactos encontrados")
+                        st.success(f"✅ Archivo cargado correctamente: {total_contactos} contactos encontrados")
                 else:
-                    st.success(f"✅ Archivo cargado correctamente: {len(df)} contactos encontrados")
+                    st.success(f"✅ Archivo cargado correctamente: {total_contactos} contactos encontrados")
                     
-                    # Mostrar vista previa
+                    # Mostrar vista previa paginada (nunca se envía el archivo completo al navegador)
                     st.write("Vista previa de los contactos:")
-                    st.dataframe(df)
+                    paginas = max(1, -(-total_contactos // PREVIEW_ROWS))
+                    pagina = 1
+                    if paginas > 1:
+                        pagina = st.number_input(f"Página (de {paginas}):", min_value=1, max_value=paginas, value=1)
+                    if pagina == 1:
+                        st.dataframe(df)
+                    else:
+                        page_df = load_contacts_page(digest, filename, uploaded_file, pagina - 1)
+                        page_df.columns = df.columns
+                        st.dataframe(page_df)
+                    
+                    # Validación de contactos antes de gastar cuota
+                    st.subheader("🧹 Validación de contactos")
+                    suppression = get_suppression_list()
+                    use_suppression = st.checkbox("Excluir direcciones de la lista de supresión (rebotes y bajas)", value=True)
+                    resumen_validacion, rechazados_df = load_validation(
+                        digest, filename, uploaded_file, tuple(df.columns),
+                        suppression.version() if use_suppression else None
+                    )
+                    col_ok, col_bad = st.columns(2)
+                    col_ok.metric("✅ Se enviarán", resumen_validacion['valid'])
+                    col_bad.metric("❌ Rechazados", resumen_validacion['rejected'])
+                    if resumen_validacion['rejected']:
+                        st.caption(" · ".join(f"{motivo}: {n}" for motivo, n in resumen_validacion['by_reason'].items()))
+                        with st.expander(f"Ver filas rechazadas ({resumen_validacion['rejected']})"):
+                            st.dataframe(rechazados_df, hide_index=True)
+                            st.download_button(
+                                "⬇️ Descargar rechazados (CSV)",
+                                rechazados_df.to_csv(index=False).encode('utf-8'),
+                                file_name="rechazados.csv",
+                                mime="text/csv"
+                            )
+                    show_suppression_manager(suppression, 'email')
                     
                     st.divider()
                     
@@ -322,150 +697,414 @@ else:
                         accept_multiple_files=True
                     )
                     
+                    # El mismo archivo subido dos veces solo se adjunta una vez
+                    unique_attachments, duplicate_attachments = dedupe_attachments(
+                        uploaded_attachments or [], key=upload_digest
+                    )
+                    attachments_too_big = False
                     if uploaded_attachments:
-                        st.write(f"📎 {len(uploaded_attachments)} archivo(s) adjunto(s):")
-                        for att in uploaded_attachments:
+                        st.write(f"📎 {len(unique_attachments)} archivo(s) adjunto(s):")
+                        for att in unique_attachments:
                             st.write(f"  - {att.name} ({att.size / 1024:.1f} KB)")
+                        for att, original in duplicate_attachments:
+                            st.caption(f"♻️ {att.name} es idéntico a {original.name}: se adjuntará una sola vez")
+                        
+                        # Tamaño codificado en el mensaje (sin leer ni codificar los archivos)
+                        attachments_size = estimated_size(att.size for att in unique_attachments)
+                        if attachments_size > MAX_MESSAGE_BYTES:
+                            attachments_too_big = True
+                            st.error(
+                                f"Los adjuntos ocupan {attachments_size / 1024 / 1024:.1f} MB ya codificados; "
+                                f"Gmail acepta como máximo {MAX_MESSAGE_BYTES / 1024 / 1024:.0f} MB por mensaje"
+                            )
+                        elif attachments_size > INLINE_LIMIT:
+                            st.caption(f"📦 {attachments_size / 1024 / 1024:.1f} MB por mensaje: se subirán por partes (un correo por petición)")
+                    
+                    # Documento generado para cada contacto (en paralelo, por delante del envío)
+                    documents = None
+                    with st.expander("📄 Documento personalizado por contacto (opcional)"):
+                        st.caption(
+                            "Sube un .xlsx con `{Nombre}`, `{Celular}` o `{email}` en sus celdas, o un archivo de "
+                            "texto (.txt, .md, .html, .csv) con esos campos: cada correo lleva su propia copia rellenada."
+                        )
+                        plantilla_doc = st.file_uploader("Plantilla del documento", type=list(DOCUMENT_TYPES), key='doc_template')
+                        if plantilla_doc is not None:
+                            doc_base, _, doc_ext = plantilla_doc.name.rpartition('.')
+                            doc_ext = doc_ext.lower()
+                            como_pdf = doc_ext in TEXT_TYPES and st.checkbox("Convertir a PDF", value=True, key='doc_pdf')
+                            nombre_doc = st.text_input(
+                                "Nombre del archivo adjunto:",
+                                value=f"{doc_base} {{Nombre}}.{'pdf' if como_pdf else doc_ext}"
+                            )
+                            try:
+                                documents = load_document_template(
+                                    upload_digest(plantilla_doc), plantilla_doc.name, nombre_doc, plantilla_doc.getvalue()
+                                )
+                            except Exception as e:
+                                st.error(f"Error en el documento: {e}")
                     
                     # Vista previa del primer correo
+                    preview_doc = None
                     if len(df) > 0:
                         st.subheader("👁️ Vista previa del primer correo")
-                        first_row = df.iloc[0]
-                        # Usar formato seguro: si falta Celular, se deja en blanco
+                        # Mismo renderizado por columnas que el envío: si falta Celular, se deja en blanco
                         try:
-                            preview_subject = safe_format(subject_template, first_row)
-                            preview_message = safe_format(message_template, first_row)
-                        except Exception as e:
+                            first = render_campaign(df.head(1), subject_template, message_template).iloc[0]
+                            preview_to = first['email']
+                            preview_subject = first['asunto']
+                            preview_message = first['mensaje']
+                        except TemplateError as e:
                             st.error(f"Error en la plantilla: {e}. Usa solo {{Nombre}}, {{Celular}}, o {{email}}")
+                            preview_to = df.iloc[0]['email']
                             preview_subject = ''
                             preview_message = ''
+                            first = None
                         
-                        st.write(f"**Para:** {first_row['email']}")
+                        st.write(f"**Para:** {preview_to}")
                         st.write(f"**Asunto:** {preview_subject}")
                         st.text_area("**Mensaje:**", value=preview_message, height=150, disabled=True)
+                        if documents is not None and first is not None:
+                            preview_doc = preview_document(
+                                upload_digest(plantilla_doc), nombre_doc, documents,
+                                (('Nombre', first['Nombre']), ('Celular', first['Celular']), ('email', first['email']))
+                            )
+                            st.download_button(
+                                f"📄 Descargar el documento de muestra ({preview_doc['name']})",
+                                preview_doc['content'],
+                                file_name=preview_doc['name']
+                            )
                     
                     st.divider()
                     
+                    # Modo de envío: uno por uno o agrupado en lotes HTTP
+                    st.subheader("⚙️ Modo de envío")
+                    send_mode = st.radio(
+                        "Enviar los correos:",
+                        ["Uno por uno", "Por lotes (batch)", "Concurrente (varios hilos)", "Varias cuentas (pool)"],
+                        horizontal=True
+                    )
+                    # El pool de cuentas (y sus credenciales cifradas) solo se carga en ese modo.
+                    # Sin perfil de Gmail, el pool es solo de esta sesión.
+                    sender_pool = None
+                    if send_mode.startswith("Varias cuentas"):
+                        sender_pool = get_sender_pool(account or st.session_state.session_id)
+                        with st.expander(f"👥 Cuentas remitentes ({len(sender_pool)})", expanded=True):
+                            show_sender_pool(sender_pool, account)
+                    batch_size = 50
+                    workers = 4
+                    if send_mode.startswith("Por lotes"):
+                        batch_size = st.number_input(
+                            "Correos por lote:",
+                            min_value=1,
+                            max_value=MAX_BATCH_SIZE,
+                            value=50,
+                            help="Gmail admite hasta 100 llamadas por lote; se recomiendan 50 o menos."
+                        )
+                    elif send_mode.startswith("Concurrente"):
+                        workers = st.number_input("Hilos de envío:", min_value=1, max_value=16, value=4)
+                    elif send_mode.startswith("Varias cuentas"):
+                        from correo.accounts import WORKERS_PER_ACCOUNT
+
+                        workers = st.number_input(
+                            "Hilos de envío:", min_value=1, max_value=64,
+                            value=min(64, WORKERS_PER_ACCOUNT * max(1, len(sender_pool))),
+                            help="Cada cuenta tiene su propia cuota por segundo: conviene unos 4 hilos por cuenta."
+                        )
+                    quota_units = st.number_input(
+                        "Cuota de Gmail (unidades por segundo):",
+                        min_value=QUOTA_UNITS['messages.send'],
+                        max_value=10000,
+                        value=GMAIL_USER_UNITS_PER_SEC,
+                        help="Cada envío consume 100 unidades. El límite por usuario de Gmail es 250 unidades/seg."
+                    )
+                    
+                    # Contenido de la campaña: archivo, plantillas, adjuntos (nombre y contenido) y documento
+                    content_id = campaign_id(
+                        digest,
+                        subject_template,
+                        message_template,
+                        *[att.name for att in unique_attachments],
+                        *[upload_digest(att) for att in unique_attachments],
+                        *([upload_digest(plantilla_doc), nombre_doc] if documents is not None else [])
+                    )
+                    # Registro de la campaña: permite reanudar sin reenviar a quien ya lo recibió.
+                    # Es por remitente: otra cuenta con los mismos archivos es otra campaña.
+                    camp_id = campaign_id(content_id, account or st.session_state.session_id)
+                    resumen = get_journal().summary(camp_id)
+                    resume = st.checkbox(
+                        "Reanudar campaña (omitir destinatarios que ya recibieron este correo)",
+                        value=True
+                    )
+                    if resumen:
+                        st.caption(f"📒 Campaña {camp_id}: {resumen.get('sent', 0)} enviados y {resumen.get('error', 0)} con error en intentos anteriores")
+                    
+                    # Campaña compilada: los mensajes se arman una vez en disco y el envío solo los lee.
+                    # El spool depende solo del contenido (no del remitente).
+                    from correo.spool import CampaignSpool, remove_spool, spool_exists, spool_path
+
+                    spool_file = spool_path(content_id)
+                    use_spool = st.checkbox(
+                        "🗜️ Compilar la campaña en disco antes de enviar",
+                        value=spool_exists(spool_file),
+                        help="Arma todos los mensajes una sola vez y los envía desde un archivo en disco: "
+                             "la memoria no crece con el número de contactos y los reenvíos no vuelven a armarlos."
+                    )
+                    if spool_exists(spool_file):
+                        spool = CampaignSpool(spool_file)
+                        try:
+                            info = spool.summary()
+                            _, primer_destinatario, primer_mensaje = spool.message(0) if info['messages'] else (None, None, None)
+                        finally:
+                            spool.close()
+                        col_spool, col_eml, col_borrar = st.columns([3, 1, 1])
+                        col_spool.caption(
+                            f"🗜️ Campaña compilada: {info['messages']} mensajes ({info['bytes'] / 1024 / 1024:.1f} MB en disco, "
+                            f"{info['rejected']} rechazados). Se reutiliza sin volver a armar los mensajes."
+                        )
+                        if primer_mensaje is not None:
+                            col_eml.download_button(
+                                "⬇️ Primer mensaje (.eml)", primer_mensaje,
+                                file_name=f"{primer_destinatario}.eml", mime='message/rfc822'
+                            )
+                        if col_borrar.button("🗑️ Borrar compilación", disabled=get_job_runner().active_for_campaign(camp_id) is not None):
+                            remove_spool(spool_file)
+                            st.rerun()
+                    
+                    current_campaign = camp_id
+                    active_job = get_job_runner().active_for_campaign(camp_id)
+                    if active_job is not None:
+                        st.warning(f"Esta campaña ya se está enviando en segundo plano (trabajo #{active_job.id}).")
+                    
                     # Botón para enviar
-                    if st.button("📤 Enviar todos los correos"):
+                    pool_vacio = sender_pool is not None and len(sender_pool) == 0
+                    if pool_vacio:
+                        st.warning("Agrega al menos una cuenta remitente al pool para enviar con varias cuentas.")
+                    if st.button("📤 Enviar todos los correos", disabled=active_job is not None or attachments_too_big or pool_vacio):
                         if not subject_template.strip() or not message_template.strip():
                             st.error("Por favor completa el asunto y mensaje")
                         else:
                             # Preparar archivos adjuntos UNA SOLA VEZ antes del loop
-                            attachments = []
-                            if uploaded_attachments:
-                                for att in uploaded_attachments:
-                                    # Leer el contenido del archivo UNA SOLA VEZ
-                                    att.seek(0)  # Ir al inicio del archivo
-                                    file_content = att.read()  # Leer todo el contenido
-                                    
-                                    attachments.append({
-                                        'name': att.name,
-                                        'content': file_content  # Ya es bytes, no necesita más procesamiento
-                                    })
-                                    st.write(f"📎 Preparado: {att.name} ({len(file_content)} bytes)")
+                            attachments = read_attachments(unique_attachments)
+                            for att in attachments:
+                                st.write(f"📎 Preparado: {att['name']} ({len(att['content'])} bytes)")
                             
-                            progress_bar = st.progress(0)
-                            status_text = st.empty()
+                            # Codificar los adjuntos UNA SOLA VEZ: cada correo solo añade cabeceras y cuerpo
+                            attachments = precompile_attachments(attachments)
+                            if attachments is not None:
+                                # Cuentan en la memoria de la sesión: si no caben, el trabajo los lee de disco
+                                get_memory_budget().put(st.session_state.session_id, ('adjuntos', camp_id), attachments)
                             
-                            enviados = 0
-                            errores = 0
+                            # Tamaño exacto del mensaje (el del primer correo): si no cabe, no se gasta ni una llamada
+                            message_size = 0
+                            preview_body = preview_message
+                            if preview_doc is not None:
+                                preview_body = BodyWithAttachments(preview_message, [preview_doc])
+                            if attachments is not None and len(df) > 0:
+                                message_size = attachments.message_size(preview_to, preview_subject, preview_body)
+                            elif preview_doc is not None:
+                                message_size = estimated_size([len(preview_doc['content'])])
                             
-                            for idx, row in df.iterrows():
-                                nombre = str(row['Nombre']).strip()
-                                celular = str(row['Celular']).strip()
-                                email = str(row['email']).strip()
-                                
-                                # Personalizar asunto y mensaje
-                                try:
-                                    # Formateo seguro para evitar KeyError si falta Celular
-                                    row_for_format = {'Nombre': nombre, 'Celular': celular if 'Celular' in df.columns else '', 'email': email}
-                                    asunto_personalizado = safe_format(subject_template, row_for_format)
-                                    mensaje_personalizado = safe_format(message_template, row_for_format)
-                                except Exception as e:
-                                    st.error(f"Error en la plantilla: {e}. Usa solo {{Nombre}}, {{Celular}}, o {{email}}")
-                                    break
-                                
-                                status_text.text(f"Enviando a {nombre} ({email})...")
-                                
-                                # Pasar los adjuntos preparados (no leer de nuevo)
-                                success, msg = send_email(
-                                    service, 
-                                    email, 
-                                    asunto_personalizado, 
-                                    mensaje_personalizado, 
-                                    attachments if attachments else None
+                            suppressed = get_suppression_list().contacts('email') if use_suppression else None
+                            
+                            journal = get_journal()
+                            journal.start_campaign(camp_id, filename, total_contactos)
+                            ya_enviados = journal.completed(camp_id) if resume else set()
+                            
+                            # Validar las plantillas antes de gastar cuota
+                            try:
+                                compile_template(subject_template)
+                                compile_template(message_template)
+                                plantilla_ok = True
+                            except TemplateError as e:
+                                st.error(f"Error en la plantilla: {e}. Usa solo {{Nombre}}, {{Celular}}, o {{email}}")
+                                plantilla_ok = False
+                            
+                            if message_size > MAX_MESSAGE_BYTES:
+                                st.error(
+                                    f"Cada correo ocuparía {message_size / 1024 / 1024:.1f} MB; "
+                                    f"Gmail acepta como máximo {MAX_MESSAGE_BYTES / 1024 / 1024:.0f} MB por mensaje"
                                 )
+                            elif plantilla_ok:
+                                if ya_enviados:
+                                    st.info(f"📒 Reanudando campaña {camp_id}: se omitirán los {len(ya_enviados)} destinatarios que ya recibieron el correo")
                                 
-                                if success:
-                                    enviados += 1
+                                # Lanzar el envío en segundo plano: un rerun de la página no lo detiene.
+                                # El archivo se recorre por lotes dentro del trabajo (memoria acotada).
+                                # Copia del archivo para el trabajo (en memoria o, si no cabe, en disco): una
+                                # por archivo, aunque cambien las plantillas; el trabajo la cierra al terminar.
+                                hoja = session_value(('hoja', digest), digest, uploaded_file.getvalue)
+                                items = functools.partial(
+                                    campaign_items,
+                                    data=hoja,
+                                    filename=filename,
+                                    columns=list(df.columns),
+                                    subject_template=subject_template,
+                                    message_template=message_template,
+                                    ya_enviados=ya_enviados,
+                                    suppressed=suppressed,
+                                    documents=documents
+                                )
+                                send_options = dict(
+                                    credentials=st.session_state.credentials,
+                                    send_mode=send_mode,
+                                    attachments=attachments,
+                                    limiter=gmail_limiter(quota_units),
+                                    client_pool=get_client_pool(),
+                                    batch_size=batch_size,
+                                    workers=workers,
+                                    sender_pool=sender_pool
+                                )
+                                if use_spool:
+                                    # Se compila la campaña completa; los ya enviados se omiten al leer el spool
+                                    run = functools.partial(
+                                        spooled_results, path=spool_file,
+                                        items=functools.partial(items, ya_enviados=set()),
+                                        ya_enviados=ya_enviados, suppressed=suppressed, **send_options
+                                    )
                                 else:
-                                    errores += 1
-                                    st.warning(f"Error enviando a {email}: {msg}")
-                                
-                                # Actualizar barra de progreso
-                                progress_bar.progress((idx + 1) / len(df))
+                                    run = functools.partial(campaign_results, items=items, **send_options)
+                                job = get_job_runner().submit(
+                                    f"{filename or 'Campaña'} ({send_mode})",
+                                    total_contactos,
+                                    functools.partial(closing_results, run=run, resource=hoja),
+                                    owner=st.session_state.session_id,
+                                    campaign_id=camp_id,
+                                    # La clave de cada fila es (número de fila, correo, hash del destinatario)
+                                    label=lambda key: key[1],
+                                    # Guardar cada resultado al momento para poder reanudar
+                                    on_result=lambda key, success, msg: journal.record(
+                                        camp_id, key[2], key[1], success, msg
+                                    )
+                                )
+                                st.success(f"📤 Envío iniciado en segundo plano (trabajo #{job.id}): {total_contactos} contactos")
+                    
+                    # Programar el envío: lo hace el servidor desde una cola persistente
+                    with st.expander("🗓️ Programar envío (se envía aunque cierres la página)"):
+                        send_at, window, daily_limit = schedule_inputs('mail')
+                        # Las sesiones iniciadas antes de pedir gmail.compose no pueden crear borradores
+                        puede_preparar = can_draft(st.session_state.credentials)
+                        prestage = st.checkbox(
+                            "📝 Preparar los correos como borradores antes de la hora de inicio",
+                            disabled=not puede_preparar,
+                            help="Los mensajes (con sus adjuntos) se suben a Gmail como borradores desde ahora; "
+                                 "a la hora programada solo se envían por su id, así el envío termina mucho antes. "
+                                 "Si cancelas la campaña, los borradores se borran."
+                        ) and puede_preparar
+                        if not puede_preparar:
+                            st.caption("📝 Para preparar borradores, vuelve a iniciar sesión y acepta el permiso de redactar correos.")
+                            if st.button("🔐 Volver a autorizar", key='reauth_compose'):
+                                sign_out()
+                        if documents is not None:
+                            st.caption("📄 Las campañas programadas se envían sin el documento personalizado.")
+                        if st.button("🗓️ Programar campaña", disabled=attachments_too_big or not account):
+                            if not subject_template.strip() or not message_template.strip():
+                                st.error("Por favor completa el asunto y mensaje")
+                            else:
+                                try:
+                                    compile_template(subject_template)
+                                    compile_template(message_template)
+                                    plantilla_ok = True
+                                except TemplateError as e:
+                                    st.error(f"Error en la plantilla: {e}. Usa solo {{Nombre}}, {{Celular}}, o {{email}}")
+                                    plantilla_ok = False
                                 
-                                # Pequeña pausa para no sobrecargar la API
-                                time.sleep(0.5)
-                            
-                            status_text.empty()
-                            progress_bar.empty()
-                            
-                            st.success(f"✅ Proceso completado: {enviados} enviados, {errores} errores")
+                                if plantilla_ok:
+                                    # Mismo filtrado y personalización que el envío inmediato; el Job solo cuenta rechazados
+                                    conteo = Job(None, filename, total_contactos)
+                                    suppressed = get_suppression_list().contacts('email') if use_suppression else None
+                                    items = campaign_items(
+                                        conteo, buffer_of(uploaded_file), filename, list(df.columns),
+                                        subject_template, message_template, set(), suppressed
+                                    )
+                                    scheduler = get_scheduler()
+                                    scheduler.save_account(account, st.session_state.credentials.to_json())
+                                    _, programados = scheduler.schedule(
+                                        f"{filename or 'Campaña'}: {subject_template}",
+                                        'gmail',
+                                        account,
+                                        ((email, asunto, mensaje) for _, email, asunto, mensaje in items),
+                                        send_at=send_at,
+                                        window=window,
+                                        daily_limit=daily_limit,
+                                        attachments=read_attachments(unique_attachments),
+                                        prestage=prestage
+                                    )
+                                    st.success(f"🗓️ Campaña programada: {programados} correos ({conteo.rechazados} rechazados)")
                         
             except Exception as e:
                 st.error(f"Error al procesar el archivo: {str(e)}")
     
+        # Envíos en segundo plano de esta sesión (o de la campaña cargada)
+        jobs = get_job_runner().jobs(owner=st.session_state.session_id, campaign_id=current_campaign)
+        if jobs:
+            st.divider()
+            st.subheader("📤 Envíos en segundo plano")
+            if any(job.active for job in jobs):
+                show_jobs_live(st.session_state.session_id, current_campaign)
+            else:
+                show_jobs(st.session_state.session_id, current_campaign)
+        
+        # Campañas programadas de la cuenta (las envía el servidor)
+        if account:
+            show_scheduled(account)
+    
     with tab2:
         st.header("Tus últimos correos")
         
-        num_messages = st.slider("Número de mensajes a mostrar:", 1, 20, 10)
-        
-        if st.button("Cargar mensajes"):
-            with st.spinner("Cargando mensajes..."):
-                messages = list_messages(service, num_messages)
+        if account:
+            cache = get_mailbox_cache()
+            num_messages = st.slider("Mensajes a descargar en la primera sincronización:", 1, 1000, 200)
+            
+            col_sync, col_reset = st.columns(2)
+            if col_sync.button("🔄 Sincronizar mensajes"):
+                with st.spinner("Sincronizando mensajes..."):
+                    try:
+                        stats = sync_mailbox(service, cache, account, num_messages, limiter=gmail_limiter())
+                        if stats['full']:
+                            st.success(f"Descargados {stats['added']} mensajes")
+                        else:
+                            st.success(f"Sincronizado: {stats['added']} nuevos, {stats['deleted']} borrados, {stats['updated']} con etiquetas cambiadas")
+                        if stats['errors']:
+                            st.warning(f"No se pudieron cargar {stats['errors']} mensajes; se reintentarán en la próxima sincronización")
+                    except Exception as e:
+                        st.error(f"Error al sincronizar mensajes: {str(e)}")
+            if col_reset.button("🗑️ Vaciar caché local"):
+                cache.clear(account)
+            
+            # Mostrar desde la caché local: búsqueda y filtros sin llamadas a la API
+            total_cache = cache.count(account)
+            if total_cache:
+                col_text, col_label, col_limit = st.columns([3, 2, 1])
+                texto = col_text.text_input("Buscar (remitente, asunto o texto):")
+                etiqueta = col_label.selectbox("Etiqueta:", ["Todas"] + cache.labels(account))
+                limite = col_limit.number_input("Mostrar:", min_value=10, max_value=5000, value=100, step=10)
+                mensajes = cache.search(account, texto, None if etiqueta == "Todas" else etiqueta, limite)
                 
-                if messages:
-                    st.write(f"Mostrando {len(messages)} mensajes:")
-                    for msg in messages:
-                        try:
-                            msg_data = service.users().messages().get(
-                                userId='me',
-                                id=msg['id'],
-                                format='metadata',
-                                metadataHeaders=['From', 'Subject', 'Date']
-                            ).execute()
-                            
-                            headers = msg_data.get('payload', {}).get('headers', [])
-                            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'Sin asunto')
-                            from_email = next((h['value'] for h in headers if h['name'] == 'From'), 'Desconocido')
-                            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Sin fecha')
-                            
-                            with st.expander(f"📧 {subject}"):
-                                st.write(f"**De:** {from_email}")
-                                st.write(f"**Fecha:** {date}")
-                                st.write(f"**ID:** {msg['id']}")
-                        except Exception as e:
-                            st.error(f"Error al cargar mensaje: {str(e)}")
-                else:
-                    st.info("No se encontraron mensajes")
+                st.write(f"Mostrando {len(mensajes)} de {total_cache} mensajes en caché:")
+                st.dataframe(
+                    pd.DataFrame(mensajes, columns=['subject', 'from', 'date', 'id']).rename(columns={
+                        'subject': 'Asunto', 'from': 'De', 'date': 'Fecha', 'id': 'ID'
+                    }),
+                    hide_index=True
+                )
+                synced_at = cache.synced_at(account)
+                if synced_at:
+                    st.caption(f"Última sincronización: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(synced_at))}")
+            else:
+                st.info("No hay mensajes en la caché. Pulsa «Sincronizar mensajes» para descargarlos.")
 
     with tab3:
         st.header("📱 Enviar WhatsApp (individual o masivo)")
         st.write("Sube un archivo Excel con las columnas: `Nombre` y `Celular` (sin prefijo +52)")
 
-        uploaded_wa = st.file_uploader("Sube el Excel para WhatsApp", type=['xlsx', 'xls'], key='wa_excel')
+        uploaded_wa = st.file_uploader("Sube el Excel para WhatsApp", type=CONTACT_FILE_TYPES, key='wa_excel')
         if uploaded_wa is not None:
             try:
-                # Leer el Excel para WhatsApp usando engine apropiado
+                # Leer el archivo para WhatsApp (Excel, CSV o Parquet) como texto
                 df_wa = None
                 try:
                     wa_filename = getattr(uploaded_wa, 'name', '') or ''
-                    if wa_filename.lower().endswith('.xls'):
-                        df_wa = pd.read_excel(uploaded_wa, dtype=str, engine='xlrd')
-                    else:
-                        df_wa = pd.read_excel(uploaded_wa, dtype=str, engine='openpyxl')
+                    df_wa = load_contacts(upload_digest(uploaded_wa), wa_filename, uploaded_wa, dtype=str)
                 except Exception as e:
                     err = str(e)
                     if 'xlrd' in err or 'Install xlrd' in err or 'Missing optional dependency' in err:
@@ -499,125 +1138,216 @@ else:
                         st.success(f"✅ Archivo cargado correctamente: {len(df_wa)} contactos encontrados")
                 else:
                     st.success(f"✅ Archivo cargado correctamente: {len(df_wa)} contactos encontrados")
-                    st.dataframe(df_wa)
+                    
+                    # Normalizar teléfonos y descartar vacíos, inválidos, duplicados y suprimidos
+                    wa_suppression = get_suppression_list()
+                    wa_validator = ContactValidator('phone', wa_suppression.contacts('phone'))
+                    telefonos, motivos_wa = wa_validator.check(df_wa['Celular'])
+                    if wa_validator.rejected:
+                        st.warning(f"Se descartan {wa_validator.rejected} contactos: " + " · ".join(
+                            f"{motivo}: {n}" for motivo, n in wa_validator.summary()['by_reason'].items()
+                        ))
+                        with st.expander(f"Ver contactos descartados ({wa_validator.rejected})"):
+                            st.dataframe(wa_validator.report_frame(), hide_index=True)
+                    df_wa = df_wa[motivos_wa == ''].assign(Celular=telefonos[motivos_wa == ''])
+                    show_suppression_manager(wa_suppression, 'phone')
+                    if df_wa.empty:
+                        st.error("No quedan contactos válidos para enviar. Revisa la columna Celular.")
+                    else:
+                        st.dataframe(df_wa)
 
-                    st.divider()
-                    st.subheader("✉️ Plantilla de mensaje para WhatsApp")
-                    st.write("Usa `{Nombre}` y `{Celular}` para personalizar")
-                    wa_template = st.text_area("Mensaje:", value="Hola {Nombre}, te contactamos al {Celular}.", height=160)
-
-                    # Selección individual o masiva
-                    mode = st.radio("Enviar a:", ["Individual (elige un contacto)", "Masivo (todos)"])
-
-                    # Método de envío
-                    method = st.selectbox("Método de envío:", ["wa.me (enlaces)", "pywhatkit (local)"])
-
-                    if mode.startswith("Individual"):
-                        # Elegir contacto
-                        names = df_wa['Nombre'].astype(str).tolist()
-                        choice = st.selectbox("Elige un contacto:", names)
-                        selected_row = df_wa[df_wa['Nombre'].astype(str) == choice].iloc[0]
-                        numero = str(selected_row['Celular']).strip()
-                        nombre = str(selected_row['Nombre']).strip()
-                        preview = wa_template.format(Nombre=nombre, Celular=numero)
-                        st.write(f"**Para:** +52{numero}")
-                        st.text_area("**Mensaje:**", value=preview, height=140, disabled=True)
-
-                        if method.startswith("wa.me"):
-                            link = f"https://wa.me/52{numero}?text={urllib.parse.quote(preview)}"
-                            st.markdown(
-                                f"""
-                                <a href="{link}" target="_blank">
-                                    <button style="
-                                        background-color:#25D366;
-                                        color:white;
-                                        padding:10px 18px;
-                                        border:none;
-                                        border-radius:8px;
-                                        font-size:16px;
-                                        cursor:pointer;
-                                    ">
-                                        📲 Enviar WhatsApp
-                                    </button>
-                                </a>
-                                """,
-                                unsafe_allow_html=True
-                            )
-                        else:
-                            if not HAS_PYWHATKIT:
-                                st.warning("pywhatkit no está disponible en este entorno. Ejecuta la app localmente para usar pywhatkit.")
-                            if st.button("📤 Enviar por pywhatkit (local)"):
-                                if not HAS_PYWHATKIT:
-                                    st.error("pywhatkit no disponible — instala pywhatkit y ejecuta localmente")
-                                else:
-                                    try:
-                                        pwk.sendwhatmsg_instantly(f"+52{numero}", preview, wait_time=15, tab_close=True, close_time=3)
-                                        st.success("Mensaje enviado (se abrió WhatsApp Web)")
-                                    except Exception as e:
-                                        st.error(f"Error enviando por pywhatkit: {e}")
+                        st.divider()
+                        st.subheader("✉️ Plantilla de mensaje para WhatsApp")
+                        st.write("Usa `{Nombre}` y `{Celular}` para personalizar")
+                        wa_template = st.text_area("Mensaje:", value="Hola {Nombre}, te contactamos al {Celular}.", height=160)
 
-                    else:
-                        # Masivo — comportamiento previo
-                        st.info("Generar enlaces wa.me para todos o usar pywhatkit (local) para envíos automáticos en tu máquina")
-                        if method.startswith("wa.me"):
-                            st.subheader("Enlaces de envío (clic para abrir WhatsApp)")
-
-                            for _, r in df_wa.iterrows():
-                                numero = str(r['Celular']).strip()
-                                nombre = str(r['Nombre']).strip()
-                                texto = wa_template.format(Nombre=nombre, Celular=numero)
-                                encoded = urllib.parse.quote(texto)
-                                link = f"https://wa.me/52{numero}?text={encoded}"
+                        # Selección individual o masiva
+                        mode = st.radio("Enviar a:", ["Individual (elige un contacto)", "Masivo (todos)"])
+
+                        # Método de envío
+                        method = st.selectbox(
+                            "Método de envío:", ["wa.me (enlaces)", "pywhatkit (local)", "API de WhatsApp (Cloud)"]
+                        )
+                        wa_api = whatsapp_api_options() if method.startswith("API") else None
 
+                        if mode.startswith("Individual"):
+                            # Elegir contacto
+                            names = df_wa['Nombre'].astype(str).tolist()
+                            choice = st.selectbox("Elige un contacto:", names)
+                            selected_row = df_wa[df_wa['Nombre'].astype(str) == choice].iloc[0]
+                            numero = str(selected_row['Celular']).strip()
+                            nombre = str(selected_row['Nombre']).strip()
+                            preview = safe_format(wa_template, {'Nombre': nombre, 'Celular': numero})
+                            st.write(f"**Para:** +52{numero}")
+                            st.text_area("**Mensaje:**", value=preview, height=140, disabled=True)
+
+                            if method.startswith("wa.me"):
+                                link = f"https://wa.me/52{numero}?text={urllib.parse.quote(preview)}"
                                 st.markdown(
                                     f"""
-                                    <div style="margin-bottom:15px; padding:10px; border:1px solid #ddd; border-radius:8px;">
-                                        <b>{nombre}</b> (+52{numero})<br><br>
-                                        <a href="{link}" target="_blank">
-                                            <button style="
-                                                background-color:#25D366;
-                                                color:white;
-                                                padding:8px 14px;
-                                                border:none;
-                                                border-radius:6px;
-                                                font-size:15px;
-                                                cursor:pointer;
-                                            ">
-                                                📲 Enviar WhatsApp
-                                            </button>
-                                        </a>
-                                    </div>
+                                    <a href="{link}" target="_blank">
+                                        <button style="
+                                            background-color:#25D366;
+                                            color:white;
+                                            padding:10px 18px;
+                                            border:none;
+                                            border-radius:8px;
+                                            font-size:16px;
+                                            cursor:pointer;
+                                        ">
+                                            📲 Enviar WhatsApp
+                                        </button>
+                                    </a>
                                     """,
                                     unsafe_allow_html=True
                                 )
-                        else:
-                            intervalo = st.number_input("Segundos entre mensajes:", min_value=5, max_value=300, value=15)
-                            if not HAS_PYWHATKIT:
-                                st.warning("pywhatkit no está instalado aquí. Ejecuta localmente para usar esta opción.")
-                            if st.button("📤 Enviar masivo por pywhatkit (local)"):
+                            elif method.startswith("pywhatkit"):
                                 if not HAS_PYWHATKIT:
-                                    st.error("pywhatkit no disponible — instala pywhatkit y ejecuta localmente")
-                                else:
-                                    progress = st.progress(0)
-                                    status = st.empty()
-                                    enviados = 0
-                                    errores = 0
-                                    for idx, row in df_wa.iterrows():
-                                        nombre = str(row['Nombre']).strip()
-                                        celular = str(row['Celular']).strip()
-                                        texto = wa_template.format(Nombre=nombre, Celular=celular)
-                                        status.text(f"Enviando a {nombre} (+52{celular})...")
+                                    st.warning("pywhatkit no está disponible en este entorno. Ejecuta la app localmente para usar pywhatkit.")
+                                if st.button("📤 Enviar por pywhatkit (local)"):
+                                    if not HAS_PYWHATKIT:
+                                        st.error("pywhatkit no disponible — instala pywhatkit y ejecuta localmente")
+                                    else:
                                         try:
-                                            pwk.sendwhatmsg_instantly(f"+52{celular}", texto, wait_time=15, tab_close=True, close_time=3)
-                                            enviados += 1
+                                            import pywhatkit as pwk
+
+                                            pwk.sendwhatmsg_instantly(f"+52{numero}", preview, wait_time=15, tab_close=True, close_time=3)
+                                            st.success("Mensaje enviado (se abrió WhatsApp Web)")
                                         except Exception as e:
-                                            errores += 1
-                                            st.warning(f"Error enviando a {celular}: {e}")
-                                        progress.progress((idx + 1) / len(df_wa))
-                                        time.sleep(intervalo)
-                                    status.empty()
-                                    progress.empty()
-                                    st.success(f"Proceso finalizado: {enviados} enviados, {errores} errores")
+                                            st.error(f"Error enviando por pywhatkit: {e}")
+                            elif st.button("📤 Enviar por la API de WhatsApp", disabled=wa_api is None):
+                                from correo.backends import WhatsAppCloudBackend
+
+                                wa_backend = WhatsAppCloudBackend(**wa_api)
+                                success, msg = wa_backend.deliver(numero, '', preview)
+                                wa_backend.close()
+                                if success:
+                                    st.success(msg)
+                                else:
+                                    st.error(msg)
+
+                        else:
+                            # Masivo — comportamiento previo
+                            st.info("Generar enlaces wa.me para todos, usar pywhatkit (local) en tu máquina o enviar por la API de WhatsApp")
+                            if method.startswith("wa.me"):
+                                st.subheader("Enlaces de envío (clic para abrir WhatsApp)")
+
+                                # Todos los enlaces en una pasada por columnas; se muestra una página a la vez
+                                enlaces = wa_links(df_wa, wa_template)
+                                col_search, col_size = st.columns([3, 1])
+                                busqueda = col_search.text_input("Buscar por nombre o celular:", key='wa_search')
+                                por_pagina = col_size.selectbox("Por página:", [25, 50, 100, 200], index=1, key='wa_page_size')
+                                filtrados = search_links(enlaces, busqueda)
+                                paginas = max(1, -(-len(filtrados) // por_pagina))
+                                pagina_wa = st.number_input(
+                                    f"Página (de {paginas}):", min_value=1, max_value=paginas, value=1, key='wa_page'
+                                )
+                                st.caption(f"{len(filtrados)} de {len(enlaces)} contactos")
+                                st.dataframe(
+                                    links_page(filtrados, pagina_wa - 1, por_pagina)[['Nombre', 'Celular', 'Enlace']],
+                                    column_config={
+                                        'Enlace': st.column_config.LinkColumn("WhatsApp", display_text="📲 Enviar WhatsApp")
+                                    },
+                                    hide_index=True
+                                )
+
+                                # Exportar la lista completa (o lo filtrado) sin pintarla en la página
+                                col_csv, col_html = st.columns(2)
+                                col_csv.download_button(
+                                    "⬇️ Descargar enlaces (CSV)",
+                                    filtrados.to_csv(index=False).encode('utf-8'),
+                                    file_name="enlaces_whatsapp.csv",
+                                    mime="text/csv"
+                                )
+                                col_html.download_button(
+                                    "⬇️ Descargar enlaces (HTML)",
+                                    links_html(filtrados).encode('utf-8'),
+                                    file_name="enlaces_whatsapp.html",
+                                    mime="text/html"
+                                )
+                            elif method.startswith("API"):
+                                # Envío en segundo plano: la velocidad la pone el límite del proveedor.
+                                # La campaña es de esta sesión: otra que suba el mismo archivo no ve ni cancela sus envíos.
+                                wa_campaign = f"whatsapp:{st.session_state.session_id}:{upload_digest(uploaded_wa)}"
+                                active_wa = get_job_runner().active_for_campaign(wa_campaign)
+                                if st.button("📤 Enviar masivo por la API de WhatsApp", disabled=wa_api is None or active_wa is not None):
+                                    from correo.backends import WhatsAppCloudBackend
+
+                                    wa_backend = WhatsAppCloudBackend(**wa_api)
+                                    wa_cols = template_columns(df_wa)
+                                    wa_items = list(zip(
+                                        wa_cols['Celular'], wa_cols['Celular'],
+                                        itertools.repeat(''), render_template(df_wa, wa_template)
+                                    ))
+                                    job = get_job_runner().submit(
+                                        f"WhatsApp: {wa_filename or 'contactos'}",
+                                        len(wa_items),
+                                        functools.partial(backend_results, backend=wa_backend, items=wa_items),
+                                        owner=st.session_state.session_id,
+                                        campaign_id=wa_campaign
+                                    )
+                                    st.success(f"📤 Envío iniciado en segundo plano (trabajo #{job.id}): {len(wa_items)} contactos")
+                                wa_jobs = get_job_runner().jobs(campaign_id=wa_campaign)
+                                if any(job.active for job in wa_jobs):
+                                    show_jobs_live(None, wa_campaign)
+                                elif wa_jobs:
+                                    show_jobs(None, wa_campaign)
+                            else:
+                                intervalo = st.number_input("Segundos entre mensajes:", min_value=5, max_value=300, value=15)
+                                if not HAS_PYWHATKIT:
+                                    st.warning("pywhatkit no está instalado aquí. Ejecuta localmente para usar esta opción.")
+                                if st.button("📤 Enviar masivo por pywhatkit (local)"):
+                                    if not HAS_PYWHATKIT:
+                                        st.error("pywhatkit no disponible — instala pywhatkit y ejecuta localmente")
+                                    else:
+                                        progress = st.progress(0)
+                                        status = st.empty()
+                                        enviados = 0
+                                        errores = 0
+                                        # Un envío cada `intervalo` segundos contados desde el inicio del anterior
+                                        from correo.backends import PyWhatKitBackend
+
+                                        wa_backend = PyWhatKitBackend(interval=intervalo)
+                                        wa_cols = template_columns(df_wa)
+                                        wa_textos = render_template(df_wa, wa_template)
+                                        for i, (nombre, celular, texto) in enumerate(zip(wa_cols['Nombre'], wa_cols['Celular'], wa_textos)):
+                                            status.text(f"Enviando a {nombre} (+52{celular})...")
+                                            success, msg = wa_backend.deliver(celular, '', texto)
+                                            if success:
+                                                enviados += 1
+                                            else:
+                                                errores += 1
+                                                st.warning(f"Error enviando a {celular}: {msg}")
+                                            progress.progress((i + 1) / len(df_wa))
+                                        status.empty()
+                                        progress.empty()
+                                        st.success(f"Proceso finalizado: {enviados} enviados, {errores} errores")
+
+                            # Programar el envío (pywhatkit o API) desde la cola del servidor
+                            if not method.startswith("wa.me"):
+                                if method.startswith("pywhatkit"):
+                                    wa_backend_name, wa_options = 'pywhatkit', {'interval': intervalo}
+                                    wa_disponible = HAS_PYWHATKIT
+                                else:
+                                    wa_backend_name, wa_options = 'whatsapp_cloud', wa_api
+                                    wa_disponible = wa_api is not None
+                                with st.expander("🗓️ Programar envío de WhatsApp"):
+                                    wa_send_at, wa_window, wa_limit = schedule_inputs('wa', default_limit=1000)
+                                    if st.button("🗓️ Programar WhatsApp", disabled=not wa_disponible or not account):
+                                        wa_cols = template_columns(df_wa)
+                                        _, programados = get_scheduler().schedule(
+                                            f"WhatsApp: {wa_filename or 'contactos'}",
+                                            wa_backend_name,
+                                            f"whatsapp:{account}",
+                                            zip(wa_cols['Celular'], itertools.repeat(''), render_template(df_wa, wa_template)),
+                                            send_at=wa_send_at,
+                                            window=wa_window,
+                                            daily_limit=wa_limit,
+                                            options=wa_options
+                                        )
+                                        st.success(f"🗓️ {programados} mensajes de WhatsApp programados")
+                                if account:
+                                    show_scheduled(f"whatsapp:{account}")
             except Exception as e:
                 st.error(f"Error procesando el Excel para WhatsApp: {e}")
 
@@ -635,4 +1365,20 @@ with st.sidebar:
     if st.session_state.credentials:
         st.success("Conectado")
     else:
-        st.warning("No autenticado")
\ No newline at end of file
+        st.warning("No autenticado")
+    
+    if 'session_id' in st.session_state:
+        uso = get_memory_budget().usage(st.session_state.session_id)
+        if uso['resident'] or uso['disk']:
+            st.caption(
+                f"🧠 Datos de la sesión: {uso['resident'] / MB:.1f} MB en memoria, "
+                f"{uso['disk'] / MB:.1f} MB en disco (límite {get_memory_budget().session_bytes / MB:.0f} MB)"
+            )
+    
+    st.divider()
+    st.write("**📈 Rendimiento de los envíos:**")
+    if any(job.active for job in get_job_runner().jobs(owner=st.session_state.session_id)):
+        show_metrics_live(st.session_state.session_id)
+    else:
+        show_metrics(st.session_state.session_id)
+    get_metrics_server()
\ No newline at end of file
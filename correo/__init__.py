@@ -0,0 +1 @@
+# Motor de envío de la aplicación de Gmail (utilidades reutilizables fuera de la UI)
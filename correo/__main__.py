@@ -0,0 +1,6 @@
+import sys
+
+from correo.cli import main
+
+# `python -m correo send --sheet contactos.xlsx --template cuerpo.txt --subject "Hola {Nombre}"`
+sys.exit(main())
@@ -0,0 +1,282 @@
+import itertools
+import json
+import sqlite3
+import threading
+import time
+
+from google.auth.exceptions import RefreshError
+from google.oauth2 import service_account
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+
+from correo.clients import GmailClientPool, refresh_if_needed
+from correo.gmail import send_message
+from correo.metrics import NO_METRICS
+from correo.paths import data_path
+from correo.ratelimit import GMAIL_USER_UNITS_PER_SEC, gmail_limiter
+from correo.retry import call_with_retry, failure_message, is_quota_exhausted
+from correo.scheduler import DEFAULT_DAILY_LIMIT
+from correo.sender import bounded_sends
+from correo.vault import Vault
+
+# Permiso que necesita la cuenta de servicio para enviar como cada usuario del dominio
+SEND_SCOPES = ['https://www.googleapis.com/auth/gmail.send']
+# Hilos de envío por cuenta (cada cuenta tiene su propia cuota por segundo)
+WORKERS_PER_ACCOUNT = 4
+# Tiempo fuera de la rotación de una cuenta con el límite diario agotado o sin acceso
+EXHAUSTED_SECONDS = 3600
+HOUR = 3600
+
+# Cada cuenta pertenece a quien la agregó (owner: la cuenta con la que inició
+# sesión) y sus credenciales se guardan cifradas
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sender_accounts (
+    owner TEXT NOT NULL,
+    email TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    credentials TEXT NOT NULL,
+    daily_limit INTEGER,
+    units_per_sec REAL,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    added_at REAL,
+    PRIMARY KEY (owner, email)
+);
+CREATE TABLE IF NOT EXISTS usage (
+    email TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (email, hour)
+);
+"""
+
+
+# Credenciales de una cuenta de servicio con delegación de dominio que envía como `subject`
+def delegated_credentials(info, subject, scopes=SEND_SCOPES):
+    return service_account.Credentials.from_service_account_info(info, scopes=scopes).with_subject(subject)
+
+
+# Una cuenta remitente del pool: sus credenciales, su limitador de cuota por
+# segundo y hasta cuándo queda fuera de la rotación
+class SenderAccount:
+    def __init__(self, email, credentials, daily_limit=DEFAULT_DAILY_LIMIT, units_per_sec=GMAIL_USER_UNITS_PER_SEC):
+        self.email = email
+        self.credentials = credentials
+        self.daily_limit = daily_limit or DEFAULT_DAILY_LIMIT
+        self.limiter = gmail_limiter(units_per_sec or GMAIL_USER_UNITS_PER_SEC)
+        self.exhausted_until = 0.0
+        self.detail = ''
+        # Envíos reservados que aún no terminan (cuentan para el límite diario)
+        self.in_flight = 0
+
+
+# Pool de cuentas remitentes de un dueño (OAuth de varias cuentas o una cuenta
+# de servicio que suplanta a varios usuarios del dominio). Solo ve, usa y quita
+# las cuentas que agregó ese dueño. Se guardan en SQLite junto con lo enviado
+# por hora (por buzón, compartido entre dueños), para respetar el límite diario
+# de cada cuenta aunque se reinicie el servidor. El reparto entre cuentas es
+# rotativo y salta las que no tienen cuota.
+class SenderPool:
+    def __init__(self, owner, path=None, clock=time.time, vault=None):
+        if not owner:
+            raise ValueError("El pool de cuentas remitentes necesita un dueño")
+        self.owner = owner
+        self.path = path or data_path('senders.sqlite3')
+        self.clock = clock
+        self.vault = vault or Vault()
+        self._accounts = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._pick_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        # La primera versión guardaba las cuentas sin dueño y con las credenciales
+        # en claro: no se pueden atribuir a nadie, así que se descartan
+        self._conn.execute('DROP TABLE IF EXISTS senders')
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        rows = self._conn.execute(
+            'SELECT email, kind, credentials, daily_limit, units_per_sec FROM sender_accounts '
+            'WHERE owner = ? AND enabled = 1 ORDER BY added_at',
+            (self.owner,)
+        ).fetchall()
+        for email, kind, credentials, daily_limit, units_per_sec in rows:
+            self._accounts[email] = SenderAccount(
+                email, self._credentials(kind, self.vault.decrypt(credentials), email), daily_limit, units_per_sec
+            )
+
+    @staticmethod
+    def _credentials(kind, credentials, email):
+        info = json.loads(credentials)
+        if kind == 'service_account':
+            return delegated_credentials(info, email)
+        return Credentials.from_authorized_user_info(info)
+
+    def _save(self, email, kind, credentials_json, daily_limit, units_per_sec):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sender_accounts '
+                '(owner, email, kind, credentials, daily_limit, units_per_sec, enabled, added_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, 1, ?)',
+                (self.owner, email, kind, self.vault.encrypt(credentials_json), daily_limit, units_per_sec,
+                 self.clock())
+            )
+            self._conn.commit()
+            self._accounts[email] = SenderAccount(
+                email, self._credentials(kind, credentials_json, email), daily_limit, units_per_sec
+            )
+
+    # Agregar una cuenta autorizada por OAuth (p. ej. la de la sesión actual)
+    def add_oauth(self, email, credentials_json, daily_limit=DEFAULT_DAILY_LIMIT,
+                  units_per_sec=GMAIL_USER_UNITS_PER_SEC):
+        self._save(email, 'oauth', credentials_json, daily_limit, units_per_sec)
+
+    # Agregar usuarios del dominio que la cuenta de servicio puede suplantar
+    def add_service_account(self, info, emails, daily_limit=DEFAULT_DAILY_LIMIT,
+                            units_per_sec=GMAIL_USER_UNITS_PER_SEC):
+        if info.get('type') != 'service_account':
+            raise ValueError("El archivo no es la clave de una cuenta de servicio")
+        for email in emails:
+            self._save(email, 'service_account', json.dumps(info), daily_limit, units_per_sec)
+
+    def remove(self, email):
+        with self._lock:
+            self._conn.execute('DELETE FROM sender_accounts WHERE owner = ? AND email = ?', (self.owner, email))
+            self._conn.commit()
+            self._accounts.pop(email, None)
+
+    def accounts(self):
+        with self._lock:
+            return list(self._accounts.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._accounts)
+
+    # Enviados por la cuenta en las últimas 24 horas (por horas completas)
+    def sent_today(self, email, now=None):
+        hour = int((now or self.clock()) // HOUR)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COALESCE(SUM(sent), 0) FROM usage WHERE email = ? AND hour > ?', (email, hour - 24)
+            ).fetchone()
+        return row[0]
+
+    # Terminar un envío reservado con next_account(); si salió, cuenta para el límite diario
+    def release(self, account, sent=True):
+        if sent:
+            self.record_sent(account)
+        with self._pick_lock:
+            account.in_flight -= 1
+
+    def record_sent(self, account, n=1):
+        hour = int(self.clock() // HOUR)
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO usage (email, hour, sent) VALUES (?, ?, ?) '
+                'ON CONFLICT (email, hour) DO UPDATE SET sent = sent + excluded.sent',
+                (account.email, hour, n)
+            )
+            self._conn.commit()
+
+    # Sacar una cuenta de la rotación por un tiempo (límite agotado o credenciales inválidas)
+    def mark_exhausted(self, account, detail='', seconds=EXHAUSTED_SECONDS):
+        account.exhausted_until = self.clock() + seconds
+        account.detail = detail
+
+    # ¿La cuenta puede enviar ahora? (no está apartada y le queda límite diario)
+    def available(self, account, now=None):
+        now = now or self.clock()
+        return (account.exhausted_until <= now
+                and self.sent_today(account.email, now) + account.in_flight < account.daily_limit)
+
+    # Reservar un envío en la siguiente cuenta de la rotación que puede enviar
+    # (None si ninguna). Hay que devolverla con release() al terminar.
+    def next_account(self, exclude=()):
+        accounts = [a for a in self.accounts() if a.email not in exclude]
+        if not accounts:
+            return None
+        with self._pick_lock:
+            start = next(self._turn)
+            now = self.clock()
+            for i in range(len(accounts)):
+                account = accounts[(start + i) % len(accounts)]
+                if self.available(account, now):
+                    account.in_flight += 1
+                    return account
+        return None
+
+    # Estado de cada cuenta para la UI
+    def summary(self):
+        now = self.clock()
+        return [
+            {
+                'email': account.email,
+                'enviados_24h': self.sent_today(account.email, now),
+                'limite_diario': account.daily_limit,
+                'disponible': self.available(account, now),
+                'detalle': account.detail if account.exhausted_until > now else '',
+            }
+            for account in self.accounts()
+        ]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ¿El error es de la cuenta (límite diario agotado, token revocado o sin permiso
+# para enviar) y no del mensaje? Entonces se reintenta con otra cuenta.
+def is_account_error(exc):
+    if is_quota_exhausted(exc) or isinstance(exc, RefreshError):
+        return True
+    return isinstance(exc, HttpError) and getattr(exc.resp, 'status', None) == 401
+
+
+# Envío repartido entre las cuentas del pool: cada correo sale por la siguiente
+# cuenta con cuota (rotación), con el limitador por segundo de esa cuenta. Si
+# una cuenta agota su límite o pierde el acceso, sale de la rotación y el
+# correo se reintenta con otra. Mismo contrato que ConcurrentSender.send().
+class PooledSender:
+    def __init__(self, pool, workers=None, client_pool=None, metrics=NO_METRICS, max_retries=5):
+        self.pool = pool
+        self.workers = max(1, int(workers or WORKERS_PER_ACCOUNT * max(1, len(pool))))
+        self.client_pool = client_pool or GmailClientPool()
+        self.metrics = metrics
+        self.max_retries = max_retries
+
+    def _call(self, account, to, subject, body, attachments):
+        refresh_if_needed(account.credentials)
+        with self.client_pool.lease(account.credentials) as service:
+            return send_message(service, to, subject, body, attachments, self.metrics)
+
+    def _send_one(self, to, subject, body, attachments):
+        tried = set()
+        while True:
+            account = self.pool.next_account(exclude=tried)
+            if account is None:
+                return False, "Error: ninguna cuenta remitente tiene cuota disponible"
+            try:
+                sent = call_with_retry(
+                    lambda: self._call(account, to, subject, body, attachments),
+                    account.limiter, max_retries=self.max_retries, metrics=self.metrics
+                )
+            except Exception as e:
+                self.pool.release(account, sent=False)
+                if is_account_error(e):
+                    self.pool.mark_exhausted(account, str(e))
+                    tried.add(account.email)
+                    self.metrics.add_retry()
+                    continue
+                return False, failure_message(e)
+            self.pool.release(account)
+            return True, f"Mensaje enviado desde {account.email}! ID: {sent['id']}"
+
+    def send(self, items, attachments=None):
+        return bounded_sends(
+            lambda to, subject, body: self._send_one(to, subject, body, attachments),
+            items, self.workers, thread_name_prefix='pool-send'
+        )
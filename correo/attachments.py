@@ -0,0 +1,229 @@
+import base64
+import hashlib
+import io
+import mimetypes
+import mmap
+import os
+import uuid
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+# Gmail rechaza mensajes de más de 25 MB (ya codificados, adjuntos incluidos)
+MAX_MESSAGE_BYTES = 25 * 1024 * 1024
+# Por encima de este tamaño el mensaje se sube por el endpoint de carga
+# reanudable en vez de ir en base64 dentro del JSON de la petición
+INLINE_LIMIT = 5 * 1024 * 1024
+# Trozos de la subida reanudable (múltiplo de 256 KB)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Holgura para las cabeceras MIME de cada adjunto en la estimación rápida
+PART_HEADER_BYTES = 512
+
+
+# Hash del contenido de un adjunto (detecta el mismo archivo subido dos veces)
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+# Quitar adjuntos repetidos por contenido. Devuelve (únicos, [(repetido, original)]).
+# `key` calcula el hash de cada elemento (por defecto, el de su 'content').
+def dedupe_attachments(attachments, key=None):
+    key = key or (lambda attachment: content_hash(attachment['content']))
+    unique = {}
+    duplicates = []
+    for attachment in attachments:
+        digest = key(attachment)
+        if digest in unique:
+            duplicates.append((attachment, unique[digest]))
+        else:
+            unique[digest] = attachment
+    return list(unique.values()), duplicates
+
+
+# Tamaño exacto en base64 MIME (líneas de 76 caracteres) de `n` bytes
+def encoded_size(n):
+    chars = 4 * ((n + 2) // 3)
+    return chars + (chars + 75) // 76
+
+
+# Estimación rápida (sin codificar nada) del tamaño que suman los adjuntos en el mensaje
+def estimated_size(sizes):
+    return sum(encoded_size(size) + PART_HEADER_BYTES for size in sizes)
+
+
+# Crear la parte MIME de un adjunto ({'name': ..., 'content': bytes}) ya codificada en base64
+def build_attachment_part(attachment):
+    filename = attachment['name']
+    content = attachment['content']
+
+    # Detectar el tipo MIME correcto
+    mime_type, _ = mimetypes.guess_type(filename)
+    if mime_type is None:
+        mime_type = 'application/octet-stream'
+
+    # Separar el tipo MIME principal y subtipo
+    maintype, subtype = mime_type.split('/', 1)
+
+    # Crear la parte del adjunto con el tipo MIME correcto
+    part = MIMEBase(maintype, subtype)
+    part.set_payload(content)
+    encoders.encode_base64(part)
+
+    # Agregar header con el nombre del archivo
+    part.add_header(
+        'Content-Disposition',
+        f'attachment; filename="{filename}"'
+    )
+    return part
+
+
+# Cuerpo de un correo con sus propios adjuntos (p. ej. un documento generado
+# para ese destinatario): sigue siendo el texto del cuerpo, pero lleva los
+# archivos consigo por la cola de envío, los lotes y los reintentos
+class BodyWithAttachments(str):
+    def __new__(cls, body, attachments):
+        self = super().__new__(cls, body)
+        self.attachments = list(attachments)
+        return self
+
+
+# Adjuntos propios del destinatario (ninguno si el cuerpo es texto simple)
+def recipient_attachments(body):
+    return getattr(body, 'attachments', ())
+
+
+# Adjuntos precompilados: se codifican UNA SOLA VEZ para toda la campaña.
+# El mensaje final es: cabeceras + cuerpo (por destinatario) seguido del bloque
+# de adjuntos (común). Como base64 codifica de 3 en 3 bytes, si la parte variable
+# mide un múltiplo de 3 el "raw" completo es la concatenación de ambas partes
+# codificadas por separado; para lograrlo se rellena con 0-2 espacios la línea
+# delimitadora del primer adjunto (relleno de transporte permitido por RFC 2046).
+class PrecompiledAttachments:
+    # Base64 del bloque común cuando está en disco (ver spill())
+    _encoded_view = None
+
+    def __init__(self, attachments):
+        self.names = [a['name'] for a in attachments]
+        self.boundary = f"==============={uuid.uuid4().hex}=="
+        delimiter = f"\n--{self.boundary}\n".encode()
+        parts = [build_attachment_part(a).as_bytes() for a in attachments]
+        self.block = delimiter.join(parts) + f"\n--{self.boundary}--\n".encode()
+        self.size = len(self.block)
+        # Los mensajes grandes se suben tal cual (sin base64 adicional)
+        self.upload = self.size > INLINE_LIMIT
+        self.encoded = None if self.upload else base64.urlsafe_b64encode(self.block).decode()
+
+    def __len__(self):
+        return len(self.names)
+
+    # Cabeceras, cuerpo y adjuntos propios de un destinatario, abiertos hacia
+    # la línea del primer adjunto común
+    def head(self, to, subject, body):
+        message = MIMEMultipart(boundary=self.boundary)
+        message['to'] = to
+        message['subject'] = subject
+        message.attach(MIMEText(body, 'plain', 'utf-8'))
+        for attachment in recipient_attachments(body):
+            message.attach(build_attachment_part(attachment))
+
+        # Quitar el cierre del multipart y abrir la línea del primer adjunto
+        head = message.as_bytes()
+        closing = f"\n--{self.boundary}--\n".encode()
+        if head.endswith(closing):
+            head = head[:-len(closing)]
+        head += f"\n--{self.boundary}".encode()
+        padding = (-(len(head) + 1)) % 3
+        head += b' ' * padding + b'\n'
+        return head
+
+    # Construir el "raw" de un destinatario reutilizando el bloque ya codificado
+    def build_raw(self, to, subject, body):
+        return self.encode(self.head(to, subject, body))
+
+    # Codificar en base64 la cabecera de un destinatario y pegarle el bloque común
+    def encode(self, head):
+        if self._encoded_view is not None:
+            return base64.urlsafe_b64encode(head).decode() + str(self._encoded_view, 'ascii')
+        if self.encoded is None:
+            return base64.urlsafe_b64encode(head + self.block).decode()
+        return base64.urlsafe_b64encode(head).decode() + self.encoded
+
+    # Tamaño exacto del mensaje de un destinatario (antes del base64 de la API)
+    def message_size(self, to, subject, body):
+        return len(self.head(to, subject, body)) + self.size
+
+    # Mensaje completo como flujo de lectura para la subida por trozos: las
+    # cabeceras y el bloque común se leen en su sitio, sin copiarlos en un blob
+    def open_stream(self, to, subject, body):
+        return ConcatStream([self.head(to, subject, body), self.block])
+
+    # Pasar el bloque común (y su base64) a un archivo en disco y leerlos desde
+    # ahí (mmap): dejan de ocupar memoria del proceso (ver correo.memory). El
+    # archivo se borra en cuanto queda mapeado; el mapa vive con el objeto.
+    def spill(self, path):
+        encoded = (self.encoded or '').encode('ascii')
+        with open(path, 'wb') as f:
+            f.write(self.block)
+            f.write(encoded)
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            os.remove(path)
+        except OSError:
+            # En Windows no se puede borrar un archivo mapeado: queda en la carpeta de datos
+            pass
+        view = memoryview(self._map)
+        self.block = view[:self.size]
+        if encoded:
+            self._encoded_view = view[self.size:]
+            self.encoded = None
+
+
+# Flujo de solo lectura sobre varios bloques de bytes (con seek, como pide MediaIoBaseUpload)
+class ConcatStream(io.RawIOBase):
+    def __init__(self, chunks):
+        self._chunks = [memoryview(c) for c in chunks]
+        self._size = sum(len(c) for c in self._chunks)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._pos = max(0, min(offset, self._size))
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size - self._pos
+        out = []
+        pos = self._pos
+        start = 0
+        for chunk in self._chunks:
+            end = start + len(chunk)
+            if size > 0 and pos < end:
+                piece = chunk[pos - start:pos - start + size]
+                out.append(piece.tobytes())
+                pos += len(piece)
+                size -= len(piece)
+            start = end
+        self._pos = pos
+        return b''.join(out)
+
+
+# Preparar los adjuntos de una campaña (None si no hay)
+def precompile_attachments(attachments):
+    if not attachments:
+        return None
+    return PrecompiledAttachments(attachments)
@@ -0,0 +1,243 @@
+import threading
+
+import requests
+
+from correo.clients import GmailClientPool
+from correo.gmail import can_draft, create_draft, delete_draft, send_draft, send_message
+from correo.metrics import NO_METRICS
+from correo.ratelimit import QUOTA_UNITS, TokenBucket, gmail_limiter
+from correo.retry import call_with_retry, failure_message
+from correo.sender import bounded_sends
+from correo.validation import COUNTRY_CODE
+
+# API de WhatsApp Business (Cloud API) de Meta
+WHATSAPP_API_URL = 'https://graph.facebook.com'
+WHATSAPP_API_VERSION = 'v19.0'
+# Mensajes por segundo por número de teléfono (límite por defecto de la Cloud API)
+WHATSAPP_RATE = 80
+# Códigos de error de la Cloud API que indican exceso de velocidad
+WHATSAPP_RATE_LIMIT_CODES = (130429, 131056, 80007)
+
+
+# Backend de entrega: quien envía (la cola programada o un bucle de la UI) solo
+# llama a deliver(destinatario, asunto, cuerpo) y recibe (success, msg) con el
+# mismo contrato que send_email().
+# `metrics` (SendMetrics) recibe el tiempo por etapa; quien lanza el envío puede reemplazarlo.
+class DeliveryBackend:
+    name = ''
+    metrics = NO_METRICS
+
+    def deliver(self, to, subject, body):
+        raise NotImplementedError
+
+    # Varios envíos: items de (clave, destinatario, asunto, cuerpo) -> (clave, success, msg).
+    # Por defecto uno tras otro; los backends con API HTTP envían en paralelo.
+    def deliver_many(self, items):
+        for key, to, subject, body in items:
+            success, msg = self.deliver(to, subject, body)
+            yield key, success, msg
+
+    # Liberar recursos (clientes, navegador) al terminar la campaña
+    def close(self):
+        pass
+
+
+# Correo por la API de Gmail con un cliente prestado del pool. También puede
+# dejar los mensajes preparados como borradores (stage_many) y enviarlos más
+# tarde solo por su id (send_drafts), con `workers` llamadas en paralelo.
+class GmailBackend(DeliveryBackend):
+    name = 'gmail'
+
+    def __init__(self, credentials, attachments=None, client_pool=None, limiter=None, workers=1):
+        self.credentials = credentials
+        self.attachments = attachments
+        self.client_pool = client_pool or GmailClientPool()
+        self.limiter = limiter or gmail_limiter()
+        self.workers = max(1, int(workers))
+
+    def _call(self, call, units):
+        def leased():
+            with self.client_pool.lease(self.credentials) as service:
+                return call(service)
+        return call_with_retry(leased, self.limiter, units, metrics=self.metrics)
+
+    def _send(self, to, subject, body):
+        with self.client_pool.lease(self.credentials) as service:
+            return send_message(service, to, subject, body, self.attachments, self.metrics)
+
+    def deliver(self, to, subject, body):
+        try:
+            sent = call_with_retry(
+                lambda: self._send(to, subject, body), self.limiter, QUOTA_UNITS['messages.send'], metrics=self.metrics
+            )
+            return True, f"Mensaje enviado! ID: {sent['id']}"
+        except Exception as e:
+            return False, failure_message(e)
+
+    # Subir el mensaje como borrador: (True, id del borrador) o (False, motivo)
+    def stage(self, to, subject, body):
+        try:
+            draft_id = self._call(
+                lambda service: create_draft(service, to, subject, body, self.attachments, self.metrics),
+                QUOTA_UNITS['drafts.create']
+            )
+            return True, draft_id
+        except Exception as e:
+            return False, failure_message(e)
+
+    # Varios borradores en paralelo: items de (clave, destinatario, asunto, cuerpo)
+    # -> (clave, success, id del borrador o motivo). Sin el scope de borradores
+    # no se llama a la API: todas las filas fallan y se envían normalmente.
+    def stage_many(self, items):
+        if not can_draft(self.credentials):
+            return [(key, False, "La cuenta no autorizó el permiso de borradores (gmail.compose)")
+                    for key, *_ in items]
+        return bounded_sends(self.stage, items, self.workers, thread_name_prefix='gmail-draft')
+
+    def send_draft(self, draft_id):
+        try:
+            sent = self._call(lambda service: send_draft(service, draft_id, self.metrics), QUOTA_UNITS['drafts.send'])
+            return True, f"Mensaje enviado! ID: {sent['id']}"
+        except Exception as e:
+            return False, failure_message(e)
+
+    # Enviar borradores ya preparados: items de (clave, destinatario, asunto, id del borrador)
+    def send_drafts(self, items):
+        return bounded_sends(
+            lambda to, subject, draft_id: self.send_draft(draft_id), items, self.workers,
+            thread_name_prefix='gmail-send'
+        )
+
+    # Borrar un borrador que ya no se enviará (p. ej. al cancelar la campaña)
+    def discard_draft(self, draft_id):
+        try:
+            self._call(lambda service: delete_draft(service, draft_id), QUOTA_UNITS['drafts.delete'])
+            return True, ''
+        except Exception as e:
+            return False, failure_message(e)
+
+
+# WhatsApp Web con pywhatkit (necesita un navegador en la máquina que envía).
+# `to` es el celular a 10 dígitos; el asunto no se usa.
+class PyWhatKitBackend(DeliveryBackend):
+    name = 'pywhatkit'
+
+    def __init__(self, interval=15, wait_time=15, close_time=3):
+        try:
+            import pywhatkit
+        except Exception as e:
+            raise RuntimeError(f"pywhatkit no disponible — instala pywhatkit y ejecuta localmente ({e})")
+        self._pwk = pywhatkit
+        self.wait_time = wait_time
+        self.close_time = close_time
+        # Un envío cada `interval` segundos contados desde el inicio del anterior
+        self.limiter = TokenBucket(1 / interval, capacity=1)
+
+    def deliver(self, to, subject, body):
+        self.metrics.observe('backoff', self.limiter.acquire())
+        try:
+            self._pwk.sendwhatmsg_instantly(
+                f"+{COUNTRY_CODE}{to}", body,
+                wait_time=self.wait_time, tab_close=True, close_time=self.close_time
+            )
+            return True, "Mensaje enviado por WhatsApp"
+        except Exception as e:
+            return False, f"Error: {str(e)}"
+
+
+# Error devuelto por la API de WhatsApp
+class WhatsAppApiError(Exception):
+    def __init__(self, status, message, code=None, retry_after=None):
+        super().__init__(f"HTTP {status}: {message}" + (f" (código {code})" if code else ''))
+        self.status = status
+        self.code = code
+        # Mismo acceso que HttpError.resp para reutilizar backoff_delay()
+        self.resp = {'status': status, 'retry-after': retry_after}
+
+    @property
+    def rate_limited(self):
+        return self.status == 429 or self.code in WHATSAPP_RATE_LIMIT_CODES
+
+    # Exceso de velocidad o fallo del servidor: se reintenta; el resto (4xx) falla de inmediato
+    @property
+    def retryable(self):
+        return self.rate_limited or self.status >= 500
+
+
+# WhatsApp por API HTTP (estilo Cloud API): varias peticiones en paralelo, cada
+# hilo con su sesión HTTP persistente y todos con un limitador compartido.
+# `to` es el celular a 10 dígitos; el asunto no se usa.
+class WhatsAppCloudBackend(DeliveryBackend):
+    name = 'whatsapp_cloud'
+
+    def __init__(self, token, phone_number_id, api_url=WHATSAPP_API_URL, api_version=WHATSAPP_API_VERSION,
+                 rate=WHATSAPP_RATE, workers=8, max_retries=5, timeout=30):
+        self.url = f"{api_url.rstrip('/')}/{api_version}/{phone_number_id}/messages"
+        self.headers = {'Authorization': f"Bearer {token}"}
+        self.limiter = TokenBucket(rate, capacity=max(1, rate))
+        self.workers = max(1, int(workers))
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def _post(self, to, body):
+        with self.metrics.timer('api'):
+            response = self._session().post(
+                self.url,
+                json={
+                    'messaging_product': 'whatsapp',
+                    'to': f"{COUNTRY_CODE}{to}",
+                    'type': 'text',
+                    'text': {'body': body},
+                },
+                timeout=self.timeout
+            )
+        if response.status_code >= 400:
+            try:
+                error = response.json().get('error', {})
+            except ValueError:
+                error = {}
+            raise WhatsAppApiError(
+                response.status_code,
+                error.get('message') or response.reason,
+                error.get('code'),
+                response.headers.get('Retry-After')
+            )
+        return response.json()['messages'][0]['id']
+
+    def deliver(self, to, subject, body):
+        try:
+            message_id = call_with_retry(
+                lambda: self._post(to, body), self.limiter, 1, self.max_retries, metrics=self.metrics
+            )
+        except Exception as e:
+            return False, failure_message(e)
+        return True, f"Mensaje enviado! ID: {message_id}"
+
+    def deliver_many(self, items):
+        return bounded_sends(self.deliver, items, self.workers, thread_name_prefix='whatsapp-send')
+
+    def close(self):
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+
+BACKENDS = {
+    GmailBackend.name: GmailBackend,
+    PyWhatKitBackend.name: PyWhatKitBackend,
+    WhatsAppCloudBackend.name: WhatsAppCloudBackend,
+}
@@ -0,0 +1,342 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import timeit
+
+import pandas as pd
+
+from correo.paths import data_path
+
+# Modos de envío que se comparan (mismos que en la app), el envío concurrente
+# desde la campaña compilada en disco y la lectura de la bandeja
+MODES = ('uno', 'lotes', 'concurrente', 'cuentas', 'spool', 'bandeja')
+SHEET_SIZES = (1000, 10000, 100000)
+ATTACHMENT_SIZES_MB = (0, 1, 5, 20)
+SUBJECT = "Hola {Nombre}"
+BODY = "Estimado/a {Nombre},\n\nTe contactamos al {Celular}.\n\nSaludos cordiales"
+
+
+# Hoja de contactos sintética (se genera una vez y se reutiliza entre corridas)
+def make_sheet(rows, fmt='csv', workdir=None):
+    path = os.path.join(workdir or data_path('bench'), f'contactos_{rows}.{fmt}')
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df = pd.DataFrame({
+            'Nombre': [f'Contacto {i}' for i in range(rows)],
+            'Celular': [f'55{i:08d}' for i in range(rows)],
+            'email': [f'contacto{i}@example.com' for i in range(rows)],
+        })
+        if fmt == 'xlsx':
+            df.to_excel(path, index=False)
+        elif fmt == 'parquet':
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+    return path
+
+
+def make_attachment(size_mb):
+    return {'name': f'adjunto_{size_mb}mb.pdf', 'content': os.urandom(int(size_mb * 1024 * 1024))}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+# Correos de la hoja: lectura por lotes + personalización por columnas, como en la app
+def sheet_items(sheet, metrics):
+    from correo.loader import iter_contact_batches
+    from correo.render import render_campaign
+
+    with open(sheet, 'rb') as f:
+        for batch in iter_contact_batches(f, os.path.basename(sheet)):
+            with metrics.timer('render', n=max(1, len(batch))):
+                rendered = render_campaign(batch, SUBJECT, BODY)
+            yield from zip(rendered.index, rendered['email'], rendered['asunto'], rendered['mensaje'])
+
+
+# Resultados (clave, success, msg) de un modo de envío, con la misma cola de
+# reintentos al final que la campaña de la app
+def mode_results(mode, items, attachments, workers, batch_size, units_per_sec, metrics, cooldown=1, accounts=1,
+                 workdir=None):
+    from google.oauth2.credentials import Credentials
+
+    from correo.accounts import PooledSender, SenderPool
+
+    from correo.backends import GmailBackend
+    from correo.clients import GmailClientPool, build_gmail_service
+    from correo.gmail import send_batch
+    from correo.ratelimit import gmail_limiter
+    from correo.retry import with_retry_queue
+    from correo.sender import ConcurrentSender
+
+    credentials = Credentials(token='benchmark')
+    limiter = gmail_limiter(units_per_sec)
+    if mode == 'uno':
+        backend = GmailBackend(credentials, attachments, GmailClientPool(), limiter)
+        backend.metrics = metrics
+        send_many = backend.deliver_many
+    elif mode == 'cuentas':
+        # Pool de `accounts` cuentas sintéticas, cada una con su propia cuota
+        path = os.path.join(workdir or data_path('bench'), f'senders_{os.getpid()}.sqlite3')
+        pool = SenderPool('benchmark', path)
+        for i in range(accounts):
+            pool.add_oauth(f'remitente{i}@example.com', json.dumps({
+                'token': f'benchmark-{i}', 'refresh_token': f'benchmark-{i}', 'client_id': 'benchmark',
+                'client_secret': 'benchmark', 'expiry': '2100-01-01T00:00:00Z',
+            }), daily_limit=10 ** 9, units_per_sec=units_per_sec)
+        sender = PooledSender(pool, workers * accounts, GmailClientPool(), metrics)
+
+        def send_many(items):
+            return sender.send(items, attachments)
+    elif mode == 'lotes':
+        service = build_gmail_service(credentials)
+
+        def send_many(items):
+            for results in send_batch(service, items, attachments, batch_size, limiter, metrics):
+                yield from results
+    else:
+        sender = ConcurrentSender(credentials, workers, limiter, metrics=metrics)
+
+        def send_many(items):
+            return sender.send(items, attachments)
+    return with_retry_queue(send_many, items, cooldown=cooldown, metrics=metrics)
+
+
+# Leer la bandeja: listar y pedir los metadatos por lotes (como la sincronización inicial)
+def inbox_results(rows, units_per_sec):
+    from google.oauth2.credentials import Credentials
+
+    from correo.clients import build_gmail_service
+    from correo.inbox import fetch_metadata, list_message_ids
+    from correo.ratelimit import gmail_limiter
+
+    service = build_gmail_service(Credentials(token='benchmark'))
+    start = time.perf_counter()
+    ids = [m['id'] for m in list_message_ids(service, rows)]
+    found, errors = fetch_metadata(service, ids, limiter=gmail_limiter(units_per_sec))
+    elapsed = time.perf_counter() - start
+    # Latencia por mensaje = tiempo total repartido (las llamadas van en lotes)
+    return len(found), len(errors), [elapsed / max(1, len(ids))] * len(ids)
+
+
+# Una corrida (en su propio proceso, para medir su memoria pico y su CPU)
+def run_scenario(mode, rows, attachment_mb, workers, batch_size, units_per_sec, fmt, workdir, accounts=1):
+    from correo.attachments import precompile_attachments
+    from correo.metrics import SendMetrics
+
+    sheet = make_sheet(rows, fmt, workdir)
+    metrics = SendMetrics()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_start = usage.ru_utime + usage.ru_stime
+    start = time.perf_counter()
+    compile_seconds = None
+
+    if mode == 'bandeja':
+        sent, errors, latencies = inbox_results(rows, units_per_sec)
+    else:
+        attachments = precompile_attachments([make_attachment(attachment_mb)] if attachment_mb else None)
+        items = sheet_items(sheet, metrics)
+        spool = None
+        if mode == 'spool':
+            from correo.spool import compile_spool, remove_spool
+
+            # Compilar primero; el envío (concurrente) solo lee los mensajes del archivo
+            spool = compile_spool(
+                os.path.join(workdir or data_path('bench'), f'campana_{os.getpid()}.spool'), items, attachments
+            )
+            compile_seconds = round(time.perf_counter() - start, 3)
+            attachments, items = spool, spool.items()
+        started = {}
+
+        # Marcar cuándo sale cada correo del generador para medir su latencia
+        def timed(items):
+            for item in items:
+                started[item[0]] = time.perf_counter()
+                yield item
+
+        sent = errors = 0
+        latencies = []
+        for key, success, msg in mode_results(
+            mode, timed(items), attachments, workers, batch_size, units_per_sec, metrics,
+            accounts=accounts, workdir=workdir
+        ):
+            latencies.append(time.perf_counter() - started.pop(key))
+            if success:
+                sent += 1
+            else:
+                errors += 1
+        if spool is not None:
+            spool.close()
+            remove_spool(spool.path)
+
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    total = sent + errors
+    return {
+        'mode': mode if mode != 'cuentas' else f'cuentas x{accounts}',
+        'rows': rows,
+        'attachment_mb': attachment_mb,
+        'sent': sent,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        # Parte del tiempo total que llevó compilar la campaña (modo spool)
+        'compile_seconds': compile_seconds,
+        'msgs_per_sec': round(total / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        # ru_maxrss está en KB en Linux y en bytes en macOS
+        'peak_rss_mb': round(usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+        'cpu_ms_per_msg': round((usage.ru_utime + usage.ru_stime - cpu_start) * 1000 / max(1, total), 3),
+        # Tiempo medio por mensaje en cada etapa (ms)
+        'stage_ms': {stage: round(h['mean'] * 1000, 3) for stage, h in metrics.snapshot()['stages'].items()},
+        'retries': metrics.retries,
+    }
+
+
+# Microbenchmarks de las funciones que corren por fila (personalización de plantillas)
+# y de la canonicalización de encabezados (corre en cada rerun de la app)
+def run_micro(rows=100000):
+    from correo.loader import canonicalize_columns, normalize_colname
+    from correo.render import compile_template, render_campaign
+
+    df = pd.read_csv(make_sheet(rows))
+    row = {'Nombre': 'Juan', 'Celular': '5512345678', 'email': 'juan@example.com'}
+    template = compile_template(BODY)
+    n = 100000
+    results = {
+        'render_one_us': timeit.timeit(lambda: template.render_one(row), number=n) / n * 1e6,
+        f'render_campaign_{rows}_ms': timeit.timeit(lambda: render_campaign(df, SUBJECT, BODY), number=3) / 3 * 1e3,
+        'canonicalize_columns_us': timeit.timeit(lambda: canonicalize_columns(df), number=1000) / 1000 * 1e6,
+        'normalize_colname_uncached_us': timeit.timeit(
+            lambda: normalize_colname.__wrapped__('Número de Teléfono'), number=n
+        ) / n * 1e6,
+    }
+    return {k: round(v, 3) for k, v in results.items()}
+
+
+# Arranque en frío de la línea de comandos: cada comando corre en un proceso
+# nuevo (como un cron) y se toma la mediana de `repeat` corridas, en segundos
+def run_startup(workdir=None, repeat=5):
+    sheet = make_sheet(100, 'csv', workdir)
+    template = os.path.join(os.path.dirname(sheet), 'cuerpo.txt')
+    with open(template, 'w', encoding='utf-8') as f:
+        f.write(BODY)
+    commands = {
+        'import correo.cli': [sys.executable, '-c', 'import correo.cli'],
+        'correo --help': [sys.executable, '-m', 'correo', '--help'],
+        'import correo.campaign': [sys.executable, '-c', 'import correo.campaign'],
+        'correo send --dry-run (100 filas)': [
+            sys.executable, '-m', 'correo', 'send', '--sheet', sheet, '--template', template,
+            '--subject', SUBJECT, '--dry-run', '--no-suppression'
+        ],
+    }
+    results = {}
+    for name, command in commands.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+        results[name] = round(percentile(times, 50), 3)
+    return results
+
+
+# Arrancar el servidor de prueba de Gmail en otro proceso (su CPU no cuenta en la medición)
+def start_mock(latency, error_rate, throttle_rate, rate, mailbox_size):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'correo.gmail_mock', '--port', '0', '--latency', str(latency),
+         '--error-rate', str(error_rate), '--throttle-rate', str(throttle_rate), '--rate', str(rate),
+         '--mailbox-size', str(mailbox_size)],
+        stdout=subprocess.PIPE, text=True
+    )
+    url = process.stdout.readline().strip()
+    return process, url
+
+
+def print_table(results):
+    columns = ['mode', 'rows', 'attachment_mb', 'sent', 'errors', 'msgs_per_sec', 'p50_ms', 'p99_ms',
+               'peak_rss_mb', 'cpu_ms_per_msg', 'compile_seconds']
+    print(pd.DataFrame(results, columns=columns).to_string(index=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de los modos de envío contra un Gmail local de prueba")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['uno', 'lotes', 'concurrente'])
+    parser.add_argument('--rows', nargs='+', type=int, default=[1000],
+                        help=f"tamaños de hoja (p. ej. {' '.join(map(str, SHEET_SIZES))})")
+    parser.add_argument('--attachments-mb', nargs='+', type=float, default=[0],
+                        help=f"tamaño del adjunto en MB (p. ej. {' '.join(map(str, ATTACHMENT_SIZES_MB))})")
+    parser.add_argument('--format', default='csv', choices=['csv', 'xlsx', 'parquet'])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--accounts', nargs='+', type=int, default=[1, 2, 4],
+                        help="cuentas remitentes en el modo 'cuentas' (hilos = workers por cuenta)")
+    parser.add_argument('--units-per-sec', type=float, default=1e9,
+                        help="cuota del limitador (por defecto sin límite; Gmail real: 250)")
+    parser.add_argument('--latency', type=float, default=0.05, help="latencia del servidor por llamada (s)")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fracción de llamadas con 429")
+    parser.add_argument('--rate', type=int, default=0, help="llamadas/s antes de responder 429 (0 = sin límite)")
+    parser.add_argument('--workdir', default=None, help="carpeta de las hojas sintéticas")
+    parser.add_argument('--json', default=None, help="guardar los resultados en este archivo")
+    parser.add_argument('--micro', action='store_true', help="medir también la personalización por fila")
+    parser.add_argument('--startup', action='store_true', help="medir solo el arranque en frío de la línea de comandos")
+    parser.add_argument('--scenario', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # Proceso hijo: una sola corrida, resultado en JSON por stdout
+    if args.scenario:
+        print(json.dumps(run_scenario(**json.loads(args.scenario))))
+        return
+    if args.startup:
+        print(json.dumps(run_startup(args.workdir), indent=2))
+        return
+
+    mock, url = start_mock(args.latency, args.error_rate, args.throttle_rate, args.rate, max(args.rows))
+    env = dict(os.environ, CORREO_GMAIL_ENDPOINT=url)
+    results = []
+    try:
+        for rows in args.rows:
+            make_sheet(rows, args.format, args.workdir)
+            for attachment_mb in args.attachments_mb:
+                for mode in args.modes:
+                    if mode == 'bandeja' and attachment_mb:
+                        continue
+                    for accounts in (args.accounts if mode == 'cuentas' else [1]):
+                        scenario = {
+                            'mode': mode, 'rows': rows, 'attachment_mb': attachment_mb, 'workers': args.workers,
+                            'batch_size': args.batch_size, 'units_per_sec': args.units_per_sec,
+                            'fmt': args.format, 'workdir': args.workdir, 'accounts': accounts,
+                        }
+                        out = subprocess.run(
+                            [sys.executable, '-m', 'correo.bench', '--scenario', json.dumps(scenario)],
+                            env=env, capture_output=True, text=True, check=True
+                        )
+                        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+                        print(f"{results[-1]['mode']:>12} {rows:>7} filas {attachment_mb:>5} MB: "
+                              f"{results[-1]['msgs_per_sec']} msg/s", file=sys.stderr)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print_table(results)
+    report = {'results': results}
+    if args.micro:
+        report['micro'] = run_micro()
+        print(json.dumps(report['micro'], indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+# `python -m correo.bench --rows 1000 10000 --attachments-mb 0 1 5`
+if __name__ == '__main__':
+    main()
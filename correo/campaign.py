@@ -0,0 +1,198 @@
+import functools
+
+from correo.clients import refresh_if_needed
+from correo.gmail import send_batch, send_message
+from correo.jobs import until_cancelled
+from correo.journal import recipient_hash
+from correo.loader import iter_contact_batches
+from correo.metrics import NO_METRICS
+from correo.render import compile_template, render_campaign
+from correo.retry import call_with_retry, failure_message, with_retry_queue
+from correo.validation import ContactValidator
+
+# Función para enviar correo MEJORADA
+# Con `limiter` espera cuota antes de cada intento; los errores de cuota y
+# transitorios (5xx, red) se reintentan con espera exponencial y los
+# permanentes (p. ej. dirección inválida) fallan de inmediato.
+def send_email(service, to, subject, body, attachments=None, metrics=NO_METRICS, limiter=None):
+    try:
+        # Crear, codificar y enviar el mensaje
+        sent = call_with_retry(
+            lambda: send_message(service, to, subject, body, attachments, metrics),
+            limiter, metrics=metrics
+        )
+
+        return True, f"Mensaje enviado! ID: {sent['id']}"
+    except Exception as e:
+        return False, failure_message(e)
+
+
+# Helper: formato seguro para plantillas que puede manejar claves faltantes
+def safe_format(template, row):
+    import pandas as pd
+
+    # Proveer valores por defecto (cadena vacía) si alguna clave falta
+    vals = {
+        'Nombre': '',
+        'Celular': '',
+        'email': ''
+    }
+    try:
+        for k in vals.keys():
+            if k in row and pd.notna(row[k]):
+                vals[k] = str(row[k])
+    except Exception:
+        # row puede ser un dict o Series; si falla, seguir con defaults
+        pass
+
+    # La plantilla se analiza una sola vez (compile_template usa caché);
+    # TemplateError indica un campo desconocido o una llave sin cerrar
+    return compile_template(template).render_one(vals)
+
+
+# Enviar uno por uno con send_email(), esperando cuota antes de cada correo
+def send_one_by_one(service, items, attachments, limiter, metrics=NO_METRICS):
+    for key, to, subject, body in items:
+        # Pasar los adjuntos preparados (no leer de nuevo)
+        success, msg = send_email(service, to, subject, body, attachments, metrics, limiter)
+        yield key, success, msg
+
+
+# Recorrer el archivo de contactos por lotes, personalizar cada lote por columnas
+# y producir solo las filas pendientes: ((fila, correo, hash), correo, asunto, cuerpo).
+# Con `documents` (DocumentTemplate) cada correo lleva además su documento,
+# generado en un pool de procesos por delante del envío.
+def campaign_items(job, data, filename, columns, subject_template, message_template, ya_enviados, suppressed=None,
+                   documents=None):
+    rows = _pending_rows(job, data, filename, columns, subject_template, message_template, ya_enviados, suppressed)
+    if documents is None:
+        for item, _ in rows:
+            yield item
+    else:
+        from correo.documents import with_documents
+
+        yield from with_documents(rows, documents, metrics=job.metrics)
+
+
+# Filas pendientes de la campaña como (item, campos de la fila)
+def _pending_rows(job, data, filename, columns, subject_template, message_template, ya_enviados, suppressed=None):
+    # Descartar vacíos, inválidos, duplicados y suprimidos antes de gastar cuota
+    validator = ContactValidator('email', suppressed)
+    for batch in iter_contact_batches(data, filename):
+        # Mismos nombres de columna (canonicalizados/mapeados) que la vista previa
+        batch.columns = columns
+        _, motivos = validator.check(batch['email'])
+        validos = motivos == ''
+        if not validos.all():
+            job.add_rejected(int((~validos).sum()))
+            batch = batch[validos]
+        with job.metrics.timer('render', n=max(1, len(batch))):
+            rendered = render_campaign(batch, subject_template, message_template)
+        for idx, nombre, celular, email, asunto, mensaje in zip(
+            rendered.index, rendered['Nombre'], rendered['Celular'], rendered['email'],
+            rendered['asunto'], rendered['mensaje']
+        ):
+            h = recipient_hash(email, asunto, mensaje)
+            if h in ya_enviados:
+                job.add_skipped()
+                continue
+            yield ((idx, email, h), email, asunto, mensaje), {'Nombre': nombre, 'Celular': celular, 'email': email}
+
+
+# Renovar el token con margen a medida que se consumen los correos de la campaña
+def refreshing(items, credentials):
+    for item in items:
+        refresh_if_needed(credentials)
+        yield item
+
+
+# Resultados de una campaña según el modo elegido (corre en el hilo del trabajo).
+# Los correos que fallan por errores transitorios se reenvían al final de la
+# campaña (cola de reintentos) antes de darlos por perdidos.
+def campaign_results(job, credentials, send_mode, items, attachments, limiter, client_pool, batch_size=50, workers=4,
+                     sender_pool=None):
+    # `items` es una fábrica: los correos se generan dentro del hilo del trabajo
+    items = items(job)
+    if send_mode.startswith("Varias cuentas"):
+        from correo.accounts import PooledSender
+
+        # Cada correo sale por la siguiente cuenta del pool con cuota disponible
+        sender = PooledSender(sender_pool, workers, client_pool=client_pool, metrics=job.metrics)
+        send_many = functools.partial(sender.send, attachments=attachments)
+    elif send_mode.startswith("Concurrente"):
+        from correo.sender import ConcurrentSender
+
+        sender = ConcurrentSender(credentials, workers, limiter, client_pool=client_pool, metrics=job.metrics)
+        send_many = functools.partial(sender.send, attachments=attachments)
+    else:
+        send_many = functools.partial(
+            leased_results, client_pool, credentials, send_mode,
+            attachments=attachments, limiter=limiter, batch_size=batch_size, metrics=job.metrics
+        )
+    # Un resultado a la vez para reutilizar el mismo bucle de progreso. Al cancelar
+    # no entran filas nuevas (ni reintentos), pero los envíos en vuelo se reportan.
+    return ([r] for r in with_retry_queue(
+        lambda pending: send_many(until_cancelled(job, pending)), items, metrics=job.metrics
+    ))
+
+
+# Campaña compilada: si aún no hay spool en `path`, se arman todos los mensajes
+# una sola vez en disco (compile_spool) y luego se envían desde ahí con el modo
+# elegido, sin personalizar ni armar MIME durante el envío. Un spool que ya
+# existe se reutiliza tal cual (reenvíos y reanudaciones). `items` es la
+# fábrica de correos de campaign_items (todos, sin omitir enviados); al leer
+# el spool se saltan los de `ya_enviados` y se rechazan los que se agregaron a
+# la lista de supresión (`suppressed`) después de compilar.
+def spooled_results(job, path, items, attachments, ya_enviados=(), suppressed=None, **send_options):
+    from correo.spool import CampaignSpool, compile_lock, compile_spool, spool_exists
+
+    # Otro trabajo con el mismo contenido puede estar compilándolo: se espera y se reutiliza
+    with compile_lock(path):
+        if spool_exists(path):
+            spool = CampaignSpool(path)
+            # Las filas rechazadas al compilar siguen contando en el total del trabajo
+            job.add_rejected(spool.rejected)
+        else:
+            spool = compile_spool(path, items(job), attachments, job, name=job.name)
+    if spool is None:
+        return
+    suppressed = set(suppressed or ())
+
+    def spooled_items(job):
+        for item in spool.items(skip=lambda key: key[2] in ya_enviados, job=job):
+            if suppressed and item[1].strip().lower() in suppressed:
+                job.add_rejected()
+                continue
+            yield item
+
+    try:
+        yield from campaign_results(job, items=spooled_items, attachments=spool, **send_options)
+    finally:
+        spool.close()
+
+
+# El trabajo toma prestado su propio cliente de Gmail (no se comparte con el script)
+def leased_results(client_pool, credentials, send_mode, items, attachments, limiter, batch_size, metrics=NO_METRICS):
+    items = refreshing(items, credentials)
+    with client_pool.lease(credentials) as job_service:
+        if send_mode.startswith("Por lotes"):
+            for results in send_batch(job_service, items, attachments, batch_size, limiter, metrics):
+                yield from results
+        else:
+            yield from send_one_by_one(job_service, items, attachments, limiter, metrics)
+
+
+# Resultados de un envío masivo por un backend de entrega (p. ej. la API de
+# WhatsApp); el backend reporta sus tiempos en las métricas del trabajo
+def backend_results(job, backend, items):
+    backend.metrics = job.metrics
+    return ([r] for r in with_retry_queue(
+        lambda pending: backend.deliver_many(until_cancelled(job, pending)), items, metrics=job.metrics
+    ))
+
+
+# Resultados de `run(job)` cerrando `resource` al terminar, p. ej. la copia de la
+# hoja que el trabajo recorre (así el trabajo es dueño del archivo abierto)
+def closing_results(job, run, resource):
+    with resource:
+        yield from run(job)
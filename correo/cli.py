@@ -0,0 +1,374 @@
+import argparse
+import functools
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+
+# Solo módulos ligeros aquí: pandas, googleapiclient y compañía se importan
+# dentro de cada comando, así `python -m correo --help` arranca al instante.
+from correo.ratelimit import GMAIL_USER_UNITS_PER_SEC
+
+# Modos de envío de la línea de comandos -> el texto del modo en la UI
+SEND_MODES = {
+    'uno': "Uno por uno",
+    'lotes': "Por lotes (batch)",
+    'concurrente': "Concurrente (varios hilos)",
+    'cuentas': "Varias cuentas (pool)",
+}
+# Segundos entre líneas de progreso
+PROGRESS_SECONDS = 2
+# Correos de muestra que se imprimen con --dry-run
+DRY_RUN_SAMPLES = 3
+# Errores que se imprimen al terminar (todos quedan en el registro de la campaña)
+ERRORS_SHOWN = 20
+
+
+def read_text(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+# Contenido del archivo de contactos en memoria (pandas cierra los archivos que
+# recorre por lotes; el buffer se puede rebobinar) y su huella SHA-256, que
+# identifica la campaña igual que en la UI
+def read_sheet(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return io.BytesIO(data), hashlib.sha256(data).hexdigest()
+
+
+# Credenciales de la cuenta que envía: un token.json (el de credentials.to_json())
+# o la cuenta que la app guardó al programar una campaña
+def load_credentials(path=None, account=None):
+    from google.oauth2.credentials import Credentials
+
+    if path:
+        return Credentials.from_authorized_user_file(path)
+    if account:
+        from cryptography.fernet import InvalidToken
+
+        from correo.scheduler import Scheduler
+
+        scheduler = Scheduler()
+        try:
+            credentials_json = scheduler.account_credentials(account)
+        except InvalidToken:
+            raise SystemExit("No se pudieron descifrar las credenciales guardadas: usa la misma clave que la app "
+                             "(CORREO_SECRET_KEY)")
+        finally:
+            scheduler.close()
+        if credentials_json is None:
+            raise SystemExit(f"No hay credenciales guardadas para {account}: usa --credentials token.json")
+        return Credentials.from_authorized_user_info(json.loads(credentials_json))
+    raise SystemExit("Indica las credenciales con --credentials token.json (o CORREO_CREDENTIALS) o --account")
+
+
+# Correo de la cuenta de las credenciales (una llamada a getProfile)
+def account_email(credentials):
+    from correo.clients import build_gmail_service
+
+    return build_gmail_service(credentials).users().getProfile(userId='me').execute()['emailAddress']
+
+
+# Nombres de columna del archivo: canónicos (Nombre, email, Celular) más el mapeo manual
+def sheet_columns(file, filename, email_column=None, name_column=None, phone_column=None):
+    from correo.loader import canonicalize_columns, read_preview
+
+    df = canonicalize_columns(read_preview(file, filename, 1))
+    mapping = {email_column: 'email', name_column: 'Nombre', phone_column: 'Celular'}
+    df = df.rename(columns={col: target for col, target in mapping.items() if col})
+    if 'email' not in df.columns:
+        raise SystemExit(f"El archivo debe tener una columna de correo (usa --email-column). Columnas: {list(df.columns)}")
+    return df
+
+
+def progress_line(snap):
+    return (f"{snap['procesados']}/{snap['total']} procesados: {snap['enviados']} enviados, "
+            f"{snap['errores']} errores, {snap['omitidos']} omitidos, {snap['rechazados']} rechazados "
+            f"({snap['rate']:.1f} msg/s)")
+
+
+# Esperar a que termine el trabajo imprimiendo el progreso; Ctrl+C lo cancela
+# (los correos ya enviados quedan en el registro y se omiten al reanudar)
+def wait_for(job, quiet=False):
+    last = 0.0
+    while job.active:
+        try:
+            time.sleep(0.2)
+        except KeyboardInterrupt:
+            print("Cancelando (los enviados quedan registrados)...", file=sys.stderr)
+            job.cancel()
+            continue
+        if not quiet and time.monotonic() - last >= PROGRESS_SECONDS:
+            last = time.monotonic()
+            print(progress_line(job.snapshot()), file=sys.stderr)
+    return job.snapshot()
+
+
+def command_send(args):
+    from correo.attachments import MAX_MESSAGE_BYTES, BodyWithAttachments, estimated_size, precompile_attachments
+    from correo.campaign import campaign_items, campaign_results, spooled_results
+    from correo.clients import GmailClientPool
+    from correo.jobs import Job, JobRunner
+    from correo.journal import SendJournal, campaign_id
+    from correo.loader import count_rows
+    from correo.ratelimit import gmail_limiter
+    from correo.render import TemplateError, compile_template, render_campaign
+    from correo.validation import SuppressionList
+
+    subject_template = args.subject if args.subject is not None else read_text(args.subject_file)
+    message_template = read_text(args.template)
+    # Validar las plantillas antes de gastar cuota
+    try:
+        compile_template(subject_template)
+        compile_template(message_template)
+    except TemplateError as e:
+        raise SystemExit(f"Error en la plantilla: {e}. Usa solo {{Nombre}}, {{Celular}}, o {{email}}")
+
+    filename = os.path.basename(args.sheet)
+    sheet, digest = read_sheet(args.sheet)
+    attachments = []
+    for path in args.attach:
+        with open(path, 'rb') as f:
+            attachments.append({'name': os.path.basename(path), 'content': f.read()})
+    attachment_digests = [hashlib.sha256(att['content']).hexdigest() for att in attachments]
+    documents = None
+    doc_parts = []
+    if args.document:
+        from correo.documents import DocumentTemplate
+
+        with open(args.document, 'rb') as f:
+            content = f.read()
+        try:
+            documents = DocumentTemplate(os.path.basename(args.document), content, args.document_name)
+        except TemplateError as e:
+            raise SystemExit(f"Error en el documento: {e}")
+        doc_parts = [hashlib.sha256(content).hexdigest(), documents.output_name]
+    # Mismo contenido que en la app: archivo, plantillas, adjuntos (nombre y contenido) y documento
+    content_id = campaign_id(
+        digest, subject_template, message_template, *[att['name'] for att in attachments], *attachment_digests,
+        *doc_parts
+    )
+    attachments = precompile_attachments(attachments)
+    suppressed = None if args.no_suppression else SuppressionList().contacts('email')
+
+    header = sheet_columns(sheet, filename, args.email_column, args.name_column, args.phone_column)
+    columns = list(header.columns)
+    total = count_rows(sheet, filename)
+
+    # Tamaño exacto del mensaje (el del primer correo): si no cabe, no se gasta ni una llamada
+    sample_doc = None
+    if len(header) > 0 and (attachments is not None or documents is not None):
+        first = render_campaign(header, subject_template, message_template).iloc[0]
+        body = first['mensaje']
+        if documents is not None:
+            sample_doc = documents.render({'Nombre': first['Nombre'], 'Celular': first['Celular'], 'email': first['email']})
+            body = BodyWithAttachments(body, [sample_doc])
+        if attachments is not None:
+            message_size = attachments.message_size(first['email'], first['asunto'], body)
+        else:
+            message_size = estimated_size([len(sample_doc['content'])])
+        if message_size > MAX_MESSAGE_BYTES:
+            raise SystemExit(
+                f"Cada correo ocuparía {message_size / 1024 / 1024:.1f} MB; "
+                f"Gmail acepta como máximo {MAX_MESSAGE_BYTES / 1024 / 1024:.0f} MB por mensaje"
+            )
+
+    items = functools.partial(
+        campaign_items, data=sheet, filename=filename, columns=columns, subject_template=subject_template,
+        message_template=message_template, suppressed=suppressed
+    )
+
+    # Sin enviar: personalizar todo el archivo y contar lo que saldría (sin generar los documentos)
+    if args.dry_run:
+        if sample_doc is not None:
+            print(f"Documento del primer correo: {sample_doc['name']} ({len(sample_doc['content'])} bytes)")
+        conteo = Job(None, filename, total)
+        pendientes = 0
+        for _, email, asunto, mensaje in items(conteo, ya_enviados=set()):
+            if pendientes < DRY_RUN_SAMPLES:
+                print(f"Para: {email}\nAsunto: {asunto}\n\n{mensaje}\n{'-' * 40}")
+            pendientes += 1
+        print(f"Campaña {content_id}: {pendientes} correos por enviar de {total} filas "
+              f"({conteo.rechazados} rechazados por la validación)")
+        return 0
+
+    # Campaña compilada (mismo spool que la app para los mismos archivos)
+    spool_file = None
+    if args.spool or args.compile_only:
+        from correo.spool import spool_exists, spool_path
+
+        spool_file = spool_path(content_id)
+    if args.compile_only:
+        from correo.spool import compile_spool, remove_spool
+
+        remove_spool(spool_file)
+        conteo = Job(None, filename, total)
+        spool = compile_spool(spool_file, items(conteo, ya_enviados=set(), documents=documents), attachments, conteo,
+                              name=filename)
+        info = spool.summary()
+        spool.close()
+        print(f"Campaña {content_id} compilada en {spool_file}: {info['messages']} mensajes "
+              f"({info['bytes'] / 1024 / 1024:.1f} MB, {info['rejected']} rechazados por la validación)")
+        return 0
+
+    send_mode = SEND_MODES[args.mode]
+    sender_pool = credentials = None
+    if args.mode == 'cuentas':
+        from correo.accounts import SenderPool
+
+        if not args.account:
+            raise SystemExit("Indica con --account la cuenta dueña del pool de remitentes")
+        sender_pool = SenderPool(args.account)
+        if not len(sender_pool):
+            raise SystemExit(f"{args.account} no tiene cuentas remitentes en el pool: agrégalas desde la app")
+    else:
+        credentials = load_credentials(args.credentials, args.account)
+
+    # El registro para reanudar es por remitente, igual que en la app
+    camp_id = campaign_id(content_id, args.account or account_email(credentials))
+    journal = SendJournal()
+    journal.start_campaign(camp_id, filename, total)
+    ya_enviados = set() if args.no_resume else journal.completed(camp_id)
+    if ya_enviados:
+        print(f"Reanudando campaña {camp_id}: se omitirán {len(ya_enviados)} destinatarios", file=sys.stderr)
+
+    send_options = dict(
+        credentials=credentials,
+        send_mode=send_mode,
+        attachments=attachments,
+        limiter=gmail_limiter(args.units_per_sec),
+        client_pool=GmailClientPool(),
+        batch_size=args.batch_size,
+        workers=args.workers,
+        sender_pool=sender_pool
+    )
+    if spool_file is not None:
+        if spool_exists(spool_file):
+            print(f"Enviando desde la campaña compilada {spool_file}", file=sys.stderr)
+        run = functools.partial(
+            spooled_results, path=spool_file,
+            items=functools.partial(items, ya_enviados=set(), documents=documents),
+            ya_enviados=ya_enviados, suppressed=suppressed, **send_options
+        )
+    else:
+        run = functools.partial(
+            campaign_results, items=functools.partial(items, ya_enviados=ya_enviados, documents=documents),
+            **send_options
+        )
+
+    runner = JobRunner(max_jobs=1)
+    job = runner.submit(
+        f"{filename} ({send_mode})",
+        total,
+        run,
+        campaign_id=camp_id,
+        label=lambda key: key[1],
+        # Guardar cada resultado al momento para poder reanudar
+        on_result=lambda key, success, msg: journal.record(camp_id, key[2], key[1], success, msg)
+    )
+    snap = wait_for(job, args.quiet)
+
+    journal.close()
+    if args.json:
+        print(json.dumps(job.metrics_snapshot(), indent=2, default=str))
+    else:
+        print(progress_line(snap))
+        for email, msg in snap['errors'][:ERRORS_SHOWN]:
+            print(f"  ❌ {email}: {msg}")
+    if snap['status'] == 'failed':
+        print(snap['detail'], file=sys.stderr)
+    return 0 if snap['status'] == 'done' and not snap['errores'] else 1
+
+
+# Revisar una campaña compilada: resumen, destinatarios y el mensaje completo de uno
+def command_spool(args):
+    from correo.spool import CampaignSpool, spool_exists
+
+    if not spool_exists(args.path):
+        raise SystemExit(f"No hay una campaña compilada en {args.path}")
+    spool = CampaignSpool(args.path)
+    try:
+        if args.show is not None:
+            try:
+                _, _, raw = spool.message(args.show)
+            except IndexError:
+                raise SystemExit(f"La campaña tiene {spool.count} mensajes (de 0 a {spool.count - 1})")
+            if args.eml:
+                with open(args.eml, 'wb') as f:
+                    f.write(raw)
+            else:
+                sys.stdout.buffer.write(raw)
+            return 0
+        info = spool.summary()
+        if args.json:
+            print(json.dumps(info, indent=2))
+            return 0
+        print(f"{info['name'] or args.path}: {info['messages']} mensajes, {info['bytes'] / 1024 / 1024:.1f} MB, "
+              f"{info['rejected']} rechazados; adjuntos: {', '.join(info['attachments']) or 'ninguno'}")
+        for seq, (_, to, subject, _) in enumerate(spool.items()):
+            if seq == args.limit:
+                print(f"... ({info['messages'] - seq} más)")
+                break
+            print(f"{seq:>6}  {to}  {subject}")
+        return 0
+    finally:
+        spool.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='correo', description="Envío masivo de correos por la API de Gmail")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    send = commands.add_parser('send', help="enviar una campaña a los contactos de una hoja")
+    send.add_argument('--sheet', required=True, help="contactos (.xlsx, .xls, .csv o .parquet)")
+    send.add_argument('--template', required=True, help="archivo de texto con el cuerpo ({Nombre}, {Celular}, {email})")
+    subject = send.add_mutually_exclusive_group(required=True)
+    subject.add_argument('--subject', help="asunto (admite los mismos campos que el cuerpo)")
+    subject.add_argument('--subject-file', help="archivo con el asunto")
+    send.add_argument('--attach', action='append', default=[], help="archivo adjunto (se puede repetir)")
+    send.add_argument('--document', help="plantilla de un documento por contacto (.xlsx o texto)")
+    send.add_argument('--document-name', help="nombre del documento adjunto, p. ej. \"Constancia {Nombre}.pdf\"")
+    send.add_argument('--mode', choices=SEND_MODES, default='uno')
+    send.add_argument('--workers', type=int, default=4, help="hilos de envío (modos concurrente y cuentas)")
+    send.add_argument('--batch-size', type=int, default=50, help="correos por lote (modo lotes)")
+    send.add_argument('--units-per-sec', type=float, default=GMAIL_USER_UNITS_PER_SEC,
+                      help="cuota de Gmail en unidades por segundo (cada envío consume 100)")
+    send.add_argument('--credentials', default=os.environ.get('CORREO_CREDENTIALS'),
+                      help="token.json de la cuenta (por defecto $CORREO_CREDENTIALS)")
+    send.add_argument('--account', help="usar las credenciales que la app guardó para esta cuenta "
+                                        "(modo cuentas: su pool de remitentes)")
+    send.add_argument('--email-column', help="columna con el correo si no se detecta sola")
+    send.add_argument('--name-column', help="columna con el nombre si no se detecta sola")
+    send.add_argument('--phone-column', help="columna con el celular si no se detecta sola")
+    send.add_argument('--no-resume', action='store_true', help="reenviar también a quien ya lo recibió")
+    send.add_argument('--no-suppression', action='store_true', help="no excluir la lista de supresión")
+    send.add_argument('--dry-run', action='store_true', help="solo personalizar y contar, sin enviar")
+    send.add_argument('--spool', action='store_true',
+                      help="compilar la campaña en disco (o reutilizar la ya compilada) y enviar desde ahí")
+    send.add_argument('--compile-only', action='store_true', help="solo compilar la campaña en disco, sin enviar")
+    send.add_argument('--quiet', action='store_true', help="sin líneas de progreso")
+    send.add_argument('--json', action='store_true', help="imprimir el resultado y las métricas en JSON")
+    send.set_defaults(run=command_send)
+
+    spool = commands.add_parser('spool', help="revisar una campaña compilada")
+    spool.add_argument('path', help="archivo .spool de la campaña")
+    spool.add_argument('--show', type=int, help="imprimir el mensaje completo (RFC 822) de esta posición")
+    spool.add_argument('--eml', help="con --show, guardarlo en este archivo .eml")
+    spool.add_argument('--limit', type=int, default=20, help="destinatarios que se listan")
+    spool.add_argument('--json', action='store_true', help="imprimir el resumen en JSON")
+    spool.set_defaults(run=command_spool)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.run(args)
+
+
+# `python -m correo.cli send --sheet contactos.xlsx --template cuerpo.txt --subject "Hola {Nombre}"`
+if __name__ == '__main__':
+    sys.exit(main())
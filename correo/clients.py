@@ -0,0 +1,131 @@
+import datetime
+import functools
+import hashlib
+import json
+import os
+import threading
+
+import google_auth_httplib2
+import httplib2
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+
+# Refrescar el token si le quedan menos de estos minutos (antes de que falle un envío)
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+# Tiempo máximo de espera por respuesta HTTP
+HTTP_TIMEOUT = 60
+
+_refresh_locks = {}
+_refresh_locks_guard = threading.Lock()
+
+
+# Documento de descubrimiento de Gmail incluido en la librería, analizado una sola vez.
+# Con `endpoint` (p. ej. el servidor de prueba de correo.gmail_mock) todas las
+# llamadas, lotes y subidas van a esa URL en vez de a Google.
+@functools.lru_cache(maxsize=None)
+def _gmail_discovery_doc(endpoint=None):
+    doc = discovery_cache.get_static_doc('gmail', 'v1')
+    if not doc:
+        return None
+    doc = json.loads(doc)
+    if endpoint:
+        root = endpoint.rstrip('/') + '/'
+        doc['rootUrl'] = doc['mtlsRootUrl'] = root
+        doc['baseUrl'] = root + doc['servicePath']
+    return doc
+
+
+# Clave estable de un usuario (no se guarda el token en claro).
+# Con una cuenta de servicio, cada usuario suplantado es una identidad distinta.
+def user_key(credentials):
+    service_account = getattr(credentials, 'service_account_email', None)
+    if service_account:
+        secret = f"{service_account}:{getattr(credentials, '_subject', None) or ''}"
+    else:
+        secret = getattr(credentials, 'refresh_token', None) or getattr(credentials, 'token', None) or ''
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()[:16]
+
+
+# Refrescar el token con margen, una sola vez aunque lo pidan varios hilos a la vez
+def refresh_if_needed(credentials, margin=REFRESH_MARGIN):
+    if not getattr(credentials, 'refresh_token', None):
+        return False
+    key = user_key(credentials)
+    with _refresh_locks_guard:
+        lock = _refresh_locks.setdefault(key, threading.Lock())
+    with lock:
+        expiry = getattr(credentials, 'expiry', None)
+        # google-auth guarda expiry como UTC sin zona horaria
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        if credentials.token and expiry is not None and expiry - now > margin:
+            return False
+        # requests solo se carga cuando de verdad hay que refrescar (arranque más rápido)
+        from google.auth.transport.requests import Request
+
+        credentials.refresh(Request())
+        return True
+
+
+# Crear un cliente de Gmail sin descargar el documento de descubrimiento y con su
+# propia conexión HTTP persistente (httplib2 reutiliza la conexión TLS entre llamadas)
+def build_gmail_service(credentials):
+    transport = httplib2.Http(timeout=HTTP_TIMEOUT)
+    # La subida reanudable responde 308 sin Location: no es una redirección
+    transport.redirect_codes = transport.redirect_codes - {308}
+    http = google_auth_httplib2.AuthorizedHttp(credentials, http=transport)
+    doc = _gmail_discovery_doc(os.environ.get('CORREO_GMAIL_ENDPOINT'))
+    if doc is None:
+        return build('gmail', 'v1', http=http, cache_discovery=False)
+    return build_from_document(doc, http=http)
+
+
+# Pool de clientes de Gmail por usuario, compartido entre reruns y sesiones
+# (se guarda con st.cache_resource). Un cliente no es thread-safe: se presta a un
+# solo hilo con acquire() y vuelve al pool con release().
+class GmailClientPool:
+    def __init__(self, max_idle_per_user=8):
+        self.max_idle_per_user = max_idle_per_user
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.built = 0
+
+    def acquire(self, credentials):
+        refresh_if_needed(credentials)
+        key = user_key(credentials)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+            self.built += 1
+        return build_gmail_service(credentials)
+
+    def release(self, credentials, service):
+        key = user_key(credentials)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_user:
+                idle.append(service)
+
+    # Olvidar los clientes de un usuario (al cerrar sesión)
+    def discard(self, credentials):
+        with self._lock:
+            self._idle.pop(user_key(credentials), None)
+
+    # Préstamo con devolución automática: `with pool.lease(creds) as service:`
+    def lease(self, credentials):
+        return _Lease(self, credentials)
+
+
+class _Lease:
+    def __init__(self, pool, credentials):
+        self.pool = pool
+        self.credentials = credentials
+        self.service = None
+
+    def __enter__(self):
+        self.service = self.pool.acquire(self.credentials)
+        return self.service
+
+    def __exit__(self, *exc):
+        self.pool.release(self.credentials, self.service)
+        return False
@@ -0,0 +1,184 @@
+import io
+import itertools
+import multiprocessing
+import os
+import re
+import textwrap
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from correo.attachments import BodyWithAttachments
+from correo.metrics import NO_METRICS
+from correo.render import TemplateError, compile_template
+
+# Plantillas de texto: se rellenan tal cual (UTF-8) o se convierten a PDF
+TEXT_TYPES = ('txt', 'md', 'csv', 'html', 'htm', 'json', 'xml')
+# Formatos de plantilla aceptados (en .xlsx se rellenan las celdas de texto)
+DOCUMENT_TYPES = ('xlsx',) + TEXT_TYPES
+# Documentos en preparación por proceso: el pool trabaja por delante del envío
+PREFETCH_PER_WORKER = 4
+
+# Página del PDF generado a partir de texto (A4 en puntos, Helvetica)
+PDF_PAGE_SIZE = (595, 842)
+PDF_MARGIN = 56
+PDF_FONT_SIZE = 11
+PDF_LEADING = 14
+PDF_LINE_CHARS = 90
+
+# Caracteres que no pueden ir en el nombre de un adjunto
+_UNSAFE_NAME = re.compile(r'[\x00-\x1f"/\\]+')
+
+
+def _extension(filename):
+    return (filename or '').lower().rsplit('.', 1)[-1]
+
+
+def _pdf_escape(line):
+    return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+# PDF mínimo (solo texto, Helvetica) sin dependencias: una línea por renglón,
+# partiendo los renglones largos y las páginas que no caben
+def text_pdf(text):
+    lines = []
+    for paragraph in text.splitlines() or ['']:
+        lines.extend(textwrap.wrap(paragraph, PDF_LINE_CHARS) or [''])
+    width, height = PDF_PAGE_SIZE
+    per_page = (height - 2 * PDF_MARGIN) // PDF_LEADING
+    pages = [lines[i:i + per_page] for i in range(0, len(lines), per_page)]
+
+    # 1 catálogo, 2 árbol de páginas, 3 fuente y luego (página, contenido) por página
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(len(pages)))}] "
+        f"/Count {len(pages)} >>".encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    ]
+    for i, page in enumerate(pages):
+        stream = [f'BT /F1 {PDF_FONT_SIZE} Tf {PDF_LEADING} TL {PDF_MARGIN} {height - PDF_MARGIN} Td']
+        stream.extend(f'({_pdf_escape(line)}) Tj T*' for line in page)
+        stream.append('ET')
+        # WinAnsiEncoding es cp1252: acentos y ñ se ven bien; lo demás sale como '?'
+        data = '\n'.join(stream).encode('cp1252', 'replace')
+        objects.append(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>'.encode()
+        )
+        objects.append(f'<< /Length {len(data)} >>\nstream\n'.encode() + data + b'\nendstream')
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f'{number} 0 obj\n'.encode() + obj + b'\nendobj\n')
+    xref = out.tell()
+    out.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode())
+    out.write(''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode())
+    out.write(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode())
+    return out.getvalue()
+
+
+# Plantilla de un documento por contacto: un .xlsx con {Nombre}, {Celular} o
+# {email} en sus celdas, o un archivo de texto (que también puede salir como
+# PDF). `output_name` es el nombre del adjunto y admite los mismos campos.
+# Los campos se validan al crearla, antes de gastar cuota.
+class DocumentTemplate:
+    def __init__(self, name, content, output_name=None):
+        self.name = name
+        self.content = content
+        self.kind = _extension(name)
+        self.output_name = output_name or name
+        self.output_kind = _extension(self.output_name)
+        if self.kind not in DOCUMENT_TYPES:
+            raise TemplateError(f"Formato de plantilla no soportado: .{self.kind}. Usa {', '.join(DOCUMENT_TYPES)}")
+        if self.output_kind == 'pdf' and self.kind not in TEXT_TYPES:
+            raise TemplateError("Solo las plantillas de texto se pueden convertir a PDF")
+        if self.output_kind not in (self.kind, 'pdf'):
+            raise TemplateError(f"El nombre del documento debe terminar en .{self.kind} o .pdf")
+        compile_template(self.output_name)
+        for text in self._texts():
+            compile_template(text)
+
+    # Textos con campos de la plantilla (el archivo completo o cada celda con llaves)
+    def _texts(self):
+        if self.kind in TEXT_TYPES:
+            return [self.content.decode('utf-8')]
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(io.BytesIO(self.content))
+        return [
+            cell.value
+            for sheet in workbook.worksheets
+            for row in sheet.iter_rows()
+            for cell in row
+            if isinstance(cell.value, str) and '{' in cell.value
+        ]
+
+    def filename(self, values):
+        return _UNSAFE_NAME.sub('_', compile_template(self.output_name).render_one(values)).strip() or self.name
+
+    # Documento de un contacto ({'name': ..., 'content': bytes}); `values` son los
+    # campos de la fila como texto, igual que en render_one()
+    def render(self, values):
+        if self.kind in TEXT_TYPES:
+            text = compile_template(self.content.decode('utf-8')).render_one(values)
+            content = text_pdf(text) if self.output_kind == 'pdf' else text.encode('utf-8')
+        else:
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(io.BytesIO(self.content))
+            for sheet in workbook.worksheets:
+                for row in sheet.iter_rows():
+                    for cell in row:
+                        if isinstance(cell.value, str) and '{' in cell.value:
+                            cell.value = compile_template(cell.value).render_one(values)
+            out = io.BytesIO()
+            workbook.save(out)
+            content = out.getvalue()
+        return {'name': self.filename(values), 'content': content}
+
+
+# Plantilla del proceso de trabajo: llega una sola vez al arrancarlo, no con cada fila
+_worker_template = None
+
+
+def _init_worker(template):
+    global _worker_template
+    _worker_template = template
+
+
+def _render_in_worker(values):
+    start = time.perf_counter()
+    document = _worker_template.render(values)
+    return document, time.perf_counter() - start
+
+
+# Generar el documento de cada correo en un pool de procesos (usa todos los
+# núcleos, sin el GIL) por delante del envío. `rows` son (item, valores) con
+# item = (clave, destinatario, asunto, cuerpo); produce los items con su
+# documento en el cuerpo (BodyWithAttachments) en cuanto cada uno está listo,
+# así la generación se solapa con las llamadas a la API.
+def with_documents(rows, template, workers=None, metrics=NO_METRICS):
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    # 'spawn': el proceso que envía tiene hilos (Streamlit, el pool de envío) y fork no es seguro
+    pool = ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker, initargs=(template,)
+    )
+    rows = iter(rows)
+    pending = {}
+    try:
+        while True:
+            for item, values in itertools.islice(rows, workers * PREFETCH_PER_WORKER - len(pending)):
+                pending[pool.submit(_render_in_worker, values)] = item
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, to, subject, body = pending.pop(future)
+                document, seconds = future.result()
+                metrics.observe('document', seconds)
+                yield key, to, subject, BodyWithAttachments(body, [document])
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,207 @@
+import base64
+import itertools
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from googleapiclient.http import MediaIoBaseUpload
+
+from correo.attachments import UPLOAD_CHUNK_SIZE, PrecompiledAttachments, build_attachment_part, recipient_attachments
+from correo.metrics import NO_METRICS
+from correo.ratelimit import QUOTA_UNITS
+from correo.retry import RATE_LIMITED, backoff_delay, call_with_retry, classify_error, failure_message
+
+# Gmail acepta como máximo 100 llamadas por lote (recomienda 50 o menos)
+MAX_BATCH_SIZE = 100
+# Crear, enviar y borrar borradores pide gmail.compose (o gmail.modify); gmail.send no alcanza
+DRAFT_SCOPES = ('https://www.googleapis.com/auth/gmail.compose', 'https://www.googleapis.com/auth/gmail.modify')
+
+
+# ¿Las credenciales permiten usar borradores? (si no declaran sus scopes, se asume que sí)
+def can_draft(credentials):
+    scopes = getattr(credentials, 'granted_scopes', None) or getattr(credentials, 'scopes', None)
+    if not scopes:
+        return True
+    return any(scope in scopes for scope in DRAFT_SCOPES)
+
+
+# Mensaje MIME en bytes (con adjuntos precompilados, solo cabeceras, cuerpo y
+# los adjuntos propios del destinatario)
+def build_mime_bytes(to, subject, body, attachments=None):
+    if isinstance(attachments, PrecompiledAttachments):
+        return attachments.head(to, subject, body)
+
+    message = MIMEMultipart()
+    message['to'] = to
+    message['subject'] = subject
+
+    # Agregar el cuerpo del mensaje
+    message.attach(MIMEText(body, 'plain', 'utf-8'))
+
+    # Agregar archivos adjuntos si existen (los del destinatario y los comunes)
+    for attachment in [*recipient_attachments(body), *(attachments or [])]:
+        message.attach(build_attachment_part(attachment))
+
+    return message.as_bytes()
+
+
+# Codificar el mensaje en base64 url-safe para la API
+# (si los adjuntos vienen precompilados, se pega el bloque ya codificado)
+def encode_raw(data, attachments=None):
+    if isinstance(attachments, PrecompiledAttachments):
+        return attachments.encode(data)
+    return base64.urlsafe_b64encode(data).decode()
+
+
+# Construir el mensaje MIME y codificarlo, midiendo cada etapa por separado
+def build_raw_message(to, subject, body, attachments=None, metrics=NO_METRICS):
+    with metrics.timer('mime'):
+        data = build_mime_bytes(to, subject, body, attachments)
+    with metrics.timer('encode'):
+        return encode_raw(data, attachments)
+
+
+# Los mensajes grandes no caben en el JSON: se suben aparte y no admiten lotes HTTP
+def needs_upload(attachments):
+    return isinstance(attachments, PrecompiledAttachments) and attachments.upload
+
+
+# Mensaje grande como message/rfc822 para la subida reanudable (en trozos, sin blob)
+def media_upload(to, subject, body, attachments, metrics=NO_METRICS):
+    with metrics.timer('mime'):
+        stream = attachments.open_stream(to, subject, body)
+    return MediaIoBaseUpload(
+        stream,
+        mimetype='message/rfc822',
+        chunksize=UPLOAD_CHUNK_SIZE,
+        resumable=True
+    )
+
+
+# Petición messages.send de un mensaje: en base64 dentro del JSON o, si es
+# grande, como message/rfc822 por la subida reanudable (en trozos, sin blob)
+def send_request(service, to, subject, body, attachments=None, metrics=NO_METRICS):
+    if needs_upload(attachments):
+        media = media_upload(to, subject, body, attachments, metrics)
+        return service.users().messages().send(userId='me', media_body=media)
+    raw = build_raw_message(to, subject, body, attachments, metrics)
+    return service.users().messages().send(
+        userId="me",
+        body={'raw': raw}
+    )
+
+
+# Petición drafts.create: el mensaje completo (con sus adjuntos) queda subido
+# como borrador y después se envía solo con su id (drafts.send)
+def create_draft_request(service, to, subject, body, attachments=None, metrics=NO_METRICS):
+    if needs_upload(attachments):
+        media = media_upload(to, subject, body, attachments, metrics)
+        return service.users().drafts().create(userId='me', media_body=media)
+    raw = build_raw_message(to, subject, body, attachments, metrics)
+    return service.users().drafts().create(userId='me', body={'message': {'raw': raw}})
+
+
+# Crear el borrador de un mensaje y devolver su id (lanza la excepción si falla)
+def create_draft(service, to, subject, body, attachments=None, metrics=NO_METRICS):
+    request = create_draft_request(service, to, subject, body, attachments, metrics)
+    with metrics.timer('api'):
+        return request.execute()['id']
+
+
+# Enviar un borrador ya creado: una llamada ligera, sin volver a subir el mensaje
+def send_draft(service, draft_id, metrics=NO_METRICS):
+    with metrics.timer('api'):
+        return service.users().drafts().send(userId='me', body={'id': draft_id}).execute()
+
+
+def delete_draft(service, draft_id):
+    service.users().drafts().delete(userId='me', id=draft_id).execute()
+
+
+# Enviar un mensaje y devolver la respuesta de la API (lanza la excepción si falla)
+def send_message(service, to, subject, body, attachments=None, metrics=NO_METRICS):
+    request = send_request(service, to, subject, body, attachments, metrics)
+    with metrics.timer('api'):
+        return request.execute()
+
+
+# Enviar mensajes agrupados en lotes HTTP (BatchHttpRequest)
+# items: iterable de tuplas (clave, destinatario, asunto, cuerpo)
+# Produce, por cada lote, una lista de (clave, success, msg) con el mismo
+# contrato que send_email() para poder atribuir el resultado a cada fila.
+# Si se pasa un limitador (TokenBucket), cada llamada del lote consume su cuota.
+# Con `metrics` (SendMetrics) se mide cada etapa; la llamada HTTP del lote se
+# reparte entre sus mensajes.
+# Las llamadas que fallan por un error transitorio se marcan (RetryLater) para
+# reenviarlas en la cola de reintentos; si alguna fue por exceso de cuota, se
+# pausa el limitador antes del siguiente lote.
+def send_batch(service, items, attachments=None, batch_size=50, limiter=None, metrics=NO_METRICS):
+    batch_size = max(1, min(int(batch_size), MAX_BATCH_SIZE))
+    items = iter(items)
+    start = 0
+
+    # Los items se consumen lote a lote (pueden venir de un generador)
+    while True:
+        chunk = list(itertools.islice(items, batch_size))
+        if not chunk:
+            break
+        results = []
+        keys = {}
+        throttled = []
+
+        def callback(request_id, response, exception):
+            key = keys[request_id]
+            if exception is not None:
+                if classify_error(exception) == RATE_LIMITED:
+                    throttled.append(exception)
+                results.append((key, False, failure_message(exception)))
+            else:
+                results.append((key, True, f"Mensaje enviado! ID: {response['id']}"))
+
+        # Las subidas de archivos no van en lotes: se envían una a una
+        if needs_upload(attachments):
+            for key, to, subject, body in chunk:
+                try:
+                    response = call_with_retry(
+                        lambda: send_message(service, to, subject, body, attachments, metrics),
+                        limiter, metrics=metrics
+                    )
+                    results.append((key, True, f"Mensaje enviado! ID: {response['id']}"))
+                except Exception as e:
+                    results.append((key, False, failure_message(e)))
+            start += len(chunk)
+            yield results
+            continue
+
+        batch = service.new_batch_http_request(callback=callback)
+        for i, (key, to, subject, body) in enumerate(chunk):
+            try:
+                raw = build_raw_message(to, subject, body, attachments, metrics)
+            except Exception as e:
+                results.append((key, False, f"Error: {str(e)}"))
+                continue
+            if limiter is not None:
+                metrics.observe('backoff', limiter.acquire(QUOTA_UNITS['messages.send']))
+            request_id = str(start + i)
+            keys[request_id] = key
+            batch.add(
+                service.users().messages().send(userId='me', body={'raw': raw}),
+                request_id=request_id
+            )
+
+        if keys:
+            try:
+                with metrics.timer('api', n=len(keys)):
+                    batch.execute()
+            except Exception as e:
+                # Si falla la petición HTTP completa, todo el lote queda sin enviar
+                answered = {r[0] for r in results}
+                for key in keys.values():
+                    if key not in answered:
+                        results.append((key, False, failure_message(e)))
+            if limiter is not None:
+                limiter.recover(sum(1 for _, success, _ in results if success))
+                if throttled:
+                    limiter.backoff(backoff_delay(throttled[0], 0))
+
+        start += len(chunk)
+        yield results
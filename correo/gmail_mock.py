@@ -0,0 +1,331 @@
+import argparse
+import base64
+import email.parser
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Rutas de la API de Gmail que imita el servidor (relativas a rootUrl)
+SEND_PATH = re.compile(r'^/(?:upload/|resumable/upload/)?gmail/v1/users/[^/]+/messages/send$')
+DRAFTS_PATH = re.compile(r'^/(?:upload/|resumable/upload/)?gmail/v1/users/[^/]+/drafts$')
+DRAFT_SEND_PATH = re.compile(r'^/gmail/v1/users/[^/]+/drafts/send$')
+DRAFT_PATH = re.compile(r'^/gmail/v1/users/[^/]+/drafts/([^/]+)$')
+LIST_PATH = re.compile(r'^/gmail/v1/users/[^/]+/messages$')
+GET_PATH = re.compile(r'^/gmail/v1/users/[^/]+/messages/([^/]+)$')
+PROFILE_PATH = re.compile(r'^/gmail/v1/users/[^/]+/profile$')
+BATCH_PATHS = ('/batch', '/batch/gmail/v1')
+UPLOAD_SESSION_PATH = re.compile(r'^/upload-session/(\d+)$')
+
+
+# Servidor local que imita messages.send (JSON, subida simple y reanudable y
+# lotes HTTP), drafts.create/send/delete, messages.list, messages.get y
+# getProfile de Gmail, para medir los
+# modos de envío sin red: latencia fija por llamada, errores 500 aleatorios y
+# 429 con Retry-After (aleatorios o al pasar de `rate` llamadas por segundo).
+# Con `daily_limit`, cada token (cuenta) puede enviar esa cantidad de correos;
+# después recibe 403 dailyLimitExceeded, como una cuenta con el límite agotado.
+# Para apuntar el cliente aquí: CORREO_GMAIL_ENDPOINT=<url> (ver correo.clients).
+class MockGmailServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.05, error_rate=0.0, throttle_rate=0.0,
+                 rate=0, mailbox_size=1000, daily_limit=0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate = rate
+        self.daily_limit = daily_limit
+        self.sent_by_token = {}
+        self.mailbox = [f'{i:016x}' for i in range(mailbox_size, 0, -1)]
+        self.calls = {'send': 0, 'list': 0, 'get': 0, 'profile': 0, 'batch': 0, 'draft': 0, 'draft_send': 0}
+        # Borradores guardados: id -> tamaño del mensaje
+        self.drafts = {}
+        self.errors = 0
+        self.throttled = 0
+        self.bytes_received = 0
+        self._ids = itertools.count(1)
+        self._uploads = {}
+        self._window = (0, 0)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stats(self):
+        with self._lock:
+            return dict(self.calls, errors=self.errors, throttled=self.throttled, bytes_received=self.bytes_received)
+
+    # Resultado simulado de una llamada: (estado, cuerpo, cabeceras extra) o None si pasa
+    def _fault(self):
+        with self._lock:
+            if self.rate:
+                second = int(time.monotonic())
+                start, count = self._window
+                if start != second:
+                    start, count = second, 0
+                self._window = (start, count + 1)
+                if count >= self.rate:
+                    self.throttled += 1
+                    return 429, _error(429, 'User-rate limit exceeded', 'rateLimitExceeded'), {'Retry-After': '1'}
+            roll = random.random()
+            if roll < self.throttle_rate:
+                self.throttled += 1
+                return 429, _error(429, 'Too many requests', 'rateLimitExceeded'), {'Retry-After': '1'}
+            if roll < self.throttle_rate + self.error_rate:
+                self.errors += 1
+                return 500, _error(500, 'Backend Error', 'backendError'), {}
+        return None
+
+    # Atender una llamada de la API. Las que vienen dentro de un lote no esperan
+    # cada una su latencia (`wait=False`): el lote completo espera una sola vez.
+    def handle_call(self, method, path, body, wait=True, token=''):
+        path, _, query = path.partition('?')
+        params = urllib.parse.parse_qs(query)
+        if wait and self.latency:
+            time.sleep(self.latency)
+        if method == 'POST' and SEND_PATH.match(path):
+            with self._lock:
+                self.calls['send'] += 1
+                self.bytes_received += len(body)
+            fault = self._fault() or self._over_limit(token)
+            if fault:
+                return fault
+            if path.startswith('/gmail/'):
+                try:
+                    base64.urlsafe_b64decode(json.loads(body)['raw'])
+                except (ValueError, KeyError, TypeError):
+                    return 400, _error(400, "Invalid value for ByteString", 'invalidArgument'), {}
+            return 200, self._sent(), {}
+        if method == 'POST' and DRAFTS_PATH.match(path):
+            with self._lock:
+                self.calls['draft'] += 1
+                self.bytes_received += len(body)
+            fault = self._fault()
+            if fault:
+                return fault
+            size = len(body)
+            if path.startswith('/gmail/'):
+                try:
+                    size = len(base64.urlsafe_b64decode(json.loads(body)['message']['raw']))
+                except (ValueError, KeyError, TypeError):
+                    return 400, _error(400, "Invalid value for ByteString", 'invalidArgument'), {}
+            with self._lock:
+                draft_id = f'r{next(self._ids)}'
+                self.drafts[draft_id] = size
+            return 200, {'id': draft_id, 'message': {'id': draft_id, 'labelIds': ['DRAFT']}}, {}
+        if method == 'POST' and DRAFT_SEND_PATH.match(path):
+            with self._lock:
+                self.calls['draft_send'] += 1
+                self.bytes_received += len(body)
+            fault = self._fault() or self._over_limit(token)
+            if fault:
+                return fault
+            try:
+                draft_id = json.loads(body)['id']
+            except (ValueError, KeyError, TypeError):
+                return 400, _error(400, 'Missing draft id', 'invalidArgument'), {}
+            with self._lock:
+                found = self.drafts.pop(draft_id, None) is not None
+            if not found:
+                return 404, _error(404, 'Requested entity was not found.', 'notFound'), {}
+            return 200, self._sent(), {}
+        match = DRAFT_PATH.match(path)
+        if method == 'DELETE' and match:
+            with self._lock:
+                found = self.drafts.pop(match.group(1), None) is not None
+            if not found:
+                return 404, _error(404, 'Requested entity was not found.', 'notFound'), {}
+            return 204, b'', {}
+        if method == 'GET' and LIST_PATH.match(path):
+            with self._lock:
+                self.calls['list'] += 1
+            fault = self._fault()
+            if fault:
+                return fault
+            start = int(params.get('pageToken', ['0'])[0])
+            size = int(params.get('maxResults', ['100'])[0])
+            ids = self.mailbox[start:start + size]
+            result = {'messages': [{'id': i, 'threadId': i} for i in ids], 'resultSizeEstimate': len(self.mailbox)}
+            if start + size < len(self.mailbox):
+                result['nextPageToken'] = str(start + size)
+            return 200, result, {}
+        match = GET_PATH.match(path)
+        if method == 'GET' and match:
+            with self._lock:
+                self.calls['get'] += 1
+            fault = self._fault()
+            if fault:
+                return fault
+            message_id = match.group(1)
+            return 200, {
+                'id': message_id,
+                'threadId': message_id,
+                'labelIds': ['INBOX'],
+                'snippet': 'Mensaje de prueba',
+                'internalDate': str(int(time.time() * 1000)),
+                'payload': {'headers': [
+                    {'name': 'From', 'value': f'remitente{message_id[-4:]}@example.com'},
+                    {'name': 'Subject', 'value': f'Asunto {message_id}'},
+                    {'name': 'Date', 'value': time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime())},
+                ]},
+            }, {}
+        if method == 'GET' and PROFILE_PATH.match(path):
+            with self._lock:
+                self.calls['profile'] += 1
+            return 200, {'emailAddress': 'prueba@example.com', 'messagesTotal': len(self.mailbox),
+                         'historyId': '1'}, {}
+        return 404, _error(404, f'Not found: {path}', 'notFound'), {}
+
+    # Con `daily_limit`: 403 cuando la cuenta (token) ya envió su cupo del día
+    def _over_limit(self, token):
+        if not self.daily_limit:
+            return None
+        with self._lock:
+            sent = self.sent_by_token.get(token, 0)
+            if sent >= self.daily_limit:
+                return 403, _error(403, 'Daily user sending quota exceeded', 'dailyLimitExceeded'), {}
+            self.sent_by_token[token] = sent + 1
+        return None
+
+    def _sent(self):
+        message_id = f'{next(self._ids):016x}'
+        return {'id': message_id, 'threadId': message_id, 'labelIds': ['SENT']}
+
+
+def _error(code, message, reason):
+    return {'error': {'code': code, 'message': message, 'errors': [{'reason': reason, 'message': message}]}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Cabeceras y cuerpo salen en escrituras separadas: sin esto Nagle añade ~40 ms por respuesta
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _reply(self, status, payload, headers=None, content_type='application/json'):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _token(self):
+        return self.headers.get('Authorization', '')
+
+    def do_GET(self):
+        self._reply(*self.server.handle_call('GET', self.path, b'', token=self._token()))
+
+    def do_DELETE(self):
+        self._reply(*self.server.handle_call('DELETE', self.path, b'', token=self._token()))
+
+    def do_POST(self):
+        server = self.server
+        body = self._body()
+        path = self.path.partition('?')[0]
+        if path in BATCH_PATHS:
+            return self._batch(body)
+        if 'uploadType=resumable' in self.path and (SEND_PATH.match(path) or DRAFTS_PATH.match(path)):
+            # Abrir una sesión de subida reanudable: el cliente manda los trozos con PUT
+            with server._lock:
+                upload_id = next(server._ids)
+                server._uploads[upload_id] = (path, bytearray())
+            return self._reply(200, b'', {'Location': f"{server.url}/upload-session/{upload_id}"})
+        self._reply(*server.handle_call('POST', self.path, body, token=self._token()))
+
+    def do_PUT(self):
+        server = self.server
+        body = self._body()
+        match = UPLOAD_SESSION_PATH.match(self.path)
+        if not match:
+            return self._reply(404, _error(404, 'Not found', 'notFound'))
+        upload_id = int(match.group(1))
+        with server._lock:
+            upload = server._uploads.get(upload_id)
+            if upload is None:
+                return self._reply(404, _error(404, 'Upload session not found', 'notFound'))
+            target, data = upload
+            data.extend(body)
+        # Content-Range: bytes inicio-fin/total
+        total = self.headers.get('Content-Range', '').rpartition('/')[2]
+        if total.isdigit() and len(data) < int(total):
+            return self._reply(308, b'', {'Range': f'bytes=0-{len(data) - 1}'})
+        with server._lock:
+            del server._uploads[upload_id]
+        self._reply(*server.handle_call('POST', target, bytes(data), token=self._token()))
+
+    # Lote HTTP (multipart/mixed): cada parte es una petición HTTP completa
+    def _batch(self, body):
+        server = self.server
+        with server._lock:
+            server.calls['batch'] += 1
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        if server.latency:
+            time.sleep(server.latency)
+        boundary = f"batch_{next(server._ids)}"
+        parts = []
+        for part in message.get_payload():
+            request = part.get_payload(decode=False)
+            head, _, request_body = request.partition('\r\n\r\n' if '\r\n\r\n' in request else '\n\n')
+            method, path, _ = head.splitlines()[0].split(' ', 2)
+            status, payload, _ = server.handle_call(
+                method, path, request_body.encode('utf-8'), wait=False, token=self._token()
+            )
+            content_id = part['Content-ID'].replace('<', '<response-', 1)
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\n\r\n{json.dumps(payload)}\r\n"
+            )
+        response = ''.join(parts) + f"--{boundary}--\r\n"
+        self._reply(200, response.encode('utf-8'), content_type=f'multipart/mixed; boundary={boundary}')
+
+
+# Arrancar el servidor de prueba en un hilo (puerto libre si port=0)
+def start_mock_server(host='127.0.0.1', port=0, **options):
+    server = MockGmailServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, name='gmail-mock', daemon=True)
+    thread.start()
+    return server
+
+
+# Servidor de prueba independiente: `python -m correo.gmail_mock --port 8090`
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de Gmail")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.05, help="segundos por llamada")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fracción de llamadas que fallan con 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fracción de llamadas que responden 429")
+    parser.add_argument('--rate', type=int, default=0, help="llamadas por segundo antes de responder 429 (0 = sin límite)")
+    parser.add_argument('--mailbox-size', type=int, default=1000, help="mensajes que devuelve messages.list")
+    parser.add_argument('--daily-limit', type=int, default=0, help="correos por cuenta antes de responder 403 (0 = sin límite)")
+    args = parser.parse_args()
+    server = MockGmailServer(
+        (args.host, args.port), latency=args.latency, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, rate=args.rate, mailbox_size=args.mailbox_size,
+        daily_limit=args.daily_limit
+    )
+    # La primera línea es la URL (el benchmark la lee para saber el puerto)
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,107 @@
+import time
+
+from correo.gmail import MAX_BATCH_SIZE
+from correo.ratelimit import QUOTA_UNITS
+from correo.retry import RATE_LIMITED, TRANSIENT, backoff_delay, classify_error, failure_message
+
+# Gmail devuelve como máximo 500 ids por página en messages.list
+MAX_PAGE_SIZE = 500
+METADATA_HEADERS = ['From', 'Subject', 'Date']
+
+
+# Listar ids de mensajes siguiendo nextPageToken hasta juntar `max_results`
+def list_message_ids(service, max_results=100, query=None, label_ids=None):
+    messages = []
+    page_token = None
+    while len(messages) < max_results:
+        kwargs = {'userId': 'me', 'maxResults': min(MAX_PAGE_SIZE, max_results - len(messages))}
+        if page_token:
+            kwargs['pageToken'] = page_token
+        if query:
+            kwargs['q'] = query
+        if label_ids:
+            kwargs['labelIds'] = label_ids
+        results = service.users().messages().list(**kwargs).execute()
+        messages.extend(results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    return messages[:max_results]
+
+
+# Convertir la respuesta de messages.get(format='metadata') en un dict plano
+def parse_metadata(msg_data):
+    headers = msg_data.get('payload', {}).get('headers', [])
+    values = {h['name']: h['value'] for h in headers}
+    return {
+        'id': msg_data.get('id'),
+        'threadId': msg_data.get('threadId'),
+        'from': values.get('From', 'Desconocido'),
+        'subject': values.get('Subject', 'Sin asunto'),
+        'date': values.get('Date', 'Sin fecha'),
+        'internalDate': int(msg_data.get('internalDate', 0) or 0),
+        'labels': msg_data.get('labelIds', []),
+        'snippet': msg_data.get('snippet', ''),
+    }
+
+
+# Pedir los metadatos de muchos mensajes agrupando las llamadas en lotes HTTP.
+# Las respuestas del lote con exceso de cuota (429) o un fallo pasajero (5xx) se
+# vuelven a pedir en otro lote, con espera exponencial, hasta `max_retries` veces.
+# Devuelve (metadatos en el mismo orden que `ids`, {id: error} de los que fallaron);
+# los errores que aún valdría la pena reintentar vienen como RetryLater.
+def fetch_metadata(service, ids, batch_size=50, limiter=None, max_retries=5, sleep=time.sleep):
+    batch_size = max(1, min(int(batch_size), MAX_BATCH_SIZE))
+    found = {}
+    errors = {}
+
+    for start in range(0, len(ids), batch_size):
+        pending = ids[start:start + batch_size]
+        attempt = 0
+        while pending:
+            failed = {}
+
+            def callback(request_id, response, exception, failed=failed):
+                if exception is not None:
+                    failed[request_id] = exception
+                else:
+                    found[request_id] = parse_metadata(response)
+
+            batch = service.new_batch_http_request(callback=callback)
+            for msg_id in pending:
+                if limiter is not None:
+                    limiter.acquire(QUOTA_UNITS['messages.get'])
+                batch.add(
+                    service.users().messages().get(
+                        userId='me',
+                        id=msg_id,
+                        format='metadata',
+                        metadataHeaders=METADATA_HEADERS
+                    ),
+                    request_id=msg_id
+                )
+            try:
+                batch.execute()
+            except Exception as e:
+                for msg_id in pending:
+                    if msg_id not in found and msg_id not in failed:
+                        failed[msg_id] = e
+
+            kinds = {msg_id: classify_error(e) for msg_id, e in failed.items()}
+            retry = [msg_id for msg_id in pending if kinds.get(msg_id) in (RATE_LIMITED, TRANSIENT)]
+            if attempt >= max_retries:
+                retry = []
+            for msg_id, e in failed.items():
+                if msg_id not in retry:
+                    errors[msg_id] = failure_message(e)
+            if retry:
+                delay = backoff_delay(failed[retry[0]], attempt)
+                if limiter is not None and RATE_LIMITED in kinds.values():
+                    # Pausar el limitador compartido (la espera se cumple en acquire)
+                    limiter.backoff(delay)
+                else:
+                    sleep(delay)
+                attempt += 1
+            pending = retry
+
+    return [found[i] for i in ids if i in found], errors
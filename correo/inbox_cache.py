@@ -0,0 +1,226 @@
+import sqlite3
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from correo.inbox import fetch_metadata, list_message_ids
+from correo.paths import data_path
+from correo.ratelimit import QUOTA_UNITS
+from correo.retry import RetryLater
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    account TEXT NOT NULL,
+    id TEXT NOT NULL,
+    thread_id TEXT,
+    sender TEXT,
+    subject TEXT,
+    date TEXT,
+    internal_date INTEGER,
+    labels TEXT,
+    snippet TEXT,
+    PRIMARY KEY (account, id)
+);
+CREATE INDEX IF NOT EXISTS messages_by_date ON messages (account, internal_date DESC);
+CREATE TABLE IF NOT EXISTS sync_state (
+    account TEXT PRIMARY KEY,
+    history_id TEXT,
+    synced_at REAL
+);
+"""
+
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+
+# Las etiquetas se guardan como ",INBOX,UNREAD," para poder filtrar con LIKE
+def _join_labels(labels):
+    return ',' + ','.join(labels or []) + ','
+
+
+def _split_labels(text):
+    return [label for label in (text or '').split(',') if label]
+
+
+# Caché local de metadatos del buzón (SQLite), una partición por cuenta
+class MailboxCache:
+    def __init__(self, path=None):
+        self.path = path or data_path('mailbox.sqlite3')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def history_id(self, account):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT history_id FROM sync_state WHERE account = ?', (account,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def synced_at(self, account):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT synced_at FROM sync_state WHERE account = ?', (account,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_history_id(self, account, history_id):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO sync_state (account, history_id, synced_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (account) DO UPDATE SET history_id = excluded.history_id, synced_at = excluded.synced_at',
+                (account, str(history_id), time.time())
+            )
+            self._conn.commit()
+
+    def upsert(self, account, messages):
+        rows = [
+            (account, m['id'], m.get('threadId'), m.get('from'), m.get('subject'), m.get('date'),
+             m.get('internalDate', 0), _join_labels(m.get('labels')), m.get('snippet', ''))
+            for m in messages
+        ]
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO messages '
+                '(account, id, thread_id, sender, subject, date, internal_date, labels, snippet) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            self._conn.commit()
+
+    def set_labels(self, account, labels_by_id):
+        with self._lock:
+            self._conn.executemany(
+                'UPDATE messages SET labels = ? WHERE account = ? AND id = ?',
+                [(_join_labels(labels), account, msg_id) for msg_id, labels in labels_by_id.items()]
+            )
+            self._conn.commit()
+
+    def delete(self, account, ids):
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM messages WHERE account = ? AND id = ?',
+                [(account, msg_id) for msg_id in ids]
+            )
+            self._conn.commit()
+
+    def clear(self, account):
+        with self._lock:
+            self._conn.execute('DELETE FROM messages WHERE account = ?', (account,))
+            self._conn.execute('DELETE FROM sync_state WHERE account = ?', (account,))
+            self._conn.commit()
+
+    def count(self, account):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM messages WHERE account = ?', (account,)
+            ).fetchone()[0]
+
+    def labels(self, account):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT DISTINCT labels FROM messages WHERE account = ?', (account,)
+            ).fetchall()
+        return sorted({label for (text,) in rows for label in _split_labels(text)})
+
+    # Búsqueda local por remitente/asunto y filtro por etiqueta, sin llamar a la API
+    def search(self, account, text='', label=None, limit=100):
+        sql = 'SELECT id, sender, subject, date, labels, snippet FROM messages WHERE account = ?'
+        params = [account]
+        if text:
+            sql += ' AND (sender LIKE ? OR subject LIKE ? OR snippet LIKE ?)'
+            like = f'%{text}%'
+            params += [like, like, like]
+        if label:
+            sql += ' AND labels LIKE ?'
+            params.append(f'%,{label},%')
+        sql += ' ORDER BY internal_date DESC LIMIT ?'
+        params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            {'id': r[0], 'from': r[1], 'subject': r[2], 'date': r[3], 'labels': _split_labels(r[4]), 'snippet': r[5]}
+            for r in rows
+        ]
+
+
+# Cambios desde `start_history_id` (paginando). Devuelve (añadidos, borrados, etiquetas, nuevo historyId)
+def _history_changes(service, start_history_id, limiter=None):
+    added = {}
+    deleted = set()
+    labels = {}
+    page_token = None
+    history_id = start_history_id
+    while True:
+        if limiter is not None:
+            limiter.acquire(QUOTA_UNITS['history.list'])
+        kwargs = {'userId': 'me', 'startHistoryId': start_history_id, 'historyTypes': HISTORY_TYPES}
+        if page_token:
+            kwargs['pageToken'] = page_token
+        results = service.users().history().list(**kwargs).execute()
+        for record in results.get('history', []):
+            for item in record.get('messagesAdded', []):
+                msg = item['message']
+                added[msg['id']] = msg
+                deleted.discard(msg['id'])
+            for item in record.get('messagesDeleted', []):
+                msg_id = item['message']['id']
+                deleted.add(msg_id)
+                added.pop(msg_id, None)
+                labels.pop(msg_id, None)
+            for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                msg = item['message']
+                if msg['id'] not in deleted:
+                    labels[msg['id']] = msg.get('labelIds', [])
+        history_id = results.get('historyId', history_id)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    return added, deleted, labels, history_id
+
+
+# ¿Quedaron mensajes sin descargar por un error pasajero? Entonces no se avanza
+# el historyId: la próxima sincronización vuelve a pedirlos
+def _incomplete(errors):
+    return any(isinstance(error, RetryLater) for error in errors.values())
+
+
+# Sincronizar la caché: la primera vez descarga los últimos `initial_size` mensajes;
+# después solo transfiere los cambios con users().history().list(startHistoryId=...).
+def sync_mailbox(service, cache, account, initial_size=500, limiter=None):
+    stats = {'full': False, 'added': 0, 'deleted': 0, 'updated': 0, 'errors': 0}
+    start_history_id = cache.history_id(account)
+
+    if start_history_id is not None:
+        try:
+            added, deleted, labels, history_id = _history_changes(service, start_history_id, limiter)
+        except HttpError as e:
+            # historyId demasiado antiguo (404): hay que volver a descargar todo
+            if getattr(e.resp, 'status', None) != 404:
+                raise
+            start_history_id = None
+        else:
+            metadata, errors = fetch_metadata(service, list(added), limiter=limiter)
+            cache.upsert(account, metadata)
+            cache.delete(account, deleted)
+            cache.set_labels(account, {k: v for k, v in labels.items() if k not in added})
+            if not _incomplete(errors):
+                cache.set_history_id(account, history_id)
+            stats.update(added=len(metadata), deleted=len(deleted), updated=len(labels), errors=len(errors))
+            return stats
+
+    # Sincronización completa: tomar el historyId ANTES de listar para no perder cambios
+    if limiter is not None:
+        limiter.acquire(QUOTA_UNITS['users.getProfile'])
+    profile = service.users().getProfile(userId='me').execute()
+    ids = [m['id'] for m in list_message_ids(service, initial_size)]
+    metadata, errors = fetch_metadata(service, ids, limiter=limiter)
+    cache.clear(account)
+    cache.upsert(account, metadata)
+    # Sin historyId la próxima vez se repite la descarga completa
+    if not _incomplete(errors):
+        cache.set_history_id(account, profile['historyId'])
+    stats.update(full=True, added=len(metadata), errors=len(errors))
+    return stats
@@ -0,0 +1,180 @@
+import itertools
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from correo.metrics import SendMetrics, eta_seconds
+
+# Máximo de errores que se guardan por trabajo para mostrarlos en la UI
+MAX_ERRORS_KEPT = 100
+
+
+# Estado de un envío masivo que corre en segundo plano.
+# El hilo del trabajo actualiza los contadores; la UI solo lee snapshot().
+class Job:
+    def __init__(self, job_id, name, total, owner=None, campaign_id=None):
+        self.id = job_id
+        self.name = name
+        self.total = total
+        self.owner = owner
+        self.campaign_id = campaign_id
+        self.status = 'pending'
+        self.enviados = 0
+        self.errores = 0
+        self.omitidos = 0
+        self.rechazados = 0
+        self.errors = []
+        self.detail = ''
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Tiempo por etapa, reintentos y velocidad reciente (lo llenan los modos de envío)
+        self.metrics = SendMetrics()
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def procesados(self):
+        return self.enviados + self.errores + self.omitidos + self.rechazados
+
+    @property
+    def active(self):
+        return self.status in ('pending', 'running')
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    # Filas que no se envían porque ya se habían enviado antes (campaña reanudada)
+    def add_skipped(self, n=1):
+        with self._lock:
+            self.omitidos += n
+
+    # Filas descartadas por la validación (vacías, inválidas, duplicadas o suprimidas)
+    def add_rejected(self, n=1):
+        with self._lock:
+            self.rechazados += n
+
+    def _add_result(self, label, success, msg):
+        with self._lock:
+            if success:
+                self.enviados += 1
+            else:
+                self.errores += 1
+                self.errors.append((label, msg))
+                del self.errors[:-MAX_ERRORS_KEPT]
+        self.metrics.add_result()
+
+    # Copia consistente del estado para pintar en la UI
+    def snapshot(self):
+        with self._lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            rate = (self.enviados + self.errores) / elapsed if elapsed > 0 else 0.0
+            return {
+                'id': self.id,
+                'name': self.name,
+                'campaign_id': self.campaign_id,
+                'status': self.status,
+                'total': self.total,
+                'enviados': self.enviados,
+                'errores': self.errores,
+                'omitidos': self.omitidos,
+                'rechazados': self.rechazados,
+                'procesados': self.procesados,
+                'errors': list(self.errors),
+                'detail': self.detail,
+                'elapsed': elapsed,
+                'rate': rate,
+            }
+
+    # Estado del trabajo junto con sus métricas y la hora estimada de fin
+    def metrics_snapshot(self):
+        snap = self.snapshot()
+        snap.pop('errors')
+        snap.update(self.metrics.snapshot())
+        snap['eta'] = eta_seconds(snap['total'] - snap['procesados'], snap['throughput']) if self.active else 0.0
+        return snap
+
+
+# Items de un trabajo hasta que se cancela: deja de entregar filas nuevas, así
+# el modo de envío termina los envíos que ya están en vuelo y reporta su resultado
+def until_cancelled(job, items):
+    for item in items:
+        if job.cancelled:
+            return
+        yield item
+
+
+# Ejecutor de trabajos en hilos propios, independiente de los reruns de Streamlit.
+# Se guarda con st.cache_resource para que lo compartan todas las sesiones:
+# el rerun (o cierre) de una sesión no detiene los envíos de otra.
+class JobRunner:
+    def __init__(self, max_jobs=4, keep_finished=50):
+        self._pool = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='campaign')
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._keep_finished = keep_finished
+        self._lock = threading.Lock()
+
+    # Lanzar un trabajo. `run` recibe el Job y devuelve un iterable de listas de
+    # resultados (clave, success, msg), igual que los modos de envío.
+    # `label` traduce la clave a un texto (p. ej. el correo) y `on_result` se llama
+    # por cada resultado (p. ej. para guardarlo en el registro de la campaña).
+    def submit(self, name, total, run, owner=None, campaign_id=None, label=None, on_result=None):
+        with self._lock:
+            job = Job(next(self._ids), name, total, owner, campaign_id)
+            self._jobs[job.id] = job
+            self._prune()
+        self._pool.submit(self._execute, job, run, label or str, on_result)
+        return job
+
+    def _execute(self, job, run, label, on_result):
+        job.status = 'running'
+        job.started_at = time.time()
+        results = None
+        try:
+            results = run(job)
+            for resultados in results:
+                for key, success, msg in resultados:
+                    if on_result is not None:
+                        on_result(key, success, msg)
+                    job._add_result(label(key), success, msg)
+            # Al cancelar no se corta el bucle: las fuentes (until_cancelled) dejan de
+            # dar filas y aquí se registran los envíos en vuelo hasta que terminan
+            job.status = 'cancelled' if job.cancelled else 'done'
+        except Exception as e:
+            job.status = 'failed'
+            job.detail = f"{e}\n{traceback.format_exc()}"
+        finally:
+            # Cerrar el generador libera los hilos/peticiones pendientes del modo de envío
+            close = getattr(results, 'close', None)
+            if close is not None:
+                close()
+            job.finished_at = time.time()
+
+    # Olvidar los trabajos terminados más antiguos
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if not j.active]
+        for job in sorted(finished, key=lambda j: j.created_at)[:-self._keep_finished or None]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # Trabajos de un dueño (sesión) o de una campaña, del más reciente al más antiguo
+    def jobs(self, owner=None, campaign_id=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if owner is not None or campaign_id is not None:
+            jobs = [j for j in jobs if (owner is not None and j.owner == owner)
+                    or (campaign_id is not None and j.campaign_id == campaign_id)]
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def active_for_campaign(self, campaign_id):
+        return next((j for j in self.jobs(campaign_id=campaign_id) if j.active), None)
@@ -0,0 +1,115 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from correo.paths import data_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign_id TEXT PRIMARY KEY,
+    name TEXT,
+    total INTEGER,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS sends (
+    campaign_id TEXT NOT NULL,
+    recipient_hash TEXT NOT NULL,
+    email TEXT,
+    status TEXT NOT NULL,
+    message_id TEXT,
+    error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (campaign_id, recipient_hash)
+);
+"""
+
+
+# Identificador estable de una campaña: mismo archivo + mismas plantillas + mismos adjuntos
+def campaign_id(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        h.update(part if part is not None else b'')
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+
+# Hash de un destinatario dentro de la campaña (correo normalizado + contenido personalizado)
+def recipient_hash(email, subject='', body=''):
+    key = f"{email.strip().lower()}\0{subject}\0{body}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+# Extraer el ID de Gmail del mensaje de send_email() ("Mensaje enviado! ID: ...")
+def message_id_from(msg):
+    if 'ID: ' in msg:
+        return msg.rsplit('ID: ', 1)[1].strip()
+    return None
+
+
+# Registro de envíos en SQLite: cada fila enviada (o fallida) se guarda al momento,
+# de modo que una campaña interrumpida se puede reanudar sin reenviar a nadie.
+class SendJournal:
+    def __init__(self, path=None):
+        self.path = path or data_path('journal.sqlite3')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def start_campaign(self, campaign_id, name='', total=0):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO campaigns (campaign_id, name, total, created_at) VALUES (?, ?, ?, ?)',
+                (campaign_id, name, total, time.time())
+            )
+            self._conn.commit()
+
+    # Conjunto de hashes ya enviados (consulta O(1) por fila durante el envío)
+    def completed(self, campaign_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT recipient_hash FROM sends WHERE campaign_id = ? AND status = 'sent'",
+                (campaign_id,)
+            ).fetchall()
+        return {r[0] for r in rows}
+
+    # Guardar el resultado de un envío con el mismo contrato que send_email()
+    def record(self, campaign_id, recipient_hash, email, success, msg):
+        status = 'sent' if success else 'error'
+        message_id = message_id_from(msg) if success else None
+        error = None if success else msg
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO sends (campaign_id, recipient_hash, email, status, message_id, error, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (campaign_id, recipient_hash) DO UPDATE SET '
+                'email = excluded.email, status = excluded.status, message_id = excluded.message_id, '
+                'error = excluded.error, updated_at = excluded.updated_at',
+                (campaign_id, recipient_hash, email, status, message_id, error, time.time())
+            )
+            self._conn.commit()
+
+    # Resumen de la campaña: {'sent': n, 'error': m}
+    def summary(self, campaign_id):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT status, COUNT(*) FROM sends WHERE campaign_id = ? GROUP BY status',
+                (campaign_id,)
+            ).fetchall()
+        return dict(rows)
+
+    # Borrar el registro de una campaña para volver a enviarla completa
+    def reset(self, campaign_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM sends WHERE campaign_id = ?', (campaign_id,))
+            self._conn.execute('DELETE FROM campaigns WHERE campaign_id = ?', (campaign_id,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,230 @@
+import csv
+import functools
+import io
+import itertools
+import unicodedata
+
+import pandas as pd
+
+# Formatos de contactos aceptados
+CONTACT_FILE_TYPES = ['xlsx', 'xls', 'csv', 'parquet']
+DEFAULT_BATCH_SIZE = 5000
+
+
+def _extension(filename):
+    return (filename or '').lower().rsplit('.', 1)[-1]
+
+
+def _rewind(file):
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return file
+
+
+# Nombres de columna como los pone pandas: vacíos → "Unnamed: i", repetidos → "x.1"
+def _header_names(values):
+    names = []
+    seen = {}
+    for i, value in enumerate(values):
+        name = f"Unnamed: {i}" if value is None or str(value).strip() == '' else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+# Filas de un .xlsx en modo read_only: no carga el libro completo en memoria
+def _iter_xlsx_batches(file, batch_size, dtype):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = _header_names(header)
+        offset = 0
+        # Ignorar filas completamente vacías (formato sin datos al final de la hoja)
+        rows = (row for row in rows if any(v is not None for v in row))
+        while True:
+            chunk = list(itertools.islice(rows, batch_size))
+            if not chunk:
+                break
+            width = len(columns)
+            chunk = [tuple(row[:width]) + (None,) * (width - len(row)) for row in chunk]
+            batch = pd.DataFrame(chunk, columns=columns, index=range(offset, offset + len(chunk)))
+            if dtype is str:
+                batch = batch.astype(object).where(batch.notna(), None).map(lambda v: None if v is None else str(v))
+            yield batch
+            offset += len(chunk)
+    finally:
+        workbook.close()
+
+
+# Detectar el separador (',' o ';' en exportaciones de Excel en español)
+def _csv_separator(file):
+    sample = file.read(64 * 1024)
+    file.seek(0)
+    if isinstance(sample, bytes):
+        sample = sample.decode('utf-8', 'ignore')
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+    except csv.Error:
+        return ','
+
+
+def _iter_csv_batches(file, batch_size, dtype):
+    offset = 0
+    sep = _csv_separator(file)
+    # pandas cierra el envoltorio de texto que crea para un archivo binario (y con
+    # él el archivo) al terminar o cortar la lectura; con un envoltorio propio el
+    # archivo queda abierto para la siguiente lectura (vista previa y luego conteo)
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='') if isinstance(file.read(0), bytes) else file
+    try:
+        for batch in pd.read_csv(text, chunksize=batch_size, dtype=dtype, sep=sep):
+            batch.index = range(offset, offset + len(batch))
+            offset += len(batch)
+            yield batch
+    finally:
+        if text is not file:
+            text.detach()
+
+
+def _iter_parquet_batches(file, batch_size, dtype):
+    import pyarrow.parquet as pq
+
+    offset = 0
+    for record_batch in pq.ParquetFile(file).iter_batches(batch_size=batch_size):
+        batch = record_batch.to_pandas()
+        if dtype is str:
+            batch = batch.astype(object).where(batch.notna(), None).map(lambda v: None if v is None else str(v))
+        batch.index = range(offset, offset + len(batch))
+        offset += len(batch)
+        yield batch
+
+
+# Recorrer un archivo de contactos por lotes de `batch_size` filas (memoria acotada).
+# El índice de cada lote es el número de fila global (0, 1, 2, ...).
+def iter_contact_batches(file, filename, batch_size=DEFAULT_BATCH_SIZE, dtype=None):
+    file = _rewind(file)
+    ext = _extension(filename)
+    if ext == 'xlsx':
+        yield from _iter_xlsx_batches(file, batch_size, dtype)
+    elif ext == 'csv':
+        yield from _iter_csv_batches(file, batch_size, dtype)
+    elif ext == 'parquet':
+        yield from _iter_parquet_batches(file, batch_size, dtype)
+    elif ext == 'xls':
+        # .xls (xlrd) no permite lectura por filas: se lee completo y se parte en lotes
+        df = pd.read_excel(file, engine='xlrd', dtype=dtype)
+        for start in range(0, len(df), batch_size):
+            yield df.iloc[start:start + batch_size]
+    else:
+        raise ValueError(f"Formato no soportado: .{ext}. Usa {', '.join(CONTACT_FILE_TYPES)}")
+
+
+# Leer un archivo de contactos completo (para listas pequeñas, p. ej. WhatsApp)
+def read_contacts(file, filename, dtype=None):
+    batches = list(iter_contact_batches(file, filename, dtype=dtype))
+    if not batches:
+        return pd.DataFrame()
+    return pd.concat(batches)
+
+
+# Leer solo una página de filas, deteniendo la lectura en cuanto se completa
+def read_page(file, filename, page=0, page_size=100, dtype=None):
+    start = page * page_size
+    parts = []
+    for batch in iter_contact_batches(file, filename, batch_size=max(page_size, 1000), dtype=dtype):
+        first = batch.index[0]
+        last = batch.index[-1]
+        if last < start:
+            continue
+        parts.append(batch.loc[max(start, first):min(start + page_size - 1, last)])
+        if last >= start + page_size - 1:
+            break
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts)
+
+
+# Vista previa: las primeras `n` filas
+def read_preview(file, filename, n=100, dtype=None):
+    return read_page(file, filename, 0, n, dtype)
+
+
+# Número de filas de datos sin cargar el archivo en memoria
+def count_rows(file, filename):
+    file = _rewind(file)
+    ext = _extension(filename)
+    if ext == 'parquet':
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(file).metadata.num_rows
+    if ext == 'xlsx':
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            # Recorrer las filas igual que _iter_xlsx_batches (sin armar DataFrames): la
+            # dimensión declarada en la hoja puede estar desactualizada o incluir filas vacías
+            rows = workbook.active.iter_rows(values_only=True)
+            next(rows, None)
+            return sum(1 for row in rows if any(v is not None for v in row))
+        finally:
+            workbook.close()
+    return sum(len(batch) for batch in iter_contact_batches(file, filename, batch_size=20000))
+
+
+# Normalizar nombres de columna: quitar acentos, espacios y pasar a minúsculas
+# (memoizado: los mismos encabezados se normalizan en cada rerun)
+@functools.lru_cache(maxsize=4096)
+def normalize_colname(name):
+    if not isinstance(name, str):
+        name = str(name)
+    # quitar espacios alrededor
+    s = name.strip().lower()
+    # quitar acentos
+    s = unicodedata.normalize('NFKD', s)
+    s = ''.join(c for c in s if not unicodedata.combining(c))
+    # reemplazar espacios y guiones bajos por nada
+    s = s.replace(' ', '').replace('_', '').replace('-', '')
+    return s
+
+
+# Mapeo de encabezados a columnas canónicas, memoizado por la tupla de encabezados
+@functools.lru_cache(maxsize=256)
+def canonical_rename_map(columns):
+    # Map columns by substring matching to handle variants like 'número_de_teléfono'
+    rename_map = {}
+    used_targets = set()
+    for col in columns:
+        norm = normalize_colname(col)
+        target = None
+        if 'nombre' in norm:
+            target = 'Nombre'
+        elif any(k in norm for k in ('correo', 'correoelectronico', 'email', 'mail')):
+            target = 'email'
+        elif any(k in norm for k in ('telefono', 'numerodetelefono', 'numero', 'movil', 'celular')):
+            target = 'Celular'
+
+        if target and target not in used_targets:
+            rename_map[col] = target
+            used_targets.add(target)
+    return rename_map
+
+
+def canonicalize_columns(df):
+    rename_map = canonical_rename_map(tuple(df.columns))
+    if rename_map:
+        df = df.rename(columns=rename_map)
+    return df
+
+
+# Copia en memoria para recorrer el archivo desde otro hilo (el upload de Streamlit no es thread-safe)
+def buffer_of(uploaded_file):
+    return io.BytesIO(uploaded_file.getvalue())
@@ -0,0 +1,355 @@
+import importlib.util
+import io
+import itertools
+import os
+import threading
+import time
+
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+from correo.attachments import PrecompiledAttachments
+from correo.paths import data_path
+
+# Memoria por sesión antes de mandar sus datos a disco, memoria total del
+# servidor y minutos sin uso antes de liberar los datos de una sesión
+SESSION_BUDGET_MB = float(os.environ.get('CORREO_SESSION_MEMORY_MB', 256))
+TOTAL_BUDGET_MB = float(os.environ.get('CORREO_MEMORY_MB', 1024))
+SESSION_TTL_MINUTES = float(os.environ.get('CORREO_SESSION_TTL_MINUTES', 30))
+# Datos más chicos que esto se quedan en memoria (no vale la pena escribirlos)
+MIN_SPILL_BYTES = 1024 * 1024
+MB = 1024 * 1024
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+_names = itertools.count(1)
+
+
+def spill_path(suffix):
+    return data_path('spill', f"{os.getpid()}_{next(_names)}{suffix}")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Un dato de una sesión que puede pasar a disco. `value()` lo devuelve esté
+# donde esté; `spill()` lo escribe a disco y libera la copia en memoria.
+# `tag` identifica la versión (p. ej. la huella del archivo subido).
+class SpillEntry:
+    tag = None
+    spilled = False
+
+    def resident_bytes(self):
+        raise NotImplementedError
+
+    def disk_bytes(self):
+        return 0
+
+    # ¿Vale la pena pasarlo a disco?
+    def can_spill(self):
+        return True
+
+    def spill(self):
+        raise NotImplementedError
+
+    def value(self):
+        raise NotImplementedError
+
+    # ¿Lo está leyendo un trabajo? (entonces no se libera por inactividad)
+    def in_use(self):
+        return False
+
+    def close(self):
+        pass
+
+
+# DataFrame: en disco como archivo Arrow (Feather sin compresión) si todas sus
+# columnas son numéricas, que se lee con mmap sin copiarlas; si tiene columnas
+# de texto (p. ej. los contactos de WhatsApp, leídos como str), como Parquet,
+# más chico en disco. value() lo lee solo para la corrida que lo pide y no lo
+# vuelve a dejar en memoria: la copia se libera al terminar esa corrida.
+# Sin pyarrow se queda en memoria.
+class FrameEntry(SpillEntry):
+    def __init__(self, df, tag=None):
+        self.tag = tag
+        self._df = df
+        self._size = int(df.memory_usage(index=True, deep=True).sum())
+        self._lock = threading.Lock()
+        self._closed = False
+        self.path = None
+
+    def resident_bytes(self):
+        return 0 if self.spilled else self._size
+
+    def disk_bytes(self):
+        return os.path.getsize(self.path) if self.spilled else 0
+
+    def can_spill(self):
+        return HAS_PYARROW and self._df is not None
+
+    @staticmethod
+    def _mappable(df):
+        return all(is_numeric_dtype(dtype) or is_bool_dtype(dtype) for dtype in df.dtypes)
+
+    def spill(self):
+        with self._lock:
+            if self.spilled or self._closed:
+                return False
+            if self._mappable(self._df):
+                from pyarrow import feather
+
+                path = spill_path('.arrow')
+                feather.write_feather(self._df, path, compression='uncompressed')
+            else:
+                path = spill_path('.parquet')
+                self._df.to_parquet(path, engine='pyarrow')
+            self.path = path
+            self.spilled = True
+            self._df = None
+        return True
+
+    def value(self):
+        df = self._df
+        if df is not None:
+            return df
+        if self.path.endswith('.parquet'):
+            return pd.read_parquet(self.path, engine='pyarrow')
+        from pyarrow import feather
+
+        # Una columna por bloque: las numéricas apuntan al archivo mapeado, sin copia
+        return feather.read_table(self.path, memory_map=True).to_pandas(split_blocks=True)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self.path:
+                _remove(self.path)
+
+
+# Archivo en disco de un BytesEntry: al cerrarlo se avisa a la entrada, que
+# borra el archivo cuando ya no lo lee nadie y la entrada se liberó
+class SpillReader(io.BufferedReader):
+    def __init__(self, path, entry):
+        super().__init__(io.FileIO(path, 'rb'))
+        self._entry = entry
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self._entry._release()
+
+
+# Contenido de un archivo (p. ej. la hoja de una campaña): value() devuelve un
+# archivo para leerlo (en memoria o en disco). Quien lo recibe lo cierra al
+# terminar (p. ej. con `with`); mientras esté abierto, la entrada no se libera
+# por inactividad y su archivo en disco no se borra.
+class BytesEntry(SpillEntry):
+    def __init__(self, data, tag=None):
+        self.tag = tag
+        self._data = data
+        self._size = len(data)
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._closed = False
+        self.path = None
+
+    def resident_bytes(self):
+        return 0 if self.spilled else self._size
+
+    def disk_bytes(self):
+        return self._size if self.spilled else 0
+
+    def spill(self):
+        with self._lock:
+            if self.spilled or self._closed:
+                return False
+            path = spill_path('.bin')
+            with open(path, 'wb') as f:
+                f.write(self._data)
+            self.path = path
+            self.spilled = True
+            self._data = None
+        return True
+
+    def value(self):
+        with self._lock:
+            if not self.spilled:
+                return io.BytesIO(self._data)
+            self._readers += 1
+        return SpillReader(self.path, self)
+
+    def in_use(self):
+        return self._readers > 0
+
+    def _release(self):
+        with self._lock:
+            self._readers -= 1
+            if self._closed and not self._readers and self.path:
+                _remove(self.path)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if not self._readers and self.path:
+                _remove(self.path)
+
+
+# Adjuntos precompilados de una campaña: al pasar a disco su bloque común se
+# lee con mmap en el mismo objeto, así los trabajos que ya lo usan también
+# dejan de cargarlo en memoria
+class AttachmentsEntry(SpillEntry):
+    def __init__(self, attachments, tag=None):
+        self.tag = tag
+        self._attachments = attachments
+
+    def resident_bytes(self):
+        return 0 if self.spilled else self._attachments.size + len(self._attachments.encoded or '')
+
+    def disk_bytes(self):
+        return len(self._attachments._map) if self.spilled else 0
+
+    def spill(self):
+        self._attachments.spill(spill_path('.mime'))
+        self.spilled = True
+        return True
+
+    def value(self):
+        return self._attachments
+
+
+# Entrada adecuada para un valor (DataFrame, bytes o adjuntos precompilados)
+def make_entry(value, tag=None):
+    if isinstance(value, PrecompiledAttachments):
+        return AttachmentsEntry(value, tag)
+    if isinstance(value, (bytes, bytearray)):
+        return BytesEntry(value, tag)
+    return FrameEntry(value, tag)
+
+
+# Presupuesto de memoria del servidor, compartido por todas las sesiones.
+# Cada sesión guarda sus datos grandes por clave; cuando una sesión pasa de
+# `session_bytes` (o el servidor de `total_bytes`), sus datos más grandes se
+# escriben a disco y se leen desde ahí. Los datos de una sesión sin actividad
+# durante `ttl` segundos se liberan (y sus archivos se borran).
+class MemoryBudget:
+    def __init__(self, session_bytes=SESSION_BUDGET_MB * MB, total_bytes=TOTAL_BUDGET_MB * MB,
+                 ttl=SESSION_TTL_MINUTES * 60, clock=time.monotonic):
+        self.session_bytes = session_bytes
+        self.total_bytes = total_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._sessions = {}
+        # Entradas que se están escribiendo a disco (fuera del candado)
+        self._spilling = set()
+        self._lock = threading.Lock()
+
+    # Guardar (o reemplazar) un dato de la sesión y devolver su entrada. Lo que
+    # haya que pasar a disco se elige con el candado y se escribe sin él, para
+    # no detener a las demás sesiones mientras dura la escritura.
+    def put(self, session, key, value, tag=None):
+        entry = value if isinstance(value, SpillEntry) else make_entry(value, tag)
+        with self._lock:
+            self._evict_idle()
+            data = self._session(session)
+            old = data['entries'].pop(key, None)
+            data['entries'][key] = entry
+            to_spill = self._enforce(session)
+            self._spilling.update(map(id, to_spill))
+        if old is not None and old is not entry:
+            old.close()
+        try:
+            for spilled in to_spill:
+                spilled.spill()
+        finally:
+            with self._lock:
+                self._spilling.difference_update(map(id, to_spill))
+        return entry
+
+    # Entrada guardada (None si no existe o si su versión `tag` cambió)
+    def get(self, session, key, tag=None):
+        with self._lock:
+            self._evict_idle()
+            entry = self._session(session)['entries'].get(key)
+        if entry is None or (tag is not None and entry.tag != tag):
+            return None
+        return entry
+
+    def discard(self, session, key):
+        with self._lock:
+            entry = self._sessions.get(session, {}).get('entries', {}).pop(key, None)
+        if entry is not None:
+            entry.close()
+
+    # Liberar todos los datos de una sesión
+    def drop(self, session):
+        with self._lock:
+            data = self._sessions.pop(session, None)
+        for entry in (data or {}).get('entries', {}).values():
+            entry.close()
+
+    # Bytes en memoria y en disco de una sesión (o de todo el servidor)
+    def usage(self, session=None):
+        with self._lock:
+            sessions = [self._sessions.get(session)] if session is not None else list(self._sessions.values())
+            entries = [e for data in sessions if data for e in data['entries'].values()]
+            return {
+                'sessions': len(self._sessions),
+                'resident': sum(e.resident_bytes() for e in entries),
+                'disk': sum(e.disk_bytes() for e in entries),
+            }
+
+    def _session(self, session):
+        data = self._sessions.setdefault(session, {'entries': {}, 'last': self.clock()})
+        data['last'] = self.clock()
+        return data
+
+    def _resident(self, data):
+        return sum(e.resident_bytes() for e in data['entries'].values())
+
+    # Datos más grandes de una sesión que hay que mandar a disco para que quepa
+    # en `limit` (cada uno deja de ocupar memoria al escribirse)
+    def _plan_spill(self, data, limit, planned):
+        candidates = sorted(
+            (e for e in data['entries'].values()
+             if not e.spilled and id(e) not in self._spilling and e not in planned
+             and e.resident_bytes() >= MIN_SPILL_BYTES and e.can_spill()),
+            key=lambda e: e.resident_bytes(), reverse=True
+        )
+        resident = self._resident(data) - sum(e.resident_bytes() for e in planned if e in data['entries'].values())
+        chosen = []
+        for entry in candidates:
+            if resident <= limit:
+                break
+            chosen.append(entry)
+            resident -= entry.resident_bytes()
+        return chosen
+
+    # Primero el presupuesto de la sesión; después el del servidor, empezando
+    # por las sesiones que llevan más tiempo sin uso. Devuelve las entradas que
+    # hay que escribir a disco (no las escribe).
+    def _enforce(self, session):
+        planned = self._plan_spill(self._sessions[session], self.session_bytes, [])
+        total = sum(self._resident(d) for d in self._sessions.values()) - sum(e.resident_bytes() for e in planned)
+        if total <= self.total_bytes:
+            return planned
+        for data in sorted(self._sessions.values(), key=lambda d: d['last']):
+            excess = total - self.total_bytes
+            if excess <= 0:
+                break
+            before = self._resident(data) - sum(e.resident_bytes() for e in planned if e in data['entries'].values())
+            chosen = self._plan_spill(data, max(0, before - excess), planned)
+            planned.extend(chosen)
+            total -= sum(e.resident_bytes() for e in chosen)
+        return planned
+
+    # Liberar las sesiones inactivas, salvo las que tienen datos que un trabajo aún lee
+    def _evict_idle(self):
+        now = self.clock()
+        for session, data in list(self._sessions.items()):
+            if now - data['last'] > self.ttl and not any(e.in_use() for e in data['entries'].values()):
+                del self._sessions[session]
+                for entry in data['entries'].values():
+                    entry.close()
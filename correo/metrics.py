@@ -0,0 +1,217 @@
+import bisect
+import collections
+import contextlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Etapas del envío de un mensaje que se miden por separado
+STAGES = ('render', 'document', 'mime', 'encode', 'api', 'backoff')
+STAGE_LABELS = {
+    'render': 'Personalización',
+    'document': 'Documento por contacto',
+    'mime': 'Armado MIME',
+    'encode': 'Base64',
+    'api': 'Llamada a la API',
+    'backoff': 'Espera (cuota y reintentos)',
+}
+# Límites superiores (segundos) de los buckets de los histogramas, como en Prometheus
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Segundos que abarca la velocidad "actual" (para la hora estimada de fin)
+THROUGHPUT_WINDOW = 30
+
+_NO_TIMER = contextlib.nullcontext()
+
+
+# Histograma de duraciones con buckets fijos (sin guardar cada muestra)
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    # `n` muestras de `seconds` cada una (p. ej. un lote repartido entre sus mensajes)
+    def observe(self, seconds, n=1):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += n
+        self.count += n
+        self.sum += seconds * n
+
+    # Cuantil aproximado interpolando dentro del bucket (como histogram_quantile)
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+# Métricas de un envío masivo: tiempo por etapa, reintentos y velocidad reciente.
+# La comparten los hilos de envío; cada medición toma el candado una sola vez.
+class SendMetrics:
+    def __init__(self, clock=time.monotonic):
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.retries = 0
+        self.results = 0
+        self._completed = collections.deque()
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, n=1):
+        with self._lock:
+            self.histograms[stage].observe(seconds, n)
+
+    # Medir un bloque: `with metrics.timer('api'): request.execute()`
+    @contextlib.contextmanager
+    def timer(self, stage, n=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - start) / n, n)
+
+    def add_retry(self, n=1):
+        with self._lock:
+            self.retries += n
+
+    # Un mensaje terminado (enviado o con error) para la velocidad reciente
+    def add_result(self, n=1):
+        now = self._clock()
+        with self._lock:
+            self.results += n
+            self._completed.append((now, n))
+            while self._completed and self._completed[0][0] < now - THROUGHPUT_WINDOW:
+                self._completed.popleft()
+
+    # Mensajes por segundo en los últimos THROUGHPUT_WINDOW segundos
+    def throughput(self):
+        now = self._clock()
+        with self._lock:
+            recent = [(t, n) for t, n in self._completed if t >= now - THROUGHPUT_WINDOW]
+        if not recent:
+            return 0.0
+        span = max(now - recent[0][0], 1.0)
+        return sum(n for _, n in recent) / span
+
+    def snapshot(self):
+        throughput = self.throughput()
+        with self._lock:
+            return {
+                'stages': {stage: h.summary() for stage, h in self.histograms.items()},
+                'retries': self.retries,
+                'results': self.results,
+                'throughput': throughput,
+            }
+
+
+# Métricas que no miden nada (para llamar sin métricas sin preguntar cada vez)
+class NullMetrics(SendMetrics):
+    def observe(self, stage, seconds, n=1):
+        pass
+
+    def timer(self, stage, n=1):
+        return _NO_TIMER
+
+    def add_retry(self, n=1):
+        pass
+
+    def add_result(self, n=1):
+        pass
+
+
+NO_METRICS = NullMetrics()
+
+
+# Segundos que faltan al ritmo actual (None si aún no hay ritmo)
+def eta_seconds(remaining, throughput):
+    if remaining <= 0:
+        return 0.0
+    return remaining / throughput if throughput > 0 else None
+
+
+# Exportar en JSON: {job_id: {...snapshot del trabajo y sus métricas}}
+def metrics_json(jobs):
+    return json.dumps({str(job.id): job.metrics_snapshot() for job in jobs}, indent=2, default=str)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+# Exportar en el formato de texto de Prometheus (un conjunto de series por trabajo)
+def prometheus_text(jobs):
+    lines = [
+        '# HELP correo_stage_seconds Tiempo por etapa del envío de cada mensaje.',
+        '# TYPE correo_stage_seconds histogram',
+    ]
+    counters = []
+    for job in jobs:
+        snap = job.metrics_snapshot()
+        base = f'job="{job.id}",campaign="{_label(job.campaign_id or job.name)}"'
+        for stage, h in snap['stages'].items():
+            cumulative = 0
+            for bound, count in h['buckets'].items():
+                cumulative += count
+                lines.append(f'correo_stage_seconds_bucket{{{base},stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'correo_stage_seconds_sum{{{base},stage="{stage}"}} {h["sum"]:.6f}')
+            lines.append(f'correo_stage_seconds_count{{{base},stage="{stage}"}} {h["count"]}')
+        counters.append((base, snap))
+    for name, kind, help_text, value in (
+        ('correo_messages_sent_total', 'counter', 'Mensajes enviados.', lambda s: s['enviados']),
+        ('correo_messages_failed_total', 'counter', 'Mensajes con error.', lambda s: s['errores']),
+        ('correo_retries_total', 'counter', 'Reintentos por cuota o fallo del servidor.', lambda s: s['retries']),
+        ('correo_messages_remaining', 'gauge', 'Mensajes que faltan por procesar.',
+         lambda s: max(0, s['total'] - s['procesados'])),
+        ('correo_throughput_messages_per_second', 'gauge', 'Velocidad reciente de envío.', lambda s: s['throughput']),
+    ):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for base, snap in counters:
+            lines.append(f'{name}{{{base}}} {value(snap):g}')
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        jobs = self.server.collect()
+        if self.path.partition('?')[0] == '/metrics.json':
+            body, content_type = metrics_json(jobs), 'application/json'
+        else:
+            body, content_type = prometheus_text(jobs), 'text/plain; version=0.0.4'
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Servir /metrics (Prometheus) y /metrics.json para el monitoreo; `collect()`
+# devuelve los trabajos a exportar en cada consulta
+def start_metrics_server(collect, host='127.0.0.1', port=9464):
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.collect = collect
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,11 @@
+import os
+
+# Carpeta para los datos locales de la app (registro de campañas, cachés, colas)
+DATA_DIR = os.environ.get('CORREO_DATA_DIR', os.path.join(os.getcwd(), '.correo'))
+
+
+# Ruta dentro de la carpeta de datos (se crea si no existe)
+def data_path(*parts):
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -0,0 +1,82 @@
+import threading
+import time
+
+# Costo en unidades de cuota de Gmail por método de la API
+QUOTA_UNITS = {
+    'messages.send': 100,
+    'drafts.create': 10,
+    'drafts.send': 100,
+    'drafts.delete': 10,
+    'messages.get': 5,
+    'messages.list': 5,
+    'history.list': 2,
+    'users.getProfile': 1,
+}
+
+# Límite de Gmail por usuario: 250 unidades de cuota por segundo
+GMAIL_USER_UNITS_PER_SEC = 250
+
+
+# Limitador tipo "token bucket" compartido entre hilos.
+# Se recarga a `rate` unidades por segundo hasta `capacity`; acquire() bloquea
+# hasta que haya unidades suficientes. Ante un error de cuota (429) se usa
+# backoff(): pausa el bucket y reduce la velocidad a la mitad; cada éxito la
+# recupera poco a poco hasta la velocidad nominal (aumento aditivo/reducción
+# multiplicativa).
+class TokenBucket:
+    def __init__(self, rate, capacity=None, min_rate=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("rate debe ser mayor que cero")
+        self.nominal_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.min_rate = float(min_rate if min_rate is not None else rate / 16)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    # Esperar hasta poder consumir `tokens` unidades; devuelve los segundos esperados
+    def acquire(self, tokens=1):
+        tokens = min(float(tokens), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return waited
+                    delay = (tokens - self._tokens) / self.rate
+            self._sleep(delay)
+            waited += delay
+
+    # Pausar todas las solicitudes `delay` segundos y bajar la velocidad
+    def backoff(self, delay):
+        with self._lock:
+            now = self._clock()
+            self._paused_until = max(self._paused_until, now + delay)
+            self._tokens = 0.0
+            self._updated = max(now, self._paused_until)
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    # Recuperar velocidad tras `n` envíos correctos
+    def recover(self, n=1):
+        with self._lock:
+            if self.rate < self.nominal_rate:
+                self.rate = min(self.nominal_rate, self.rate + n * self.nominal_rate / 20)
+
+
+# Limitador por defecto para una cuenta de Gmail
+def gmail_limiter(units_per_sec=GMAIL_USER_UNITS_PER_SEC):
+    return TokenBucket(units_per_sec, capacity=max(units_per_sec, QUOTA_UNITS['messages.send']))
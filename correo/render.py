@@ -0,0 +1,97 @@
+import functools
+import string
+
+import pandas as pd
+
+# Campos que se pueden usar en las plantillas
+TEMPLATE_FIELDS = ('Nombre', 'Celular', 'email')
+
+_formatter = string.Formatter()
+
+
+# Error de plantilla con un mensaje que se puede mostrar al usuario
+class TemplateError(ValueError):
+    pass
+
+
+# Plantilla ya analizada: lista de (texto literal, campo, conversión, formato)
+class CompiledTemplate:
+    def __init__(self, template, fields=TEMPLATE_FIELDS):
+        self.template = template
+        self.segments = []
+        try:
+            parsed = list(_formatter.parse(template))
+        except ValueError as e:
+            raise TemplateError(f"Plantilla mal formada: {e}") from e
+        for literal, field, conversion, spec in parsed:
+            if field is not None:
+                if field == '' or field.isdigit():
+                    raise TemplateError("Usa campos con nombre, por ejemplo {Nombre}")
+                if field not in fields:
+                    raise TemplateError(f"Campo desconocido en la plantilla: {{{field}}}")
+                if spec and ('{' in spec):
+                    raise TemplateError("No se admiten campos anidados en el formato")
+            self.segments.append((literal, field, conversion, spec))
+        self.fields = {field for _, field, _, _ in self.segments if field is not None}
+        # Sin conversiones ni formatos basta con concatenar columnas
+        self.simple = all(not conversion and not spec for _, _, conversion, spec in self.segments)
+
+    # Renderizar un solo registro (dict con los valores como texto)
+    def render_one(self, values):
+        return self.template.format(**{f: values.get(f, '') for f in self.fields})
+
+    # Renderizar todas las filas de una vez a partir de columnas de texto
+    def render_columns(self, columns, index):
+        if not self.simple:
+            # Con conversiones o formatos ({Nombre!r}, {email:>20}) se formatea fila a fila
+            names = sorted(self.fields)
+            rows = zip(*(columns[f] for f in names))
+            return pd.Series(
+                [self.template.format(**dict(zip(names, values))) for values in rows],
+                index=index,
+                dtype=object
+            )
+        result = pd.Series('', index=index, dtype=object)
+        for literal, field, _, _ in self.segments:
+            if literal:
+                result = result + literal
+            if field is not None:
+                result = result + columns[field]
+        return result
+
+
+# Las plantillas se analizan una sola vez aunque se rendericen en cada rerun
+@functools.lru_cache(maxsize=64)
+def compile_template(template, fields=TEMPLATE_FIELDS):
+    return CompiledTemplate(template, fields)
+
+
+# Columnas de texto limpias (vacías si faltan o son NaN) para todas las filas
+def template_columns(df, fields=TEMPLATE_FIELDS):
+    columns = {}
+    for field in fields:
+        if field in df.columns:
+            columns[field] = df[field].astype(object).where(df[field].notna(), '').astype(str).str.strip().astype(object)
+        else:
+            columns[field] = pd.Series('', index=df.index, dtype=object)
+    return columns
+
+
+# Renderizar asunto y cuerpo de toda la campaña en una pasada por columnas.
+# Devuelve un DataFrame con Nombre, Celular, email, asunto y mensaje (mismo índice que df)
+def render_campaign(df, subject_template, message_template):
+    subject = compile_template(subject_template)
+    body = compile_template(message_template)
+    columns = template_columns(df)
+    return pd.DataFrame({
+        'Nombre': columns['Nombre'],
+        'Celular': columns['Celular'],
+        'email': columns['email'],
+        'asunto': subject.render_columns(columns, df.index),
+        'mensaje': body.render_columns(columns, df.index),
+    }, index=df.index)
+
+
+# Renderizar una sola plantilla para todas las filas (p. ej. mensajes de WhatsApp)
+def render_template(df, template):
+    return compile_template(template).render_columns(template_columns(df), df.index)
@@ -0,0 +1,158 @@
+import random
+import time
+
+import httplib2
+from google.auth.exceptions import TransportError
+from googleapiclient.errors import HttpError
+
+from correo.metrics import NO_METRICS
+from correo.ratelimit import QUOTA_UNITS
+
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+# Límite diario de envío de la cuenta agotado: no sirve reintentar con la misma cuenta
+QUOTA_EXHAUSTED_REASONS = ('dailyLimitExceeded', 'quotaExceeded', 'sending limit exceeded', 'sending quota exceeded')
+# Estados HTTP que indican un fallo pasajero del servidor (se reintentan)
+TRANSIENT_STATUSES = (408, 500, 502, 503, 504)
+# Clases de error de un envío
+RATE_LIMITED = 'rate_limited'
+QUOTA_EXHAUSTED = 'quota_exhausted'
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+# Vueltas de la cola de reintentos al final de la campaña y espera antes de cada una (s)
+RETRY_ROUNDS = 2
+RETRY_COOLDOWN = 10
+
+
+# Detectar si un error de la API es por exceso de cuota (429 o 403 rateLimitExceeded)
+def is_rate_limit_error(exc):
+    if not isinstance(exc, HttpError):
+        return False
+    status = getattr(exc.resp, 'status', None)
+    if status == 429:
+        return True
+    if status == 403:
+        content = exc.content.decode('utf-8', 'replace') if isinstance(exc.content, bytes) else str(exc.content)
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+
+# Detectar si la cuenta agotó su límite diario de envío (403/429 dailyLimitExceeded)
+def is_quota_exhausted(exc):
+    if not isinstance(exc, HttpError) or getattr(exc.resp, 'status', None) not in (403, 429):
+        return False
+    content = exc.content.decode('utf-8', 'replace') if isinstance(exc.content, bytes) else str(exc.content)
+    content = content.lower()
+    return any(reason.lower() in content for reason in QUOTA_EXHAUSTED_REASONS)
+
+
+# Clasificar el error de un envío: límite diario agotado (se cambia de cuenta), exceso de cuota (se espera y se baja la
+# velocidad de todos), transitorio (5xx, red caída: se reintenta) o permanente
+# (dirección inválida, mensaje rechazado: se falla de inmediato)
+def classify_error(exc):
+    if is_quota_exhausted(exc):
+        return QUOTA_EXHAUSTED
+    if is_rate_limit_error(exc) or getattr(exc, 'rate_limited', False):
+        return RATE_LIMITED
+    if isinstance(exc, HttpError):
+        return TRANSIENT if getattr(exc.resp, 'status', None) in TRANSIENT_STATUSES else PERMANENT
+    # Los errores de otros backends (p. ej. WhatsAppApiError) dicen si se pueden reintentar
+    if getattr(exc, 'retryable', False):
+        return TRANSIENT
+    if isinstance(exc, (OSError, httplib2.HttpLib2Error, TransportError)):
+        return TRANSIENT
+    return PERMANENT
+
+
+# Mensaje de error de un envío que falló por un error transitorio: sigue siendo
+# el texto "Error: ..." de siempre, pero la cola de reintentos lo reconoce
+class RetryLater(str):
+    pass
+
+
+# Texto del resultado fallido de un envío (marcado si vale la pena reintentarlo)
+def failure_message(exc):
+    msg = f"Error: {str(exc)}"
+    return RetryLater(msg) if classify_error(exc) in (RATE_LIMITED, TRANSIENT) else msg
+
+
+# Ejecutar `call()` (p. ej. un messages.send) esperando cuota antes de cada
+# intento y reintentando los errores de cuota y transitorios con espera
+# exponencial con jitter (o Retry-After). Los de cuota pausan el limitador
+# compartido; los permanentes y el límite diario agotado se lanzan de inmediato.
+def call_with_retry(call, limiter=None, units=QUOTA_UNITS['messages.send'], max_retries=5, metrics=NO_METRICS,
+                    sleep=time.sleep):
+    attempt = 0
+    while True:
+        if limiter is not None:
+            metrics.observe('backoff', limiter.acquire(units))
+        try:
+            result = call()
+        except Exception as e:
+            kind = classify_error(e)
+            if kind not in (RATE_LIMITED, TRANSIENT) or attempt >= max_retries:
+                raise
+            delay = backoff_delay(e, attempt)
+            if kind == RATE_LIMITED and limiter is not None:
+                # Pausar a todos los hilos y bajar la velocidad (la espera se mide en acquire)
+                limiter.backoff(delay)
+            else:
+                sleep(delay)
+                metrics.observe('backoff', delay)
+            metrics.add_retry()
+            attempt += 1
+            continue
+        if limiter is not None:
+            limiter.recover()
+        return result
+
+
+# Segundos de espera ante un error de cuota: Retry-After si existe, si no exponencial con jitter
+def backoff_delay(exc, attempt, base=1.0, cap=32.0):
+    retry_after = None
+    try:
+        retry_after = exc.resp.get('retry-after')
+    except Exception:
+        pass
+    if retry_after:
+        try:
+            return min(cap, float(retry_after))
+        except ValueError:
+            pass
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+# Cola de reintentos de una campaña: los envíos que fallaron por un error
+# transitorio (ya reintentados en su momento) se apartan y se vuelven a mandar
+# al terminar la pasada principal, hasta `rounds` veces y tras una espera; solo
+# entonces se reporta su error. Los errores permanentes se reportan al momento.
+# `send_many(items)` produce (clave, success, msg) como ConcurrentSender.send().
+def with_retry_queue(send_many, items, rounds=RETRY_ROUNDS, cooldown=RETRY_COOLDOWN, metrics=NO_METRICS,
+                     sleep=time.sleep):
+    for round_number in range(rounds + 1):
+        in_flight = {}
+        deferred = []
+
+        # Recordar cada correo mientras está en vuelo para poder reencolarlo
+        def track(items):
+            for item in items:
+                in_flight[item[0]] = item
+                yield item
+
+        results = send_many(track(items))
+        try:
+            for key, success, msg in results:
+                item = in_flight.pop(key, None)
+                if not success and isinstance(msg, RetryLater) and item is not None and round_number < rounds:
+                    deferred.append(item)
+                    continue
+                yield key, success, msg
+        finally:
+            close = getattr(results, 'close', None)
+            if close is not None:
+                close()
+        if not deferred:
+            return
+        metrics.add_retry(len(deferred))
+        sleep(cooldown)
+        metrics.observe('backoff', cooldown)
+        items = deferred
@@ -0,0 +1,524 @@
+import itertools
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+from correo.attachments import content_hash, precompile_attachments
+from correo.backends import BACKENDS
+from correo.clients import GmailClientPool
+from correo.paths import data_path
+from correo.retry import RetryLater
+from correo.vault import Vault
+
+# Límite diario de Gmail para cuentas personales (Workspace admite 2000)
+DEFAULT_DAILY_LIMIT = 500
+# Filas que el despachador toma de una campaña en cada vuelta
+CLAIM_SIZE = 50
+# Cada cuánto revisa la cola el hilo despachador (segundos)
+POLL_SECONDS = 30
+# Filas "enviando" más viejas que esto quedaron de un proceso que murió: se reintentan
+STALE_CLAIM_SECONDS = 3600
+# Borradores que se preparan por vuelta y llamadas en paralelo (al prepararlos y al enviarlos)
+STAGE_SIZE = 200
+DRAFT_WORKERS = 8
+DAY = 24 * 3600
+HOUR = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    account TEXT PRIMARY KEY,
+    credentials TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign_id TEXT PRIMARY KEY,
+    name TEXT,
+    backend TEXT NOT NULL,
+    account TEXT NOT NULL,
+    send_at REAL NOT NULL,
+    window_start INTEGER,
+    window_end INTEGER,
+    daily_limit INTEGER,
+    attachments TEXT,
+    options TEXT,
+    prestage INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    detail TEXT,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS queue (
+    campaign_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    recipient TEXT,
+    subject TEXT,
+    body TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    message TEXT,
+    claim TEXT,
+    claimed_at REAL,
+    sent_at REAL,
+    draft_id TEXT,
+    PRIMARY KEY (campaign_id, seq)
+);
+CREATE INDEX IF NOT EXISTS queue_status ON queue (campaign_id, status, seq);
+CREATE INDEX IF NOT EXISTS queue_sent_at ON queue (sent_at);
+"""
+# Columnas agregadas después de la primera versión (las colas ya creadas las reciben al abrirse)
+MIGRATIONS = {
+    'campaigns': [('prestage', 'INTEGER NOT NULL DEFAULT 0')],
+    'queue': [('draft_id', 'TEXT')],
+}
+
+
+# Guardar los adjuntos por su hash (una copia por contenido) y devolver sus referencias
+def store_attachments(attachments):
+    refs = []
+    for attachment in attachments or []:
+        digest = content_hash(attachment['content'])
+        path = data_path('attachments', digest)
+        if not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as f:
+                f.write(attachment['content'])
+            os.replace(path + '.tmp', path)
+        refs.append({'name': attachment['name'], 'digest': digest})
+    return refs
+
+
+def load_attachments(refs):
+    attachments = []
+    for ref in refs or []:
+        with open(data_path('attachments', ref['digest']), 'rb') as f:
+            attachments.append({'name': ref['name'], 'content': f.read()})
+    return attachments
+
+
+# ¿La hora local `now` cae dentro de la ventana [inicio, fin) en horas? (admite cruzar medianoche)
+def in_window(now, window_start, window_end):
+    if window_start is None or window_end is None or window_start == window_end:
+        return True
+    hour = time.localtime(now).tm_hour + time.localtime(now).tm_min / 60
+    if window_start < window_end:
+        return window_start <= hour < window_end
+    return hour >= window_start or hour < window_end
+
+
+def window_hours(window_start, window_end):
+    if window_start is None or window_end is None or window_start == window_end:
+        return 24
+    return (window_end - window_start) % 24
+
+
+# Cola persistente de campañas programadas (SQLite). Un hilo despachador las
+# envía aunque nadie tenga la página abierta: respeta la fecha de inicio, la
+# ventana horaria y el límite diario de cada cuenta, repartiendo el envío en
+# partes iguales por hora dentro de la ventana. Las credenciales de las cuentas
+# y las opciones de cada campaña (p. ej. el token de WhatsApp) se guardan cifradas.
+class Scheduler:
+    def __init__(self, path=None, backend_factory=None, client_pool=None, clock=time.time, vault=None):
+        self.path = path or data_path('scheduler.sqlite3')
+        self.vault = vault or Vault()
+        self.backend_factory = backend_factory or self._default_backend
+        self.client_pool = client_pool or GmailClientPool()
+        self.clock = clock
+        self.worker_id = uuid.uuid4().hex
+        self._backends = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        for table, columns in MIGRATIONS.items():
+            existing = {row[1] for row in self._conn.execute(f'PRAGMA table_info({table})')}
+            for column, definition in columns:
+                if column not in existing:
+                    self._conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        self._encrypt_plaintext()
+        self._conn.commit()
+
+    # Las versiones anteriores guardaban credenciales y opciones en claro (JSON): se cifran al abrir
+    def _encrypt_plaintext(self):
+        for table, column, key in (('accounts', 'credentials', 'account'), ('campaigns', 'options', 'campaign_id')):
+            rows = self._conn.execute(
+                f"SELECT {key}, {column} FROM {table} WHERE {column} LIKE '{{%'"
+            ).fetchall()
+            self._conn.executemany(
+                f'UPDATE {table} SET {column} = ? WHERE {key} = ?',
+                [(self.vault.encrypt(value), row_key) for row_key, value in rows]
+            )
+
+    # Guardar las credenciales de la cuenta para enviar sin la sesión abierta
+    def save_account(self, account, credentials_json):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO accounts (account, credentials, updated_at) VALUES (?, ?, ?)',
+                (account, self.vault.encrypt(credentials_json), self.clock())
+            )
+            self._conn.commit()
+
+    def account_credentials(self, account):
+        with self._lock:
+            row = self._conn.execute('SELECT credentials FROM accounts WHERE account = ?', (account,)).fetchone()
+        return self.vault.decrypt(row[0]) if row else None
+
+    # Programar una campaña. `rows` es un iterable de (destinatario, asunto, cuerpo)
+    # ya personalizados; se guardan en la cola por tandas sin cargarlos todos en memoria.
+    # Con `prestage` (solo Gmail) los mensajes se suben como borradores antes de
+    # la hora de inicio y a esa hora solo se envían por id (drafts.send).
+    def schedule(self, name, backend, account, rows, send_at=None, window=None, daily_limit=DEFAULT_DAILY_LIMIT,
+                 attachments=None, options=None, prestage=False):
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend desconocido: {backend}")
+        if prestage and backend != 'gmail':
+            raise ValueError("Solo las campañas de Gmail se pueden preparar como borradores")
+        campaign_id = uuid.uuid4().hex[:16]
+        window_start, window_end = window or (None, None)
+        refs = store_attachments(attachments)
+        rows = iter(rows)
+        total = 0
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO campaigns (campaign_id, name, backend, account, send_at, window_start, window_end, '
+                'daily_limit, attachments, options, prestage, status, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (campaign_id, name, backend, account, send_at or self.clock(), window_start, window_end,
+                 daily_limit, json.dumps(refs), self.vault.encrypt(json.dumps(options or {})), int(bool(prestage)), 'loading',
+                 self.clock())
+            )
+            while True:
+                chunk = [(campaign_id, total + i, to, subject, body)
+                         for i, (to, subject, body) in enumerate(itertools.islice(rows, 5000))]
+                if not chunk:
+                    break
+                self._conn.executemany(
+                    'INSERT INTO queue (campaign_id, seq, recipient, subject, body) VALUES (?, ?, ?, ?, ?)', chunk
+                )
+                total += len(chunk)
+            self._conn.execute("UPDATE campaigns SET status = 'scheduled' WHERE campaign_id = ?", (campaign_id,))
+            self._conn.commit()
+        self._wake.set()
+        return campaign_id, total
+
+    def set_status(self, campaign_id, status):
+        with self._lock:
+            self._conn.execute('UPDATE campaigns SET status = ? WHERE campaign_id = ?', (status, campaign_id))
+            self._conn.commit()
+
+    def pause(self, campaign_id):
+        self.set_status(campaign_id, 'paused')
+
+    def resume(self, campaign_id):
+        self.set_status(campaign_id, 'scheduled')
+        self._wake.set()
+
+    def cancel(self, campaign_id):
+        self.set_status(campaign_id, 'cancelled')
+
+    # Campañas (de una cuenta o todas) con su avance, de la más reciente a la más antigua
+    def campaigns(self, account=None):
+        query = (
+            'SELECT c.campaign_id, c.name, c.backend, c.account, c.send_at, c.window_start, c.window_end, '
+            'c.daily_limit, c.prestage, c.status, c.detail, '
+            "SUM(q.status = 'sent'), SUM(q.status = 'error'), COUNT(q.seq), "
+            "SUM(q.draft_id <> '' AND q.status IN ('pending', 'sending', 'retry')) "
+            'FROM campaigns c LEFT JOIN queue q USING (campaign_id)'
+        )
+        params = ()
+        if account is not None:
+            query += ' WHERE c.account = ?'
+            params = (account,)
+        query += ' GROUP BY c.campaign_id ORDER BY c.created_at DESC'
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        keys = ['campaign_id', 'name', 'backend', 'account', 'send_at', 'window_start', 'window_end',
+                'daily_limit', 'prestage', 'status', 'detail', 'sent', 'errors', 'total', 'staged']
+        return [dict(zip(keys, row)) for row in rows]
+
+    # Enviados por la cuenta desde `since` (todas sus campañas cuentan para el límite)
+    def sent_since(self, account, since):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM queue q JOIN campaigns c USING (campaign_id) "
+                "WHERE c.account = ? AND q.status = 'sent' AND q.sent_at > ?",
+                (account, since)
+            ).fetchone()
+        return row[0]
+
+    # Cuántos mensajes puede enviar ahora la campaña: lo que queda del día
+    # (ventana móvil de 24 h) y de la hora, para repartir el envío en la ventana
+    def allowance(self, campaign, now):
+        daily_limit = campaign['daily_limit'] or DEFAULT_DAILY_LIMIT
+        hourly_limit = math.ceil(daily_limit / window_hours(campaign['window_start'], campaign['window_end']))
+        return min(
+            daily_limit - self.sent_since(campaign['account'], now - DAY),
+            hourly_limit - self.sent_since(campaign['account'], now - HOUR),
+        )
+
+    # Reservar hasta `n` filas pendientes (atómico: otro despachador no toma las mismas).
+    # Las que fallaron por un error transitorio ('retry') van al final de la campaña.
+    def _claim(self, campaign_id, n, now):
+        claim = f"{self.worker_id}:{now}"
+        with self._lock:
+            self._conn.execute(
+                "UPDATE queue SET status = 'sending', claim = ?, claimed_at = ? "
+                "WHERE campaign_id = ? AND seq IN ("
+                "SELECT seq FROM queue WHERE campaign_id = ? AND status IN ('pending', 'retry') "
+                "ORDER BY status = 'retry', seq LIMIT ?)",
+                (claim, now, campaign_id, campaign_id, n)
+            )
+            self._conn.commit()
+            return self._conn.execute(
+                "SELECT seq, recipient, subject, body, draft_id FROM queue WHERE campaign_id = ? AND claim = ? "
+                "AND status = 'sending' ORDER BY seq",
+                (campaign_id, claim)
+            ).fetchall()
+
+    # Reservar hasta `n` filas pendientes que aún no tienen borrador
+    def _claim_unstaged(self, campaign_id, n, now):
+        claim = f"{self.worker_id}:{now}"
+        with self._lock:
+            self._conn.execute(
+                "UPDATE queue SET status = 'staging', claim = ?, claimed_at = ? "
+                "WHERE campaign_id = ? AND seq IN ("
+                "SELECT seq FROM queue WHERE campaign_id = ? AND status = 'pending' AND draft_id IS NULL "
+                "ORDER BY seq LIMIT ?)",
+                (claim, now, campaign_id, campaign_id, n)
+            )
+            self._conn.commit()
+            return self._conn.execute(
+                "SELECT seq, recipient, subject, body FROM queue WHERE campaign_id = ? AND claim = ? "
+                "AND status = 'staging' ORDER BY seq",
+                (campaign_id, claim)
+            ).fetchall()
+
+    # Guardar el borrador de una fila. Si no se pudo crear queda draft_id = '':
+    # no se vuelve a intentar y a la hora se envía normalmente
+    def _record_draft(self, campaign_id, seq, draft_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE queue SET status = 'pending', claim = NULL, draft_id = ? WHERE campaign_id = ? AND seq = ?",
+                (draft_id or '', campaign_id, seq)
+            )
+            self._conn.commit()
+
+    # Un error transitorio deja la fila para reintentarla una vez al final (en su
+    # primer intento la fila aún no tiene mensaje); a la segunda queda como error
+    def _record(self, campaign_id, seq, success, msg):
+        status = 'sent' if success else 'error'
+        retry = not success and isinstance(msg, RetryLater)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE queue SET status = CASE WHEN ? AND message IS NULL THEN 'retry' ELSE ? END, "
+                'message = ?, sent_at = ? WHERE campaign_id = ? AND seq = ?',
+                (retry, status, msg, self.clock(), campaign_id, seq)
+            )
+            self._conn.commit()
+
+    # Devolver a la cola las filas reservadas por un despachador que se detuvo a medias
+    def release_stale(self, now=None):
+        now = now or self.clock()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE queue SET status = 'pending', claim = NULL "
+                "WHERE status IN ('sending', 'staging') AND claimed_at < ?",
+                (now - STALE_CLAIM_SECONDS,)
+            )
+            self._conn.commit()
+
+    def _remaining(self, campaign_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM queue WHERE campaign_id = ? AND status IN ('pending', 'staging', 'sending', 'retry')",
+                (campaign_id,)
+            ).fetchone()
+        return row[0]
+
+    def _due(self, now):
+        return [c for c in self.campaigns()
+                if c['status'] in ('scheduled', 'running') and c['send_at'] <= now]
+
+    # Backend por defecto: Gmail con las credenciales guardadas de la cuenta, o pywhatkit
+    def _default_backend(self, campaign):
+        options = campaign.get('options') or {}
+        if campaign['backend'] == 'gmail':
+            from google.oauth2.credentials import Credentials
+            info = self.account_credentials(campaign['account'])
+            if info is None:
+                raise RuntimeError(f"No hay credenciales guardadas para {campaign['account']}")
+            credentials = Credentials.from_authorized_user_info(json.loads(info))
+            attachments = precompile_attachments(load_attachments(campaign.get('attachments')))
+            return BACKENDS['gmail'](credentials, attachments, client_pool=self.client_pool, workers=DRAFT_WORKERS)
+        return BACKENDS[campaign['backend']](**options)
+
+    def _backend(self, campaign):
+        backend = self._backends.get(campaign['campaign_id'])
+        if backend is None:
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT attachments, options FROM campaigns WHERE campaign_id = ?', (campaign['campaign_id'],)
+                ).fetchone()
+            campaign = dict(campaign, attachments=json.loads(row[0] or '[]'), options=json.loads(self.vault.decrypt(row[1]) if row[1] else '{}'))
+            backend = self.backend_factory(campaign)
+            self._backends[campaign['campaign_id']] = backend
+        return backend
+
+    def _finish(self, campaign_id, status, detail=None):
+        backend = self._backends.pop(campaign_id, None)
+        if backend is not None:
+            backend.close()
+        with self._lock:
+            self._conn.execute(
+                'UPDATE campaigns SET status = ?, detail = ? WHERE campaign_id = ?', (status, detail, campaign_id)
+            )
+            self._conn.commit()
+
+    # Preparar como borradores las filas de las campañas que aún no empiezan
+    # (subir los mensajes grandes queda fuera de la ventana de envío). Una fila
+    # cuyo borrador no se pudo crear se envía normalmente a la hora.
+    # Devuelve cuántos borradores se crearon.
+    def stage_pending(self, now=None):
+        now = now or self.clock()
+        staged = 0
+        for campaign in self.campaigns():
+            if not campaign['prestage'] or campaign['status'] != 'scheduled' or campaign['send_at'] <= now:
+                continue
+            rows = self._claim_unstaged(campaign['campaign_id'], STAGE_SIZE, now)
+            if not rows:
+                continue
+            try:
+                backend = self._backend(campaign)
+            except Exception as e:
+                self._release(campaign['campaign_id'], [r[0] for r in rows])
+                self._finish(campaign['campaign_id'], 'failed', f"{e}\n{traceback.format_exc()}")
+                continue
+            for seq, success, draft_id in backend.stage_many(rows):
+                self._record_draft(campaign['campaign_id'], seq, draft_id if success else None)
+                staged += bool(success)
+        return staged
+
+    # Borrar los borradores que quedaron sin enviar en campañas canceladas
+    def discard_drafts(self):
+        discarded = 0
+        for campaign in self.campaigns():
+            if campaign['status'] != 'cancelled' or not campaign['staged']:
+                continue
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT seq, draft_id FROM queue WHERE campaign_id = ? AND draft_id <> '' "
+                    "AND status IN ('pending', 'sending', 'retry') LIMIT ?",
+                    (campaign['campaign_id'], STAGE_SIZE)
+                ).fetchall()
+            try:
+                backend = self._backend(campaign)
+            except Exception:
+                # Sin credenciales no se pueden borrar: quedan en la carpeta de borradores de la cuenta
+                traceback.print_exc()
+                backend = None
+            for seq, draft_id in rows:
+                if backend is not None:
+                    backend.discard_draft(draft_id)
+                with self._lock:
+                    self._conn.execute(
+                        'UPDATE queue SET draft_id = NULL WHERE campaign_id = ? AND seq = ?',
+                        (campaign['campaign_id'], seq)
+                    )
+                    self._conn.commit()
+                discarded += 1
+            if len(rows) >= campaign['staged']:
+                self._finish(campaign['campaign_id'], 'cancelled')
+        return discarded
+
+    # Una vuelta del despachador: envía lo que toca ahora de cada campaña vencida
+    # (los borradores ya preparados, solo por id). Devuelve cuántos mensajes se intentaron.
+    def run_pending(self, now=None):
+        now = now or self.clock()
+        attempted = 0
+        for campaign in self._due(now):
+            if not in_window(now, campaign['window_start'], campaign['window_end']):
+                continue
+            allowance = self.allowance(campaign, now)
+            if allowance <= 0:
+                continue
+            rows = self._claim(campaign['campaign_id'], min(allowance, CLAIM_SIZE), now)
+            if not rows:
+                if self._remaining(campaign['campaign_id']) == 0:
+                    self._finish(campaign['campaign_id'], 'done')
+                continue
+            if campaign['status'] == 'scheduled':
+                self.set_status(campaign['campaign_id'], 'running')
+            try:
+                backend = self._backend(campaign)
+            except Exception as e:
+                self._release(campaign['campaign_id'], [r[0] for r in rows])
+                self._finish(campaign['campaign_id'], 'failed', f"{e}\n{traceback.format_exc()}")
+                continue
+            drafts = [(seq, to, subject, draft_id) for seq, to, subject, _, draft_id in rows if draft_id]
+            messages = [(seq, to, subject, body) for seq, to, subject, body, draft_id in rows if not draft_id]
+            results = itertools.chain(
+                backend.send_drafts(drafts) if drafts else (),
+                backend.deliver_many(messages)
+            )
+            for seq, success, msg in results:
+                self._record(campaign['campaign_id'], seq, success, msg)
+                attempted += 1
+            if self._remaining(campaign['campaign_id']) == 0:
+                self._finish(campaign['campaign_id'], 'done')
+        return attempted
+
+    def _release(self, campaign_id, seqs):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE queue SET status = 'pending', claim = NULL WHERE campaign_id = ? AND seq = ?",
+                [(campaign_id, seq) for seq in seqs]
+            )
+            self._conn.commit()
+
+    # Hilo despachador en segundo plano (uno por proceso)
+    def start(self, poll_seconds=POLL_SECONDS):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.release_stale()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.serve_forever, args=(poll_seconds,), name='scheduler', daemon=True
+        )
+        self._thread.start()
+
+    def serve_forever(self, poll_seconds=POLL_SECONDS):
+        while not self._stop.is_set():
+            try:
+                # Si hubo envíos (o borradores creados), revisar de inmediato por si queda cupo
+                if self.run_pending() + self.stage_pending() + self.discard_drafts():
+                    continue
+            except Exception:
+                traceback.print_exc()
+            # Una campaña nueva (o reanudada) despierta al despachador antes de tiempo
+            self._wake.wait(poll_seconds)
+            self._wake.clear()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._conn.close()
+
+
+# Despachador independiente de Streamlit: `python -m correo.scheduler`
+if __name__ == '__main__':
+    scheduler = Scheduler()
+    scheduler.release_stale()
+    print(f"Despachando campañas programadas desde {scheduler.path} (Ctrl+C para salir)")
+    try:
+        scheduler.serve_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
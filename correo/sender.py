@@ -0,0 +1,103 @@
+import itertools
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from correo.clients import build_gmail_service, refresh_if_needed
+from correo.gmail import send_message
+from correo.metrics import NO_METRICS
+from correo.ratelimit import gmail_limiter
+from correo.retry import call_with_retry, failure_message
+
+
+# Motor de envío concurrente: un pool de hilos donde cada hilo tiene su propio
+# cliente de Gmail (los clientes de build() no son thread-safe) y todos comparten
+# un limitador de cuota. Cada resultado sigue el contrato de send_email():
+# produce tuplas (clave, success, msg) conforme se completan los envíos.
+# Con `client_pool` (GmailClientPool) los clientes se toman prestados y se devuelven al terminar.
+# Con `metrics` (SendMetrics) se mide cada etapa y se cuentan los reintentos.
+class ConcurrentSender:
+    def __init__(self, credentials, workers=4, limiter=None, max_retries=5, client_pool=None, metrics=NO_METRICS):
+        self.credentials = credentials
+        self.workers = max(1, int(workers))
+        self.limiter = limiter or gmail_limiter()
+        self.max_retries = max_retries
+        self.client_pool = client_pool
+        self.metrics = metrics
+        self._local = threading.local()
+        self._leased = []
+        self._leased_lock = threading.Lock()
+
+    def _service(self):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            if self.client_pool is not None:
+                service = self.client_pool.acquire(self.credentials)
+                with self._leased_lock:
+                    self._leased.append(service)
+            else:
+                service = build_gmail_service(self.credentials)
+            self._local.service = service
+        return service
+
+    def _release_services(self):
+        with self._leased_lock:
+            leased, self._leased = self._leased, []
+        for service in leased:
+            self.client_pool.release(self.credentials, service)
+
+    def _call(self, to, subject, body, attachments):
+        # Renovar el token antes de que caduque en mitad de la campaña
+        refresh_if_needed(self.credentials)
+        return send_message(self._service(), to, subject, body, attachments, self.metrics)
+
+    def _send_one(self, to, subject, body, attachments):
+        try:
+            sent = call_with_retry(
+                lambda: self._call(to, subject, body, attachments),
+                self.limiter, max_retries=self.max_retries, metrics=self.metrics
+            )
+        except Exception as e:
+            return False, failure_message(e)
+        return True, f"Mensaje enviado! ID: {sent['id']}"
+
+    # items: iterable de tuplas (clave, destinatario, asunto, cuerpo)
+    # Si se deja de consumir el generador, los envíos pendientes se descartan
+    # sin llegar a la API (y no se reportan los que estaban en vuelo: para
+    # cancelar, quien lo usa deja de dar items y lo consume hasta el final).
+    # Los items se consumen de forma perezosa: solo hay unos pocos envíos en vuelo
+    # por hilo, así que `items` puede ser un generador de millones de filas.
+    def send(self, items, attachments=None):
+        try:
+            yield from bounded_sends(
+                lambda to, subject, body: self._send_one(to, subject, body, attachments),
+                items, self.workers, thread_name_prefix='gmail-send'
+            )
+        finally:
+            self._release_services()
+
+
+# Ejecutar send_one(destinatario, asunto, cuerpo) -> (success, msg) en un pool de
+# hilos con a lo sumo `workers * 4` envíos en vuelo. items: iterable de tuplas
+# (clave, destinatario, asunto, cuerpo); produce (clave, success, msg) conforme
+# terminan. Al cerrar el generador se descartan los envíos que no empezaron.
+def bounded_sends(send_one, items, workers, thread_name_prefix='send'):
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix)
+    items = iter(items)
+    pending = {}
+
+    def fill():
+        for key, to, subject, body in itertools.islice(items, workers * 4 - len(pending)):
+            pending[pool.submit(send_one, to, subject, body)] = key
+
+    try:
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                success, msg = future.result()
+                yield key, success, msg
+            fill()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
@@ -0,0 +1,244 @@
+import base64
+import json
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from correo.attachments import INLINE_LIMIT, PrecompiledAttachments
+from correo.gmail import build_mime_bytes
+from correo.metrics import NO_METRICS
+from correo.paths import data_path
+
+# Cabecera del archivo de mensajes (formato y versión)
+MAGIC = b'CORREO-SPOOL 1\n'
+# Filas del índice que se insertan de una vez al compilar
+INDEX_BATCH = 1000
+
+_compile_locks = {}
+_compile_locks_guard = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    subject TEXT,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+"""
+
+
+# Spool de una campaña en la carpeta de datos (uno por campaña)
+def spool_path(campaign_id):
+    return data_path('spool', f'{campaign_id}.spool')
+
+
+def index_path(path):
+    return path + '.sqlite3'
+
+
+# ¿Hay un spool completo en `path`? (el índice se escribe al final de la compilación)
+def spool_exists(path):
+    return os.path.exists(path) and os.path.exists(index_path(path))
+
+
+# Candado de un spool: una sola compilación a la vez por ruta dentro del proceso
+# (quien lo toma vuelve a revisar spool_exists, porque otro pudo terminarlo antes)
+def compile_lock(path):
+    with _compile_locks_guard:
+        return _compile_locks.setdefault(os.path.abspath(path), threading.RLock())
+
+
+def remove_spool(path):
+    for name in (path, index_path(path)):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+# Cuerpo de un correo ya compilado: no lleva el texto, solo dónde está su
+# mensaje dentro del spool (la cola de envío y los reintentos lo pasan tal cual)
+class SpooledBody(str):
+    def __new__(cls, offset, length):
+        self = super().__new__(cls, '')
+        self.offset = offset
+        self.length = length
+        return self
+
+
+# Compilar una campaña: arma el mensaje de cada destinatario UNA SOLA VEZ y lo
+# guarda en un archivo en disco, con un índice SQLite de posiciones. El bloque
+# de adjuntos comunes se guarda una sola vez al principio; cada registro es la
+# parte propia del destinatario (cabeceras, cuerpo y sus documentos), abierta
+# hacia ese bloque como en PrecompiledAttachments. La memoria no crece con el
+# número de destinatarios. `items` son (clave, destinatario, asunto, cuerpo).
+# Con `job`, se miden los tiempos en sus métricas y se guarda cuántas filas
+# rechazó la validación; si el trabajo se cancela, no queda spool (devuelve None).
+# Se escribe en archivos temporales propios y se publica con el candado del spool.
+def compile_spool(path, items, attachments=None, job=None, name=''):
+    with compile_lock(path):
+        return _compile_spool(path, items, attachments, job, name)
+
+
+def _temp_file(path):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    return tmp
+
+
+def _compile_spool(path, items, attachments, job, name):
+    metrics = job.metrics if job is not None else NO_METRICS
+    if attachments and not isinstance(attachments, PrecompiledAttachments):
+        attachments = PrecompiledAttachments(attachments)
+    tmp_path = _temp_file(path)
+    tmp_index = _temp_file(index_path(path))
+    done = False
+    conn = sqlite3.connect(tmp_index)
+    try:
+        conn.executescript(SCHEMA)
+        count = 0
+        rows = []
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            block = attachments.block if attachments is not None else b''
+            block_offset = f.tell()
+            f.write(block)
+            for key, to, subject, body in items:
+                if job is not None and job.cancelled:
+                    return None
+                with metrics.timer('mime'):
+                    head = build_mime_bytes(to, subject, body, attachments)
+                rows.append((json.dumps(key, default=int), to, subject, f.tell(), len(head)))
+                f.write(head)
+                count += 1
+                if len(rows) >= INDEX_BATCH:
+                    conn.executemany(
+                        'INSERT INTO messages (key, recipient, subject, offset, length) VALUES (?, ?, ?, ?, ?)', rows
+                    )
+                    rows = []
+            if rows:
+                conn.executemany(
+                    'INSERT INTO messages (key, recipient, subject, offset, length) VALUES (?, ?, ?, ?, ?)', rows
+                )
+        meta = {
+            'name': name,
+            'count': count,
+            'rejected': job.rechazados if job is not None else 0,
+            'attachments': json.dumps(attachments.names if attachments is not None else []),
+            'block_offset': block_offset,
+            'block_length': len(block),
+            'created_at': time.time(),
+        }
+        conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', meta.items())
+        conn.commit()
+        done = True
+    finally:
+        conn.close()
+        if not done:
+            for tmp in (tmp_path, tmp_index):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+    # El índice se publica al final: un spool a medias nunca se usa
+    os.replace(tmp_path, path)
+    os.replace(tmp_index, index_path(path))
+    return CampaignSpool(path)
+
+
+# Spool abierto para enviar: los mensajes se leen del archivo mapeado en
+# memoria (mmap), sin volver a personalizar ni a armar MIME. Se usa en lugar
+# de los adjuntos precompilados (mismo contrato: head/encode/open_stream), con
+# los items de items(); así funciona con todos los modos de envío.
+class CampaignSpool(PrecompiledAttachments):
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} no es un spool de campaña")
+        conn = sqlite3.connect(index_path(path))
+        try:
+            meta = dict(conn.execute('SELECT key, value FROM meta'))
+        finally:
+            conn.close()
+        self.name = meta['name']
+        self.count = meta['count']
+        self.rejected = meta['rejected']
+        self.names = json.loads(meta['attachments'])
+        self.created_at = meta['created_at']
+        start = meta['block_offset']
+        self.size = meta['block_length']
+        # El bloque común se lee en su sitio (sin copiarlo) al subir mensajes grandes
+        self.block = memoryview(self._map)[start:start + self.size]
+        self.upload = self.size > INLINE_LIMIT
+        self.encoded = None if self.upload else base64.urlsafe_b64encode(self.block).decode()
+
+    def __len__(self):
+        return len(self.names)
+
+    # Parte propia del destinatario, tal como quedó al compilar
+    def head(self, to, subject, body):
+        return self._map[body.offset:body.offset + body.length]
+
+    def message_size(self, to, subject, body):
+        return body.length + self.size
+
+    # Correos del spool en orden: (clave, destinatario, asunto, SpooledBody).
+    # `skip(clave)` descarta los que ya se enviaron (p. ej. al reanudar).
+    def items(self, skip=None, job=None):
+        conn = sqlite3.connect(index_path(self.path))
+        try:
+            for key, to, subject, offset, length in conn.execute(
+                'SELECT key, recipient, subject, offset, length FROM messages ORDER BY seq'
+            ):
+                key = json.loads(key)
+                key = tuple(key) if isinstance(key, list) else key
+                if skip is not None and skip(key):
+                    if job is not None:
+                        job.add_skipped()
+                    continue
+                yield key, to, subject, SpooledBody(offset, length)
+        finally:
+            conn.close()
+
+    # Mensaje completo (RFC 822) de la posición `seq` para revisarlo: (clave, destinatario, bytes)
+    def message(self, seq):
+        conn = sqlite3.connect(index_path(self.path))
+        try:
+            row = conn.execute(
+                'SELECT key, recipient, offset, length FROM messages WHERE seq = ?', (seq + 1,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise IndexError(seq)
+        key, to, offset, length = row
+        return json.loads(key), to, self._map[offset:offset + length] + self.block.tobytes()
+
+    def summary(self):
+        return {
+            'name': self.name,
+            'messages': self.count,
+            'rejected': self.rejected,
+            'attachments': self.names,
+            'bytes': os.path.getsize(self.path),
+            'created_at': self.created_at,
+        }
+
+    def close(self):
+        block = getattr(self, 'block', None)
+        if block is not None:
+            block.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # Un flujo de subida aún usa el bloque: el mapa se libera cuando lo suelte
+            pass
+        self._file.close()
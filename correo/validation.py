@@ -0,0 +1,153 @@
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from correo.paths import data_path
+
+# Sintaxis de correo razonable (parte local RFC 5322 sin comillas + dominio con punto)
+EMAIL_RE = (
+    r"^[a-z0-9.!#$%&'*+/=?^_`{|}~-]+"
+    r"@[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?(?:\.[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?)+$"
+)
+# Lada de México: los números se guardan sin el prefijo 52
+COUNTRY_CODE = '52'
+PHONE_DIGITS = 10
+
+# Motivos de rechazo que se muestran en la tabla
+REASON_EMPTY = 'vacío'
+REASON_INVALID = 'formato inválido'
+REASON_DUPLICATE = 'duplicado'
+REASON_SUPPRESSED = 'en lista de supresión'
+
+# Máximo de filas rechazadas que se guardan para el reporte (se cuentan todas)
+MAX_REPORTED = 5000
+
+
+# Texto limpio de una columna: NaN, None y "nan" cuentan como vacío
+def _clean(series):
+    text = series.astype(object).where(series.notna(), '').astype(str).str.strip()
+    return text.where(~text.str.lower().isin(['nan', 'none']), '')
+
+
+# Correos normalizados: sin espacios y en minúsculas
+def normalize_emails(series):
+    return _clean(series).str.lower()
+
+
+# Teléfonos normalizados: solo dígitos, sin ".0" de Excel ni el prefijo del país
+def normalize_phones(series):
+    digits = _clean(series).str.replace(r'\.0$', '', regex=True).str.replace(r'\D', '', regex=True)
+    with_code = (digits.str.len() == PHONE_DIGITS + len(COUNTRY_CODE)) & digits.str.startswith(COUNTRY_CODE)
+    return digits.where(~with_code, digits.str[len(COUNTRY_CODE):])
+
+
+# Índice de validación de contactos: recorre los lotes en orden y decide, de forma
+# vectorizada, qué filas se envían. Guarda un set con los contactos ya vistos para
+# detectar duplicados entre lotes en O(1) por fila.
+class ContactValidator:
+    def __init__(self, kind='email', suppressed=None):
+        if kind not in ('email', 'phone'):
+            raise ValueError("kind debe ser 'email' o 'phone'")
+        self.kind = kind
+        self.suppressed = set(suppressed or ())
+        self.seen = set()
+        self.valid = 0
+        self.rejected = 0
+        self.rejected_by_reason = {}
+        self.report = []
+
+    # Devuelve (contacto normalizado, motivo de rechazo o '') para las filas de un lote
+    def check(self, values):
+        if self.kind == 'email':
+            normalized = normalize_emails(values)
+            syntax_ok = normalized.str.match(EMAIL_RE)
+        else:
+            normalized = normalize_phones(values)
+            syntax_ok = normalized.str.len() == PHONE_DIGITS
+
+        reasons = pd.Series('', index=values.index, dtype=object)
+        empty = normalized == ''
+        reasons[~syntax_ok] = REASON_INVALID
+        reasons[empty] = REASON_EMPTY
+        ok = reasons == ''
+        if self.suppressed:
+            suppressed = ok & normalized.isin(self.suppressed)
+            reasons[suppressed] = REASON_SUPPRESSED
+            ok &= ~suppressed
+        duplicate = ok & (normalized.duplicated() | normalized.isin(self.seen))
+        reasons[duplicate] = REASON_DUPLICATE
+        ok &= ~duplicate
+
+        self.seen.update(normalized[ok])
+        self.valid += int(ok.sum())
+        bad = reasons[~ok]
+        self.rejected += len(bad)
+        for reason, count in bad.value_counts().items():
+            self.rejected_by_reason[reason] = self.rejected_by_reason.get(reason, 0) + int(count)
+        if len(self.report) < MAX_REPORTED:
+            for idx in bad.index[:MAX_REPORTED - len(self.report)]:
+                self.report.append({'Fila': idx + 2, 'Contacto': values[idx], 'Motivo': reasons[idx]})
+        return normalized, reasons
+
+    # Tabla de filas rechazadas (número de fila como en Excel, con encabezado en la fila 1)
+    def report_frame(self):
+        return pd.DataFrame(self.report, columns=['Fila', 'Contacto', 'Motivo'])
+
+    def summary(self):
+        return {
+            'valid': self.valid,
+            'rejected': self.rejected,
+            'by_reason': dict(self.rejected_by_reason),
+        }
+
+
+# Lista de supresión persistente (rebotes, bajas): direcciones o teléfonos que nunca se contactan
+class SuppressionList:
+    def __init__(self, path=None):
+        self.path = path or data_path('suppression.sqlite3')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS suppressed ('
+            'contact TEXT PRIMARY KEY, kind TEXT, reason TEXT, added_at REAL)'
+        )
+        self._conn.commit()
+
+    def add(self, contacts, kind='email', reason=''):
+        series = pd.Series(list(contacts), dtype=object)
+        normalized = normalize_emails(series) if kind == 'email' else normalize_phones(series)
+        rows = [(c, kind, reason, time.time()) for c in normalized.unique() if c]
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO suppressed VALUES (?, ?, ?, ?)', rows)
+            self._conn.commit()
+        return len(rows)
+
+    def remove(self, contacts):
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM suppressed WHERE contact = ?',
+                [(str(c).strip().lower(),) for c in contacts]
+            )
+            self._conn.commit()
+
+    def contacts(self, kind='email'):
+        with self._lock:
+            rows = self._conn.execute('SELECT contact FROM suppressed WHERE kind = ?', (kind,)).fetchall()
+        return {r[0] for r in rows}
+
+    def frame(self):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT contact, kind, reason, added_at FROM suppressed ORDER BY added_at DESC'
+            ).fetchall()
+        df = pd.DataFrame(rows, columns=['Contacto', 'Tipo', 'Motivo', 'Agregado'])
+        df['Agregado'] = pd.to_datetime(df['Agregado'], unit='s')
+        return df
+
+    # Cambia cada vez que se modifica la lista (sirve de clave de caché)
+    def version(self):
+        with self._lock:
+            row = self._conn.execute('SELECT COUNT(*), MAX(added_at) FROM suppressed').fetchone()
+        return f"{row[0]}:{row[1]}"
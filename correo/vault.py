@@ -0,0 +1,42 @@
+import os
+
+from cryptography.fernet import Fernet
+
+# Clave para cifrar las credenciales guardadas (Fernet, base64). Si no se
+# configura, se genera una vez fuera de la carpeta de datos compartida.
+KEY_ENV = 'CORREO_SECRET_KEY'
+KEY_FILE = os.environ.get(
+    'CORREO_KEY_FILE', os.path.join(os.path.expanduser('~'), '.config', 'correo', 'credentials.key')
+)
+
+
+def load_key(path=KEY_FILE):
+    key = os.environ.get(KEY_ENV)
+    if key:
+        return key.encode()
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read().strip()
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    key = Fernet.generate_key()
+    # Solo el usuario del servidor puede leerla; si otro proceso la creó antes, se usa esa
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return load_key(path)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+# Cifrar y descifrar texto (tokens de OAuth, claves de cuentas de servicio)
+# antes de guardarlo en SQLite
+class Vault:
+    def __init__(self, key=None):
+        self._fernet = Fernet(key or load_key())
+
+    def encrypt(self, text):
+        return self._fernet.encrypt(text.encode('utf-8')).decode('ascii')
+
+    def decrypt(self, token):
+        return self._fernet.decrypt(token.encode('ascii')).decode('utf-8')
@@ -0,0 +1,141 @@
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from correo.backends import WHATSAPP_RATE
+
+# Ruta de envío de la Cloud API: /<versión>/<id del número>/messages
+MESSAGES_PATH = re.compile(r'^/v[\d.]+/[^/]+/messages$')
+
+
+# Servidor local que imita el endpoint de mensajes de la API de WhatsApp para
+# medir el envío sin conexión: latencia fija, errores 500 aleatorios y 429 con
+# Retry-After cuando se supera `rate` mensajes por segundo.
+class MockWhatsAppServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.05, rate=WHATSAPP_RATE, error_rate=0.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.rate = rate
+        self.error_rate = error_rate
+        self.received = 0
+        self.accepted = 0
+        self.throttled = 0
+        self.failed = 0
+        self._ids = itertools.count(1)
+        self._window = (0, 0)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # ¿Cabe un mensaje más en el segundo actual?
+    def _admit(self):
+        second = int(time.monotonic())
+        with self._lock:
+            self.received += 1
+            start, count = self._window
+            if start != second:
+                start, count = second, 0
+            if self.rate and count >= self.rate:
+                self.throttled += 1
+                return False
+            self._window = (start, count + 1)
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'received': self.received,
+                'accepted': self.accepted,
+                'throttled': self.throttled,
+                'failed': self.failed,
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Cabeceras y cuerpo salen en escrituras separadas: sin esto Nagle añade ~40 ms por respuesta
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, code, headers=None):
+        self._reply(status, {'error': {'message': message, 'type': 'OAuthException', 'code': code}}, headers)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length)
+        if not MESSAGES_PATH.match(self.path):
+            return self._error(404, 'Unknown path', 100)
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self._error(401, 'Missing access token', 190)
+        try:
+            payload = json.loads(raw or b'{}')
+            to = payload['to']
+            text = payload['text']['body']
+        except (ValueError, KeyError, TypeError):
+            return self._error(400, 'Invalid parameter', 100)
+        if not text:
+            return self._error(400, 'Message text is empty', 100)
+        if not server._admit():
+            return self._error(429, 'Rate limit hit', 130429, {'Retry-After': '1'})
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            with server._lock:
+                server.failed += 1
+            return self._error(500, 'Internal server error', 1)
+        with server._lock:
+            server.accepted += 1
+            message_id = f"wamid.MOCK{next(server._ids):012d}"
+        self._reply(200, {
+            'messaging_product': 'whatsapp',
+            'contacts': [{'input': to, 'wa_id': to}],
+            'messages': [{'id': message_id, 'message_status': 'accepted'}],
+        })
+
+
+# Arrancar el servidor de prueba en un hilo (puerto libre si port=0)
+def start_mock_server(host='127.0.0.1', port=0, latency=0.05, rate=WHATSAPP_RATE, error_rate=0.0):
+    server = MockWhatsAppServer((host, port), latency=latency, rate=rate, error_rate=error_rate)
+    thread = threading.Thread(target=server.serve_forever, name='wa-mock', daemon=True)
+    thread.start()
+    return server
+
+
+# Servidor de prueba independiente: `python -m correo.wa_mock --port 8089`
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de mensajes de WhatsApp")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.05, help="segundos por petición")
+    parser.add_argument('--rate', type=int, default=WHATSAPP_RATE, help="mensajes por segundo antes de responder 429")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fracción de peticiones que fallan con 500")
+    args = parser.parse_args()
+    server = MockWhatsAppServer((args.host, args.port), args.latency, args.rate, args.error_rate)
+    print(f"API de WhatsApp de prueba en {server.url} (Ctrl+C para salir)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
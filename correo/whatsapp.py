@@ -0,0 +1,62 @@
+import html
+import urllib.parse
+
+import pandas as pd
+
+from correo.render import render_template, template_columns
+from correo.validation import COUNTRY_CODE
+
+WA_BASE_URL = 'https://wa.me/'
+
+
+# Tabla de enlaces wa.me de todos los contactos en una sola pasada por columnas:
+# Nombre, Celular, Mensaje y Enlace (listo para abrir WhatsApp con el texto)
+def wa_links(df, template):
+    cols = template_columns(df)
+    mensajes = render_template(df, template)
+    celulares = cols['Celular'].astype(str)
+    enlaces = (
+        WA_BASE_URL + COUNTRY_CODE + celulares
+        + '?text=' + mensajes.map(lambda texto: urllib.parse.quote(texto, safe=''))
+    )
+    return pd.DataFrame({
+        'Nombre': cols['Nombre'].astype(str),
+        'Celular': celulares,
+        'Mensaje': mensajes,
+        'Enlace': enlaces,
+    })
+
+
+# Filtrar la tabla por nombre o celular (sin distinguir mayúsculas)
+def search_links(links, query):
+    query = (query or '').strip()
+    if not query:
+        return links
+    mask = (
+        links['Nombre'].str.contains(query, case=False, regex=False)
+        | links['Celular'].str.contains(query, regex=False)
+    )
+    return links[mask]
+
+
+# Página `page` (desde 0) de la tabla
+def links_page(links, page, page_size):
+    start = page * page_size
+    return links.iloc[start:start + page_size]
+
+
+# Página HTML independiente con un botón por contacto, para abrirla fuera de la app
+def links_html(links, title='Enlaces de WhatsApp'):
+    filas = ''.join(
+        f'<tr><td>{html.escape(nombre)}</td><td>+{COUNTRY_CODE}{html.escape(celular)}</td>'
+        f'<td><a class="wa" href="{html.escape(enlace)}" target="_blank">📲 Enviar WhatsApp</a></td></tr>\n'
+        for nombre, celular, enlace in zip(links['Nombre'], links['Celular'], links['Enlace'])
+    )
+    return (
+        '<!DOCTYPE html>\n<html lang="es"><head><meta charset="utf-8">'
+        f'<title>{html.escape(title)}</title>'
+        '<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse}'
+        'td{padding:6px 12px;border-bottom:1px solid #ddd}'
+        'a.wa{background:#25D366;color:#fff;padding:6px 12px;border-radius:6px;text-decoration:none}</style>'
+        f'</head><body><h1>{html.escape(title)}</h1><table>\n{filas}</table></body></html>\n'
+    )
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from correo.backends import DeliveryBackend
+from correo.campaign import backend_results
+from correo.jobs import JobRunner
+from correo.sender import bounded_sends
+
+
+# Backend lento y concurrente que cuenta los mensajes que de verdad salieron
+class SlowBackend(DeliveryBackend):
+    def __init__(self, workers=4, delay=0.05):
+        self.workers = workers
+        self.delay = delay
+        self.delivered = 0
+        self._lock = threading.Lock()
+
+    def deliver(self, to, subject, body):
+        time.sleep(self.delay)
+        with self._lock:
+            self.delivered += 1
+        return True, f"Mensaje enviado a {to}"
+
+    def deliver_many(self, items):
+        return bounded_sends(self.deliver, items, self.workers)
+
+
+def wait_finished(job, timeout=10):
+    deadline = time.time() + timeout
+    while job.active and time.time() < deadline:
+        time.sleep(0.01)
+    assert not job.active
+
+
+def test_cancel_reports_every_delivered_message():
+    backend = SlowBackend()
+    journal = []
+    first = threading.Event()
+
+    def on_result(key, success, msg):
+        journal.append(key)
+        first.set()
+
+    items = [(i, f'55{i:08d}', '', 'hola') for i in range(200)]
+    runner = JobRunner(max_jobs=1)
+    job = runner.submit('prueba', len(items), lambda job: backend_results(job, backend, items), on_result=on_result)
+    assert first.wait(5)
+    job.cancel()
+    wait_finished(job)
+
+    assert job.status == 'cancelled'
+    assert 0 < backend.delivered < len(items)
+    # Cada mensaje que salió quedó registrado (al reanudar no se vuelve a enviar)
+    assert len(journal) == backend.delivered
+    assert job.enviados == backend.delivered
+
+
+def test_finished_job_reports_all_results():
+    backend = SlowBackend(delay=0)
+    items = [(i, f'55{i:08d}', '', 'hola') for i in range(20)]
+    runner = JobRunner(max_jobs=1)
+    job = runner.submit('prueba', len(items), lambda job: backend_results(job, backend, items))
+    wait_finished(job)
+
+    assert job.status == 'done'
+    assert job.enviados == backend.delivered == len(items)